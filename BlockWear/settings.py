@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'apps.main',
     'apps.cart',
     'apps.users',
@@ -35,6 +36,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.main.middleware.RequestMetricsMiddleware',
+    'apps.main.middleware.ReplicaRoutingMiddleware',
+    'apps.main.middleware.VersionMemoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +84,26 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения (каталог и отзывы, см. apps.main.routers):
+# POSTGRES_REPLICA_HOSTS=replica1.internal,replica2.internal:5433
+# Для локальной проверки достаточно указать тот же сервер, что и у default.
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    _host, _, _port = _host.strip().partition(':')
+    DATABASES[f'replica{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{_index}')
+
+DATABASE_ROUTERS = ['apps.main.routers.ReplicaRouter']
+
+# Сколько секунд после собственной записи пользователь читает с primary
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,11 +146,33 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Общий для всех воркеров кеш: версии справочников и фасетов (apps.main.reference,
+# apps.main.facets), манифесты производных изображений, счетчик корзины.
+# Кеш в памяти процесса не годится - сброс версии увидел бы только один воркер.
+# По умолчанию - таблица в БД (создается миграцией main.0012), с REDIS_URL - Redis
+# (нужен пакет redis).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        },
+    }
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CART_SESSION_ID = 'cart'
+# Число товаров в корзине для значка в шапке (apps.cart.cart.Cart.cached_count)
+CART_COUNT_SESSION_ID = 'cart_count'
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -138,5 +184,52 @@ STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 # Currency
 STRIPE_CURRENCY = 'usd'
 
+# HTTP-клиент Stripe (apps.payments.gateway)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# Размер пула соединений и потоков для вызовов Stripe
+STRIPE_MAX_CONNECTIONS = int(os.getenv('STRIPE_MAX_CONNECTIONS', '10'))
+
+# Сколько держится резерв остатков после отправки checkout (apps.payments.reservations);
+# истекшие возвращает на склад manage.py release_reservations
+STOCK_RESERVATION_SECONDS = int(os.getenv('STOCK_RESERVATION_SECONDS', str(15 * 60)))
+
 # CSRF для webhook
-CSRF_TRUSTED_ORIGINS = ['https://your-domain.com']  # Для продакшена
\ No newline at end of file
+CSRF_TRUSTED_ORIGINS = ['https://your-domain.com']  # Для продакшена
+
+# Catalog
+CATALOG_PAGE_SIZE = 24
+# Оценка количества товаров по статистике PostgreSQL вместо COUNT(*)
+CATALOG_APPROXIMATE_COUNT = os.getenv('CATALOG_APPROXIMATE_COUNT', '') == '1'
+
+# Фото отзывов обрабатывает manage.py process_review_images (apps.main.review_uploads):
+# число процессов пула и длинная сторона сохраненного фото в пикселях
+REVIEW_IMAGE_WORKERS = int(os.getenv('REVIEW_IMAGE_WORKERS', '2'))
+REVIEW_IMAGE_MAX_SIDE = int(os.getenv('REVIEW_IMAGE_MAX_SIDE', '2000'))
+
+# Производные фото товаров и отзывов создает manage.py process_image_renditions
+# (apps.main.renditions): число процессов пула
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', '2'))
+
+# Метрики запросов (apps.main.middleware.RequestMetricsMiddleware)
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', '1') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Строка JSON на каждый запрос пишется только с REQUEST_METRICS_LOG_LEVEL=INFO,
+        # по умолчанию выключена (Server-Timing и гистограммы работают всегда)
+        'apps.main.metrics': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_METRICS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -1,3 +1,18 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Cart, CartLine
+
+
+class CartLineInline(admin.TabularInline):
+    model = CartLine
+    raw_id_fields = ['product_size']
+    extra = 0
+
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ['user', 'updated_at']
+    raw_id_fields = ['user']
+    list_select_related = ['user']
+    search_fields = ['user__email']
+    inlines = [CartLineInline]
@@ -1,87 +1,265 @@
 from decimal import Decimal
 from django.conf import settings
+from django.db import connections, router
+from django.db.models import Sum
 from apps.main.models import Product, ProductSize
+from apps.main.routers import replica_reads
+from .models import Cart as StoredCart, CartLine
+
+
+def _upsert_lines(user_id, items, increment):
+    """
+    Записать позиции корзины пользователя одним запросом:
+    корзина создается, если ее нет, размер товара находится по (product_id, size_id),
+    при конфликте количество прибавляется (increment) или заменяется.
+    items - {(product_id, size_id): (количество, цена)}. Позиции без ProductSize пропускаются.
+    """
+    connection = connections[router.db_for_write(CartLine)]
+    quote = connection.ops.quote_name
+    carts = quote(StoredCart._meta.db_table)
+    lines = quote(CartLine._meta.db_table)
+    product_sizes = quote(ProductSize._meta.db_table)
+    quantity = f'{lines}.quantity + EXCLUDED.quantity' if increment else 'EXCLUDED.quantity'
+
+    values = ', '.join(['(%s::bigint, %s::bigint, %s::integer, %s::numeric)'] * len(items))
+    sql = (
+        f'WITH touched AS ('
+        f'INSERT INTO {carts} (user_id, updated_at) VALUES (%s, now()) '
+        f'ON CONFLICT (user_id) DO UPDATE SET updated_at = EXCLUDED.updated_at) '
+        f'INSERT INTO {lines} (cart_id, product_size_id, quantity, price) '
+        f'SELECT %s, ps.id, v.quantity, v.price '
+        f'FROM (VALUES {values}) AS v (product_id, size_id, quantity, price) '
+        f'JOIN {product_sizes} ps ON ps.product_id = v.product_id AND ps.size_id = v.size_id '
+        f'ORDER BY ps.id '
+        f'ON CONFLICT (cart_id, product_size_id) DO UPDATE SET quantity = {quantity}, price = EXCLUDED.price'
+    )
+    params = [user_id, user_id]
+    for (product_id, size_id), (line_quantity, price) in sorted(items.items()):
+        params.extend([product_id, size_id, line_quantity, price])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def merge_session_cart(request, user):
+    """
+    Перенести корзину из сессии в корзину пользователя после входа - одним upsert,
+    количества одинаковых позиций складываются. Вызывается по user_logged_in.
+    """
+    items = request.session.get(settings.CART_SESSION_ID)
+    if not items:
+        return
+    _upsert_lines(user.id, {
+        (int(item['product_id']), int(item['size_id'])): (item['quantity'], Decimal(item['price']))
+        for item in items.values()
+    }, increment=True)
+    del request.session[settings.CART_SESSION_ID]
+    request.session.pop(settings.CART_COUNT_SESSION_ID, None)
+    request._cart_cache = {}
 
 
 class Cart:
+    """
+    Корзина: у гостей - dict в сессии, у вошедших пользователей - строки
+    CartLine в БД. Снаружи оба режима выглядят одинаково: cart - dict позиций
+    {"{product_id}_{size_id}": {product_id, size_id, quantity, price}}, итерация
+    отдает гидрированные позиции.
+    """
+
     def __init__(self, request):
         """
-        Инициализация корзины
+        Инициализация корзины. Сессия здесь не читается и не меняется: Cart
+        создается на каждом рендере (context processor), и пустая корзина не
+        должна заводить строку django_session для ботов и случайных посетителей.
         """
+        self.request = request
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+
+    @property
+    def user_id(self):
+        """id вошедшего пользователя; None - корзина в сессии"""
+        user = getattr(self.request, 'user', None)
+        return user.id if user is not None and user.is_authenticated else None
+
+    @property
+    def cart(self):
+        """
+        Позиции корзины. У гостя, пока в корзине ничего нет, - пустой dict,
+        который в сессию не записывается
+        """
+        if self.user_id is not None:
+            return self._load_stored()['items']
+        return self.session.get(settings.CART_SESSION_ID) or {}
 
     def add(self, product, size_id, quantity=1, update_quantity=False):
         """
         Добавить товар в корзину или обновить его количество
         """
+        if self.user_id is not None:
+            _upsert_lines(self.user_id, {(product.id, int(size_id)): (quantity, product.price)},
+                          increment=not update_quantity)
+            self._invalidate()
+            return
+
         product_id = str(product.id)
         size_id = str(size_id)
         cart_key = f"{product_id}_{size_id}"
-        
-        if cart_key not in self.cart:
-            self.cart[cart_key] = {
+        cart = self.session.setdefault(settings.CART_SESSION_ID, {})
+
+        if cart_key not in cart:
+            cart[cart_key] = {
                 'product_id': product_id,
                 'size_id': size_id,
                 'quantity': 0,
                 'price': str(product.price)
             }
-        
+
         if update_quantity:
-            self.cart[cart_key]['quantity'] = quantity
+            cart[cart_key]['quantity'] = quantity
         else:
-            self.cart[cart_key]['quantity'] += quantity
-        
+            cart[cart_key]['quantity'] += quantity
+
         self.save()
+        self._invalidate()
 
     def save(self):
         """
-        Сохранить корзину в сессии
+        Сохранить корзину в сессии. Вызывается только при изменении корзины;
+        вместе с ней обновляется число товаров для значка в шапке.
+        Опустевшая корзина удаляется из сессии целиком.
+        Корзина пользователя пишется в БД сразу, здесь делать нечего.
         """
+        if self.user_id is not None:
+            return
+        if self.cart:
+            self.session[settings.CART_COUNT_SESSION_ID] = len(self)
+        else:
+            self.session.pop(settings.CART_SESSION_ID, None)
+            self.session.pop(settings.CART_COUNT_SESSION_ID, None)
         self.session.modified = True
 
     def remove(self, product_id, size_id):
         """
         Удалить товар из корзины
         """
+        if self.user_id is not None:
+            CartLine.objects.filter(
+                cart_id=self.user_id, product_size__product_id=product_id, product_size__size_id=size_id,
+            ).delete()
+            self.save()
+            self._invalidate()
+            return
+
         cart_key = f"{product_id}_{size_id}"
         if cart_key in self.cart:
             del self.cart[cart_key]
             self.save()
+            self._invalidate()
 
-    def __iter__(self):
+    @property
+    def _cache(self):
         """
-        Перебор элементов корзины и получение товаров из БД
+        Кеш гидрированных позиций и итогов на время запроса.
+        Хранится на request, поэтому общий для всех Cart(request) в одном запросе
+        (context processor, view, шаблоны).
+        """
+        cache = getattr(self.request, '_cart_cache', None)
+        if cache is None:
+            cache = self.request._cart_cache = {}
+        return cache
+
+    def _invalidate(self):
+        self.request._cart_cache = {}
+
+    def _load_stored(self):
+        """
+        Корзина пользователя одним запросом по индексу (cart_id, product_size_id):
+        позиции вместе с товаром, категорией, размером и остатком.
+        """
+        if 'stored' in self._cache:
+            return self._cache['stored']
+
+        items = {}
+        lines = []
+        for cart_line in CartLine.objects.filter(cart_id=self.user_id).select_related(
+            'product_size__product__category', 'product_size__size',
+        ).order_by('id'):
+            product_size = cart_line.product_size
+            item = {
+                'product_id': str(product_size.product_id),
+                'size_id': str(product_size.size_id),
+                'quantity': cart_line.quantity,
+                'price': str(cart_line.price),
+            }
+            items[f"{item['product_id']}_{item['size_id']}"] = item
+            lines.append({
+                **item,
+                'product': product_size.product,
+                'size': product_size.size,
+                'stock': product_size.stock,
+                'price': cart_line.price,
+                'total_price': cart_line.price * cart_line.quantity,
+            })
+
+        stored = self._cache['stored'] = {'items': items, 'lines': lines}
+        return stored
+
+    def _get_lines(self):
         """
-        product_ids = [item['product_id'] for item in self.cart.values()]
-        products = Product.objects.filter(id__in=product_ids)
-        
-        cart = self.cart.copy()
-        
-        for item in cart.values():
+        Загрузить товары и размеры для всех позиций корзины двумя запросами
+        """
+        if self.user_id is not None:
+            return self._load_stored()['lines']
+        if 'lines' in self._cache:
+            return self._cache['lines']
+
+        product_ids = {int(item['product_id']) for item in self.cart.values()}
+        size_ids = {int(item['size_id']) for item in self.cart.values()}
+
+        # Только отображение: остатки при оформлении заказа проверяются на primary
+        with replica_reads():
+            products = Product.objects.select_related('category').in_bulk(product_ids)
+            product_sizes = {
+                (product_size.product_id, product_size.size_id): product_size
+                for product_size in ProductSize.objects.select_related('size').filter(
+                    product_id__in=product_ids,
+                    size_id__in=size_ids,
+                )
+            }
+
+        lines = []
+        for item in self.cart.values():
             product_id = int(item['product_id'])
             size_id = int(item['size_id'])
-            
-            item['product'] = products.get(id=product_id)
-            
-            # Получаем информацию о размере
-            try:
-                product_size = ProductSize.objects.select_related('size').get(
-                    product_id=product_id,
-                    size_id=size_id
-                )
-                item['size'] = product_size.size
-                item['stock'] = product_size.stock
-            except ProductSize.DoesNotExist:
-                item['size'] = None
-                item['stock'] = 0
-            
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+
+            product = products.get(product_id)
+            if product is None:
+                # Товар удален из каталога
+                continue
+
+            # Копия, чтобы объекты моделей не попали в сессию
+            line = dict(item)
+            line['product'] = product
+
+            product_size = product_sizes.get((product_id, size_id))
+            if product_size is not None:
+                line['size'] = product_size.size
+                line['stock'] = product_size.stock
+            else:
+                line['size'] = None
+                line['stock'] = 0
+
+            line['price'] = Decimal(item['price'])
+            line['total_price'] = line['price'] * item['quantity']
+            lines.append(line)
+
+        self._cache['lines'] = lines
+        return lines
+
+    def __iter__(self):
+        """
+        Перебор элементов корзины и получение товаров из БД
+        """
+        return iter(self._get_lines())
 
     def __len__(self):
         """
@@ -93,18 +271,48 @@ class Cart:
         """
         Подсчитать общую стоимость товаров в корзине
         """
-        return sum(Decimal(item['price']) * item['quantity'] 
-                   for item in self.cart.values())
+        if 'total_price' not in self._cache:
+            self._cache['total_price'] = sum(Decimal(item['price']) * item['quantity']
+                                             for item in self.cart.values())
+        return self._cache['total_price']
 
     def clear(self):
         """
         Очистить корзину
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        if self.user_id is not None:
+            CartLine.objects.filter(cart_id=self.user_id).delete()
+            self.save()
+        elif settings.CART_SESSION_ID in self.session:
+            del self.session[settings.CART_SESSION_ID]
+            self.save()
+        self._invalidate()
 
     def get_item_count(self):
         """
         Получить количество уникальных позиций в корзине
         """
-        return len(self.cart)
\ No newline at end of file
+        return len(self.cart)
+
+    def cached_count(self):
+        """
+        Число товаров для значка в шапке. У гостя лежит в сессии отдельным
+        числом (см. save), посетитель без сессии не вызывает ни одного запроса.
+        У пользователя - из строк корзины: из уже загруженных в этом запросе
+        или одной суммой по индексу (cart_id, ...). Кеша нет - счетчик всегда
+        совпадает с БД на всех устройствах и воркерах.
+        """
+        if self.user_id is not None:
+            if 'stored' in self._cache:
+                return len(self)
+            if 'count' not in self._cache:
+                self._cache['count'] = CartLine.objects.filter(cart_id=self.user_id).aggregate(
+                    total=Sum('quantity'),
+                )['total'] or 0
+            return self._cache['count']
+
+        count = self.session.get(settings.CART_COUNT_SESSION_ID)
+        if count is None and self.cart:
+            # Корзина, сохраненная до появления счетчика
+            count = len(self)
+        return count or 0
@@ -1,4 +1,7 @@
 from .cart import Cart
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    # Cart не читает сессию, пока к ней не обратились, а cart_count вызывается
+    # шаблоном только там, где выводится значок
+    cart = Cart(request)
+    return {'cart': cart, 'cart_count': cart.cached_count}
@@ -1,3 +1,36 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from apps.main.models import ProductSize
+
+
+class Cart(models.Model):
+    """
+    Корзина пользователя в БД (у гостей корзина живет в сессии, см.
+    apps.cart.cart.Cart). Первичный ключ - id пользователя, поэтому позиции
+    корзины выбираются по cart_id = user.id без обращения к этой таблице.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='stored_cart',
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Cart of user {self.user_id}'
+
+
+class CartLine(models.Model):
+    """Позиция корзины: размер товара, количество и цена на момент добавления"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='lines')
+    product_size = models.ForeignKey(ProductSize, on_delete=models.CASCADE, related_name='cart_lines')
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            # Индекс ограничения обслуживает и чтение корзины (cart_id = ...)
+            models.UniqueConstraint(fields=['cart', 'product_size'], name='cart_line_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity}x product size {self.product_size_id}'
@@ -0,0 +1,12 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from apps.cart.cart import merge_session_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # Любой вход (страница входа, регистрация, админка): корзина гостя
+    # переезжает в корзину аккаунта
+    if request is not None:
+        merge_session_cart(request, user)
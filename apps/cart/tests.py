@@ -1,3 +1,193 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from apps.main.models import Category, Product, ProductSize, Size
+from .cart import Cart
+from .models import CartLine
+
+
+class CartTestMixin:
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Outerwear')
+        self.product = Product.objects.create(
+            name='Coat', slug='coat', price=Decimal('50.00'), color='black', category=category,
+        )
+        self.size = Size.objects.create(name='S')
+        ProductSize.objects.create(product=self.product, size=self.size, stock=5)
+
+    def add(self, quantity=1, client=None):
+        return (client or self.client).post(
+            reverse('cart:cart_add', args=[self.product.id]), {'size_id': self.size.id, 'quantity': quantity},
+        )
+
+
+class LazyCartSessionTests(CartTestMixin, TestCase):
+
+    def test_browsing_does_not_create_a_session(self):
+        self.client.get(reverse('main:main_page'))
+        self.client.get(reverse('main:product_catalog'))
+        self.client.get(reverse('cart:cart_detail'))
+
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_browsing_does_not_rewrite_an_existing_session(self):
+        self.add()
+        # save() сессии сдвигает expire_date
+        saved = Session.objects.get().expire_date
+
+        self.client.get(reverse('main:product_catalog'))
+        self.client.get(reverse('cart:cart_detail'))
+
+        self.assertEqual(Session.objects.get().expire_date, saved)
+
+    def test_badge_reads_cached_count(self):
+        self.add(quantity=2)
+        self.add(quantity=1)
+
+        self.assertEqual(self.client.session[settings.CART_COUNT_SESSION_ID], 3)
+        self.assertContains(self.client.get(reverse('main:wishlist')), '<span class="cart-badge">3</span>')
+
+    def test_emptied_cart_leaves_session(self):
+        self.add()
+        self.client.post(reverse('cart:cart_remove', args=[self.product.id, self.size.id]))
+
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+        self.assertNotIn(settings.CART_COUNT_SESSION_ID, self.client.session)
+        self.assertNotContains(self.client.get(reverse('main:wishlist')), 'cart-badge">')
+
+
+class StoredCartTests(CartTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model()._default_manager.create(
+            email='buyer@example.com', first_name='Test', last_name='Buyer',
+        )
+
+    def test_user_cart_is_stored_in_db(self):
+        self.client.force_login(self.user)
+        self.add(quantity=2)
+        self.add(quantity=1)
+
+        line = CartLine.objects.get()
+        self.assertEqual((line.cart_id, line.quantity, line.price), (self.user.id, 3, Decimal('50.00')))
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+
+        # Другое устройство видит ту же корзину
+        other = Client()
+        other.force_login(self.user)
+        self.assertContains(other.get(reverse('main:wishlist')), '<span class="cart-badge">3</span>')
+        self.assertContains(other.get(reverse('cart:cart_detail')), 'Coat')
+
+    def test_read_is_one_query(self):
+        self.client.force_login(self.user)
+        self.add(quantity=2)
+        request = self.client.get(reverse('main:wishlist')).wsgi_request
+        request._cart_cache = {}
+
+        with self.assertNumQueries(1):
+            cart = Cart(request)
+            lines = list(cart)
+            self.assertEqual(len(cart), 2)
+            self.assertEqual(cart.get_total_price(), Decimal('100.00'))
+
+        self.assertEqual((lines[0]['product'], lines[0]['size'], lines[0]['stock']), (self.product, self.size, 5))
+
+    def test_badge_reads_current_lines(self):
+        self.client.force_login(self.user)
+        self.add(quantity=2)
+        self.assertContains(self.client.get(reverse('main:wishlist')), '<span class="cart-badge">2</span>')
+
+        # Корзину изменил запрос, обработанный другим воркером
+        CartLine.objects.update(quantity=5)
+        self.assertContains(self.client.get(reverse('main:wishlist')), '<span class="cart-badge">5</span>')
+
+    def test_session_cart_merges_on_login(self):
+        self.client.force_login(self.user)
+        self.add(quantity=1)
+        self.client.logout()
+        self.add(quantity=2)
+
+        self.client.force_login(self.user)
+
+        self.assertEqual(CartLine.objects.get().quantity, 3)
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+        self.assertNotIn(settings.CART_COUNT_SESSION_ID, self.client.session)
+        self.assertContains(self.client.get(reverse('main:wishlist')), '<span class="cart-badge">3</span>')
+
+    def test_remove_and_clear(self):
+        self.client.force_login(self.user)
+        self.add()
+        self.client.post(reverse('cart:cart_remove', args=[self.product.id, self.size.id]))
+        self.assertFalse(CartLine.objects.exists())
+
+        self.add()
+        self.client.get(reverse('cart:cart_clear'))
+        self.assertFalse(CartLine.objects.exists())
+        self.assertNotContains(self.client.get(reverse('main:wishlist')), 'cart-badge">')
+
+
+class CartQueryCountTests(CartTestMixin, TestCase):
+    """
+    Страница корзины и значок (context processor) - одинаковое число запросов
+    для 1 и N строк. В счет входят SAVEPOINT/RELEASE от ATOMIC_REQUESTS и
+    чтение сессии, для пользователя - еще users_customuser.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model()._default_manager.create(
+            email='buyer@example.com', first_name='Test', last_name='Buyer',
+        )
+        self.products = [self.product]
+        for index in range(4):
+            product = Product.objects.create(
+                name=f'Coat {index}', slug=f'coat-{index}', price=Decimal('60.00'), color='black',
+                category=self.product.category,
+            )
+            ProductSize.objects.create(product=product, size=self.size, stock=5)
+            self.products.append(product)
+
+    def filled_client(self, lines, user=None):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+            CartLine.objects.filter(cart_id=user.id).delete()
+        for product in self.products[:lines]:
+            client.post(reverse('cart:cart_add', args=[product.id]), {'size_id': self.size.id, 'quantity': 1})
+        return client
+
+    def test_session_cart(self):
+        for lines in (1, 5):
+            with self.subTest(lines=lines):
+                client = self.filled_client(lines)
+                # Сессия, товары, остатки по размерам
+                with self.assertNumQueries(5):
+                    response = client.get(reverse('cart:cart_detail'))
+                self.assertContains(response, self.products[lines - 1].name)
+                self.assertContains(response, f'<span class="cart-badge">{lines}</span>')
+                # Значок - из счетчика в сессии, без товаров
+                with self.assertNumQueries(3):
+                    response = client.get(reverse('main:wishlist'))
+                self.assertContains(response, f'<span class="cart-badge">{lines}</span>')
+
+    def test_stored_cart(self):
+        for lines in (1, 5):
+            with self.subTest(lines=lines):
+                client = self.filled_client(lines, user=self.user)
+                # Сессия, пользователь, строки с товарами и остатками: view загружает
+                # строки до шаблона (фото, apps.main.renditions), значок считается по ним
+                with self.assertNumQueries(5):
+                    response = client.get(reverse('cart:cart_detail'))
+                self.assertContains(response, self.products[lines - 1].name)
+                self.assertContains(response, f'<span class="cart-badge">{lines}</span>')
+                # Значок - один SUM по строкам
+                with self.assertNumQueries(5):
+                    response = client.get(reverse('main:wishlist'))
+                self.assertContains(response, f'<span class="cart-badge">{lines}</span>')
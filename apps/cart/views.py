@@ -3,6 +3,7 @@ from django.views.decorators.http import require_POST
 from django.contrib import messages
 from .cart import Cart
 from apps.main.models import Product, ProductSize
+from apps.main.renditions import attach_renditions
 
 
 def cart_detail(request):
@@ -10,6 +11,7 @@ def cart_detail(request):
     Страница корзины
     """
     cart = Cart(request)
+    attach_renditions(item['product'].main_image for item in cart)
         
     return render(request, 'cart/cart_detail.html', {'cart': cart})
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import Category, Size, Product, ProductSize, ProductImage
-from .review_models import Review, ReviewImage, ReviewHelpful
+from .review_models import Review, ReviewImage, ReviewImageUpload, ReviewHelpful
 
 
 class ProductImageInline(admin.TabularInline):
@@ -35,10 +35,16 @@ class ReviewAdmin(admin.ModelAdmin):
     list_display = ['id', 'product', 'user', 'rating', 'title', 'is_verified_purchase', 'helpful_count', 'created_at']
     list_filter = ['rating', 'is_verified_purchase', 'created_at']
     search_fields = ['title', 'content', 'user__email', 'product__name']
-    readonly_fields = ['created_at', 'updated_at', 'helpful_count']
+    readonly_fields = ['created_at', 'updated_at', 'helpful_count', 'images_pending']
     inlines = [ReviewImageInline]
     date_hierarchy = 'created_at'
 
+class ReviewImageUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'review', 'original_name', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status']
+    search_fields = ['original_name', 'file']
+    readonly_fields = ['review', 'file', 'original_name', 'attempts', 'last_error', 'created_at']
+
 class ReviewHelpfulAdmin(admin.ModelAdmin):
     list_display = ['review', 'user', 'created_at']
     list_filter = ['created_at']
@@ -50,4 +56,5 @@ admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Size, SizeAdmin)
 admin.site.register(Review, ReviewAdmin)
+admin.site.register(ReviewImageUpload, ReviewImageUploadAdmin)
 admin.site.register(ReviewHelpful, ReviewHelpfulAdmin)
\ No newline at end of file
@@ -0,0 +1,321 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from apps.main.models import Category, Product, ProductImage, ProductSize, Size
+from apps.main.reference import reference_objects
+
+
+# Формат файла каталога: одна строка - один товар. В CSV размеры пишутся
+# как "S:5;M:0", дополнительные изображения - через ";". В JSONL sizes - объект
+# {"S": 5}, images - список. Отсутствующие колонки при обновлении товара не трогаются.
+CSV_FIELDS = [
+    'slug', 'name', 'category', 'category_name', 'description', 'price', 'color',
+    'status_discount', 'main_image', 'sizes', 'images',
+]
+PRODUCT_FIELDS = ('name', 'description', 'price', 'color', 'status_discount', 'main_image', 'category')
+REQUIRED_FOR_NEW = ('name', 'price', 'category')
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+
+class CatalogRowError(ValueError):
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        super().__init__(f'line {line_number}: {message}')
+
+
+def read_rows(stream, file_format):
+    """(номер строки, dict) из CSV или JSONL - по одной строке, без чтения файла целиком"""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Пустые ячейки CSV - это "колонка не задана"
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise CatalogRowError(line_number, f'invalid JSON ({e})')
+        if not isinstance(row, dict):
+            raise CatalogRowError(line_number, 'expected a JSON object')
+        yield line_number, row
+
+
+def _parse_sizes(value):
+    if isinstance(value, dict):
+        items = value.items()
+    else:
+        items = (part.split(':', 1) for part in str(value).split(';') if part.strip())
+    sizes = {}
+    for name, stock in items:
+        stock = int(stock)
+        if stock < 0:
+            raise ValueError(f'negative stock for size {name}')
+        sizes[str(name).strip()] = stock
+    return sizes
+
+
+def _parse_images(value):
+    if isinstance(value, list):
+        return [str(image) for image in value if image]
+    return [image.strip() for image in str(value).split(';') if image.strip()]
+
+
+def parse_row(line_number, raw):
+    """Проверить и привести строку файла к {'slug', поля Product..., 'sizes', 'images'}"""
+    slug = str(raw.get('slug') or '').strip()
+    if not slug:
+        raise CatalogRowError(line_number, 'slug is required')
+    row = {'line': line_number, 'slug': slug}
+    try:
+        for field in ('name', 'description', 'color', 'main_image'):
+            if field in raw:
+                row[field] = str(raw[field])
+        if 'price' in raw:
+            row['price'] = Decimal(str(raw['price']))
+            if row['price'] < 0:
+                raise ValueError('negative price')
+        if 'status_discount' in raw:
+            value = raw['status_discount']
+            row['status_discount'] = value if isinstance(value, bool) else str(value).strip().lower() in TRUE_VALUES
+        if 'category' in raw:
+            row['category'] = str(raw['category']).strip()
+            if raw.get('category_name'):
+                row['category_name'] = str(raw['category_name'])
+        if 'sizes' in raw:
+            row['sizes'] = _parse_sizes(raw['sizes'])
+        if 'images' in raw:
+            row['images'] = _parse_images(raw['images'])
+    except (ValueError, InvalidOperation, TypeError) as e:
+        raise CatalogRowError(line_number, str(e) or type(e).__name__)
+    return row
+
+
+class CatalogImporter:
+    """
+    Загрузка каталога пачками: на пачку - фиксированное число запросов
+    (bulk_create/bulk_update) независимо от ее размера, одна транзакция на пачку.
+    Категории находятся по slug, товары - по slug, размеры - по названию.
+    """
+
+    def __init__(self):
+        self.stats = dict.fromkeys(
+            ('rows', 'categories', 'products_created', 'products_updated', 'stock_rows', 'images'), 0,
+        )
+
+    def import_chunk(self, rows, skip_invalid=False):
+        """
+        Загрузить пачку строк parse_row. Новый товар без REQUIRED_FOR_NEW
+        (это видно только по базе) - CatalogRowError, а с skip_invalid такая
+        строка пропускается. Возвращает ошибки пропущенных строк.
+        """
+        # Повтор slug внутри пачки: побеждает последняя строка
+        rows = list({row['slug']: row for row in rows}.values())
+        skipped = []
+        with transaction.atomic():
+            product_ids = dict(
+                Product.objects.filter(slug__in=[row['slug'] for row in rows]).values_list('slug', 'id')
+            )
+            valid = []
+            for row in rows:
+                if row['slug'] not in product_ids:
+                    missing = [field for field in REQUIRED_FOR_NEW if field not in row]
+                    if missing:
+                        error = CatalogRowError(row['line'], f'new product needs {", ".join(missing)}')
+                        if not skip_invalid:
+                            raise error
+                        skipped.append(error)
+                        continue
+                valid.append(row)
+            rows = valid
+
+            category_ids = self._upsert_categories(rows)
+            self._upsert_products(rows, product_ids, category_ids)
+            self._upsert_stock(rows, product_ids)
+            self._add_images(rows, product_ids)
+        self.stats['rows'] += len(rows)
+        return skipped
+
+    def _upsert_categories(self, rows):
+        named = {row['category']: row['category_name'] for row in rows if 'category_name' in row}
+        slugs = {row['category'] for row in rows if 'category' in row}
+        if named:
+            Category.objects.bulk_create(
+                [Category(slug=slug, name=name) for slug, name in named.items()],
+                update_conflicts=True, unique_fields=['slug'], update_fields=['name'],
+            )
+        unnamed = slugs - named.keys()
+        if unnamed:
+            Category.objects.bulk_create(
+                [Category(slug=slug, name=slug.replace('-', ' ').title()) for slug in unnamed],
+                ignore_conflicts=True,
+            )
+        self.stats['categories'] += len(slugs)
+        return dict(Category.objects.filter(slug__in=slugs).values_list('slug', 'id')) if slugs else {}
+
+    def _product_values(self, row, category_ids):
+        values = {field: row[field] for field in PRODUCT_FIELDS if field in row and field != 'category'}
+        if 'category' in row:
+            values['category_id'] = category_ids[row['category']]
+        return values
+
+    def _upsert_products(self, rows, product_ids, category_ids):
+        """
+        Строки с name, price и category (новые и существующие товары) -
+        INSERT ... ON CONFLICT (slug) DO UPDATE по колонкам строки. Частичные
+        строки (например, только цена) - bulk_update уже существующих товаров.
+        """
+        groups = {}
+        for row in rows:
+            fields = tuple(field for field in PRODUCT_FIELDS if field in row)
+            if fields:
+                upsert = all(field in row for field in REQUIRED_FOR_NEW)
+                groups.setdefault((upsert, fields), []).append(row)
+
+        for (upsert, fields), group in groups.items():
+            if upsert:
+                saved = Product.objects.bulk_create(
+                    [Product(slug=row['slug'], **self._product_values(row, category_ids)) for row in group],
+                    update_conflicts=True, unique_fields=['slug'], update_fields=list(fields) + _auto_now_fields(),
+                )
+                created = sum(product.slug not in product_ids for product in saved)
+                self.stats['products_created'] += created
+                self.stats['products_updated'] += len(saved) - created
+                product_ids.update((product.slug, product.id) for product in saved)
+                continue
+
+            now = timezone.now()
+            products = []
+            for row in group:
+                product = Product(id=product_ids[row['slug']], **self._product_values(row, category_ids))
+                for field in _auto_now_fields():
+                    setattr(product, field, now)
+                products.append(product)
+            Product.objects.bulk_update(products, list(fields) + _auto_now_fields())
+            self.stats['products_updated'] += len(products)
+
+    def _upsert_stock(self, rows, product_ids):
+        # Размеры - из базы, а не из кеша справочников: размер, созданный
+        # в откаченной пачке, не должен остаться в памяти
+        names = {name for row in rows for name in row.get('sizes', ())}
+        size_ids = {}
+        for size_id, name in Size.objects.filter(name__in=names).order_by('-id').values_list('id', 'name'):
+            size_ids[name] = size_id
+        missing = sorted(names - size_ids.keys())
+        if missing:
+            size_ids.update((size.name, size.id) for size in Size.objects.bulk_create([Size(name=name) for name in missing]))
+
+        stock = {
+            (product_ids[row['slug']], size_ids[name]): quantity
+            for row in rows if 'sizes' in row
+            for name, quantity in row['sizes'].items()
+        }
+        if not stock:
+            return
+        existing = {}
+        for product_size in ProductSize.objects.filter(
+            product_id__in={product_id for product_id, _ in stock}
+        ).only('id', 'product_id', 'size_id', 'stock'):
+            existing.setdefault((product_size.product_id, product_size.size_id), []).append(product_size)
+
+        changed = []
+        for key, quantity in stock.items():
+            for product_size in existing.get(key, ()):
+                if product_size.stock != quantity:
+                    product_size.stock = quantity
+                    changed.append(product_size)
+        ProductSize.objects.bulk_update(changed, ['stock'])
+        ProductSize.objects.bulk_create([
+            ProductSize(product_id=product_id, size_id=size_id, stock=quantity)
+            for (product_id, size_id), quantity in stock.items() if (product_id, size_id) not in existing
+        ])
+        self.stats['stock_rows'] += len(stock)
+
+    def _add_images(self, rows, product_ids):
+        wanted = {
+            (product_ids[row['slug']], image)
+            for row in rows if 'images' in row
+            for image in row['images']
+        }
+        if not wanted:
+            return
+        existing = set(ProductImage.objects.filter(
+            product_id__in={product_id for product_id, _ in wanted}
+        ).values_list('product_id', 'image'))
+        added = ProductImage.objects.bulk_create([
+            ProductImage(product_id=product_id, image=image)
+            for product_id, image in sorted(wanted - existing)
+        ])
+        if added:
+            # Новые изображения меняют страницу товара (ETag, apps.main.conditional)
+            Product.objects.filter(id__in={image.product_id for image in added}).update(updated_at=timezone.now())
+        self.stats['images'] += len(added)
+
+
+def _auto_now_fields():
+    """Поля Product с auto_now: bulk_update их сам не обновляет"""
+    return [field.name for field in Product._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+
+def export_rows(chunk_size=2000):
+    """
+    Строки каталога для выгрузки. Товары читаются серверным курсором
+    (iterator), размеры и изображения - prefetch на каждую пачку из chunk_size
+    товаров, поэтому память не растет с размером каталога.
+    """
+    sizes = {size.id: size.name for size in reference_objects(Size)}
+    products = (
+        Product.objects
+        .select_related('category')
+        .only(*PRODUCT_FIELDS, 'slug', 'category__slug', 'category__name')
+        .prefetch_related(
+            Prefetch('productsize_set', queryset=ProductSize.objects.only('product_id', 'size_id', 'stock').order_by('id')),
+            Prefetch('images', queryset=ProductImage.objects.only('product_id', 'image').order_by('id')),
+        )
+        .order_by('id')
+    )
+    for product in products.iterator(chunk_size=chunk_size):
+        yield {
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.slug,
+            'category_name': product.category.name,
+            'description': product.description,
+            'price': str(product.price),
+            'color': product.color,
+            'status_discount': product.status_discount,
+            'main_image': product.main_image.name or '',
+            'sizes': {
+                sizes.get(product_size.size_id, str(product_size.size_id)): product_size.stock
+                for product_size in product.productsize_set.all()
+            },
+            'images': [image.image.name for image in product.images.all()],
+        }
+
+
+def write_rows(rows, stream, file_format):
+    """Записать строки export_rows в CSV или JSONL; отдает записанные строки (для счетчика прогресса)"""
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({
+                **row,
+                'status_discount': 'true' if row['status_discount'] else 'false',
+                'sizes': ';'.join(f'{name}:{stock}' for name, stock in row['sizes'].items()),
+                'images': ';'.join(row['images']),
+            })
+            yield row
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            yield row
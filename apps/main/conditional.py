@@ -0,0 +1,115 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import CharField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from apps.main.facets import FACETS_VERSION_KEY
+from apps.main.models import Product, ProductSize
+from apps.main.reference import REFERENCE_VERSION_KEY
+from apps.main.renditions import VERSION_KEY as RENDITIONS_VERSION_KEY
+from apps.main.review_models import Review
+from apps.main.versions import get_versions
+
+
+# Условные GET (ETag/Last-Modified) для страниц товара и каталога. Версия
+# страницы считается одним запросом по индексам, и 304 отдается без рендеринга.
+# Товар: updated_at (меняется и со сводкой отзывов, apps.main.ratings),
+# остатки по размерам, сводка отзывов и последняя правка отзывов. Счетчики
+# "полезно" сворачиваются пачками (apps.main.helpful) и версию не меняют.
+# Каталог: последний updated_at товаров, версии кеша фасетов и справочников.
+# В обеих версиях и версия производных фото (apps.main.renditions): готовые
+# производные заменяют в разметке оригиналы. Версии из общего кеша читаются
+# одним get_many (apps.main.versions), и 304 стоит два запроса: кеш и товары.
+
+
+def _is_shared(request):
+    """
+    Страница без сессии и flash-сообщений одинакова для всех посетителей
+    (кроме csrf-токена, он входит в ETag). С сессией в ней корзина, голоса
+    и кнопки пользователя - такие страницы всегда рендерятся.
+    """
+    return (
+        settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def _etag(request, parts):
+    # Секрет csrf: из cookie запроса или новый, если страница его только что выдала
+    parts = [*parts, request.META.get('CSRF_COOKIE', '')]
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def conditional_page(version_func):
+    """
+    Декоратор view: version_func(request, *args, **kwargs) возвращает
+    (части версии, время изменения) или None - тогда view работает как обычно.
+
+    304 решает только ETag: у остатков нет своей метки времени, и по одному
+    If-Modified-Since изменение остатков было бы не видно. Last-Modified
+    отдается для сведения. Cache-Control: no-cache - браузер каждый раз
+    переспрашивает сервер и не показывает устаревшую страницу.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not _is_shared(request):
+                return view(request, *args, **kwargs)
+
+            version = version_func(request, *args, **kwargs)
+            if version is None:
+                return view(request, *args, **kwargs)
+            parts, last_modified = version
+
+            response = get_conditional_response(request, etag=_etag(request, parts))
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.headers.setdefault('ETag', _etag(request, parts))
+            if last_modified is not None:
+                response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def product_version(request, id, slug):
+    """Версия страницы товара одним запросом; None - товара нет (view отдаст 404)"""
+    stock = ArraySubquery(
+        ProductSize.objects.filter(product_id=OuterRef('id')).order_by('id')
+        .values(pair=Concat(Cast('size_id', CharField()), Value(':'), Cast('stock', CharField())))
+    )
+    reviews_changed_at = Subquery(
+        Review.objects.filter(product_id=OuterRef('id')).order_by('-updated_at').values('updated_at')[:1]
+    )
+    row = (
+        Product.objects.filter(id=id, slug=slug)
+        .annotate(stock=stock, reviews_changed_at=reviews_changed_at)
+        .values('updated_at', 'rating_avg', 'rating_count', 'stock', 'reviews_changed_at')
+        .first()
+    )
+    if row is None:
+        return None
+    last_modified = max(filter(None, (row['updated_at'], row['reviews_changed_at'])))
+    return [*get_versions(REFERENCE_VERSION_KEY, RENDITIONS_VERSION_KEY), *row.values()], last_modified
+
+
+def catalog_version(request):
+    """
+    Версия страниц каталога: товары создаются, удаляются и меняют фасеты через
+    сигналы (invalidate_facets), прочие правки видны по updated_at
+    """
+    last_modified = Product.objects.aggregate(latest=Max('updated_at'))['latest']
+    parts = get_versions(FACETS_VERSION_KEY, REFERENCE_VERSION_KEY, RENDITIONS_VERSION_KEY)
+    return [*parts, last_modified], last_modified
@@ -0,0 +1,187 @@
+import hashlib
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Q, QuerySet, Value, When
+
+from apps.main.models import ProductSize
+from apps.main.versions import bump_version, get_version
+
+
+FACETS_CACHE_TIMEOUT = 60 * 15
+FACETS_VERSION_KEY = 'catalog:facets:version'
+
+# Фасет -> фильтры ProductFilter, которые он не учитывает (свои)
+FACET_FILTERS = {
+    'category': ('category',),
+    'size': ('sizes',),
+    'color': ('color',),
+    'discount': ('status_discount',),
+    'price': ('price_min', 'price_max'),
+}
+
+# Диапазоны цен для сайдбара: (от, до), границы [от, до)
+PRICE_BUCKETS = (
+    (None, Decimal('50')),
+    (Decimal('50'), Decimal('100')),
+    (Decimal('100'), Decimal('200')),
+    (Decimal('200'), None),
+)
+
+
+def facets_version():
+    return get_version(FACETS_VERSION_KEY)
+
+
+def invalidate_facets():
+    """Сбросить все закешированные фасеты во всех воркерах (новая версия ключей)"""
+    bump_version(FACETS_VERSION_KEY)
+
+
+def _cleaned_data(product_filter):
+    """Значения фильтров, которые применяет product_filter.qs (невалидные поля он пропускает)"""
+    if not product_filter.is_bound:
+        return {}
+    product_filter.is_valid()
+    return {
+        name: value for name, value in product_filter.form.cleaned_data.items()
+        if name != 'ordering' and _is_set(value)
+    }
+
+
+def _is_set(value):
+    # Пустые значения фильтры пропускают сами: пустой множественный выбор
+    # приходит как queryset.none(). 0 (цена до 0) - не пустое значение
+    if value is None or value is False or value == '':
+        return False
+    if isinstance(value, (list, tuple, QuerySet)):
+        return len(value) > 0
+    return True
+
+
+def normalize_filter(product_filter):
+    """
+    Ключ фильтра, не зависящий от порядка параметров, регистра и сортировки:
+    ?color=Red&category=2&category=1 и ?category=1&category=2&color=red
+    дают одинаковые фасеты.
+    """
+    normalized = {}
+    for name, value in _cleaned_data(product_filter).items():
+        if hasattr(value, '__iter__') and not isinstance(value, str):
+            value = sorted(obj.pk for obj in value)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        elif isinstance(value, Decimal):
+            value = str(value.normalize())
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True)
+
+
+def _price_bucket():
+    whens = []
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(index)))
+    return Case(*whens, output_field=IntegerField())
+
+
+def _filtered(product_filter, cleaned_data, exclude):
+    """queryset ProductFilter со всеми выбранными фильтрами, кроме exclude"""
+    queryset = product_filter.queryset.all()
+    for name, value in cleaned_data.items():
+        if name not in exclude:
+            queryset = product_filter.filters[name].filter(queryset, value)
+    return queryset
+
+
+def _count(queryset, sizes):
+    """
+    Категория, цвет, скидка и диапазон цен - один GROUP BY по товарам,
+    размеры (sizes=True) - второй запрос по ProductSize, т.к. у товара несколько
+    размеров и в общей группировке товары считались бы несколько раз.
+    """
+    products = queryset.order_by().prefetch_related(None)
+
+    counts = {
+        'category': {},
+        'color': {},
+        'discount': 0,
+        'price': [0] * len(PRICE_BUCKETS),
+        'total': 0,
+    }
+
+    rows = (
+        products
+        .annotate(price_bucket=_price_bucket())
+        .values('category_id', 'color', 'status_discount', 'price_bucket')
+        .annotate(count=Count('id', distinct=True))
+    )
+    for row in rows:
+        count = row['count']
+        # Группы не пересекаются: каждый товар ровно в одной
+        counts['total'] += count
+        counts['category'][row['category_id']] = counts['category'].get(row['category_id'], 0) + count
+        counts['color'][row['color']] = counts['color'].get(row['color'], 0) + count
+        if row['status_discount']:
+            counts['discount'] += count
+        if row['price_bucket'] is not None:
+            counts['price'][row['price_bucket']] += count
+
+    if sizes:
+        rows = (
+            ProductSize.objects
+            .filter(product__in=products.values('id'))
+            .values('size_id')
+            .annotate(count=Count('product_id', distinct=True))
+        )
+        counts['size'] = {row['size_id']: row['count'] for row in rows}
+
+    counts['color'] = sorted(counts['color'].items(), key=lambda item: (-item[1], item[0]))
+    counts['price'] = [
+        {'min': low, 'max': high, 'count': count}
+        for (low, high), count in zip(PRICE_BUCKETS, counts['price'])
+    ]
+    return counts
+
+
+def compute_facets(product_filter):
+    """
+    Счетчики для сайдбара. Каждый фасет считается со всеми выбранными
+    фильтрами, кроме своего: при выбранной категории остальные категории
+    показывают, сколько товаров добавится, а не 0. total - число товаров
+    с учетом всех фильтров.
+
+    Фасеты, чей фильтр не выбран, считаются одной общей выборкой, поэтому
+    без фильтров это два запроса, а с каждым выбранным фасетом - плюс один-два.
+    """
+    cleaned_data = _cleaned_data(product_filter)
+    groups = {(): []}
+    for facet, names in FACET_FILTERS.items():
+        exclude = tuple(name for name in names if name in cleaned_data)
+        groups.setdefault(exclude, []).append(facet)
+
+    facets = {}
+    for exclude, names in groups.items():
+        counts = _count(_filtered(product_filter, cleaned_data, exclude), sizes='size' in names)
+        if not exclude:
+            facets['total'] = counts['total']
+        for name in names:
+            facets[name] = counts[name]
+    return facets
+
+
+def get_facets(product_filter):
+    """Фасеты для текущего фильтра из кеша, при промахе - compute_facets"""
+    digest = hashlib.sha1(normalize_filter(product_filter).encode()).hexdigest()
+    key = f'catalog:facets:{facets_version()}:{digest}'
+
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(product_filter)
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
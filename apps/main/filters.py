@@ -1,10 +1,85 @@
 import django_filters
+from django.core.exceptions import ValidationError
+from django_filters.fields import ModelChoiceIterator, ModelMultipleChoiceField
+
 from apps.main.models import Product, Category, Size
+from apps.main.reference import reference_objects
+from apps.main.search import search_products
+
+
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    """Варианты выбора из закешированного справочника, без запросов к БД"""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        if self.field.null_label is not None:
+            yield (self.field.null_value, self.field.null_label)
+        for obj in reference_objects(self.queryset.model):
+            yield self.choice(obj)
+
+    def __len__(self):
+        add = 1 if self.field.empty_label is not None else 0
+        add += 1 if self.field.null_label is not None else 0
+        return len(reference_objects(self.queryset.model)) + add
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(reference_objects(self.queryset.model))
+
+
+class ReferenceMultipleChoiceField(ModelMultipleChoiceField):
+    iterator = ReferenceChoiceIterator
+
+    def _check_values(self, value):
+        """Проверка выбранных значений по справочнику в памяти вместо pk__in запроса"""
+        null = self.null_label is not None and value and self.null_value in value
+        if null:
+            value = [v for v in value if v != self.null_value]
+
+        key = self.to_field_name or 'pk'
+        try:
+            value = frozenset(value)
+        except TypeError:
+            raise ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+
+        objects = {str(getattr(obj, key)): obj for obj in reference_objects(self.queryset.model)}
+        result = []
+        for pk in value:
+            self.validate_no_null_characters(pk)
+            obj = objects.get(str(pk))
+            if obj is None:
+                raise ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': pk},
+                )
+            result.append(obj)
+        result.sort(key=lambda obj: obj.pk)
+        return result + ([self.null_value] if null else [])
+
+
+class ReferenceMultipleChoiceFilter(django_filters.ModelMultipleChoiceFilter):
+    """
+    ModelMultipleChoiceFilter для справочников (apps.main.reference):
+    форма рендерится и валидируется без запросов к БД.
+    """
+    field_class = ReferenceMultipleChoiceField
 
 
 class ProductFilter(django_filters.FilterSet):
+    # Полнотекстовый поиск (название, описание, категория) с ранжированием
+    q = django_filters.CharFilter(
+        method='filter_search',
+        widget=django_filters.widgets.forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Поиск по каталогу',
+            'type': 'search'
+        }),
+        label='Поиск'
+    )
+
     # Фильтр по категориям (множественный выбор)
-    category = django_filters.ModelMultipleChoiceFilter(
+    category = ReferenceMultipleChoiceFilter(
         queryset=Category.objects.all(),
         field_name='category',
         widget=django_filters.widgets.forms.CheckboxSelectMultiple(attrs={
@@ -14,7 +89,7 @@ class ProductFilter(django_filters.FilterSet):
     )
     
     # Фильтр по размерам (множественный выбор)
-    sizes = django_filters.ModelMultipleChoiceFilter(
+    sizes = ReferenceMultipleChoiceFilter(
         queryset=Size.objects.all(),
         field_name='productsize__size',
         widget=django_filters.widgets.forms.CheckboxSelectMultiple(attrs={
@@ -54,13 +129,28 @@ class ProductFilter(django_filters.FilterSet):
     #     label='Диапазон цен'
     # )
     
+    # Фильтр по рейтингу (из сводки отзывов в Product, без запросов к Review)
+    rating_min = django_filters.NumberFilter(
+        field_name='rating_avg',
+        lookup_expr='gte',
+        widget=django_filters.widgets.forms.NumberInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Рейтинг от',
+            'min': 1,
+            'max': 5,
+            'step': 0.5
+        }),
+        label='Рейтинг от'
+    )
+
     # Фильтр по цвету
     color = django_filters.CharFilter(
         field_name='color',
         lookup_expr='icontains',
         widget=django_filters.widgets.forms.TextInput(attrs={
             'class': 'form-control',
-            'placeholder': 'Поиск по цвету'
+            'placeholder': 'Поиск по цвету',
+            'list': 'colorFacets'
         }),
         label='Цвет'
     )
@@ -68,6 +158,7 @@ class ProductFilter(django_filters.FilterSet):
     # Фильтр по товарам со скидкой
     status_discount = django_filters.BooleanFilter(
         field_name='status_discount',
+        method='filter_status_discount',
         widget=django_filters.widgets.forms.CheckboxInput(attrs={
             'class': 'form-check-input'
         }),
@@ -91,6 +182,7 @@ class ProductFilter(django_filters.FilterSet):
             ('price', 'price'),
             ('created_at', 'created_at'),
             ('name', 'name'),
+            ('rating_avg', 'rating'),
         ),
         field_labels={
             'price': 'Цене',
@@ -99,10 +191,21 @@ class ProductFilter(django_filters.FilterSet):
             '-created_at': 'Дате создания (новые)',
             'name': 'Названию',
             '-name': 'Названию (Z-A)',
+            'rating': 'Рейтингу',
+            '-rating': 'Рейтингу (лучшие)',
         },
         label='Сортировка'
     )
 
+    def filter_search(self, queryset, name, value):
+        return search_products(queryset, value)
+
+    def filter_status_discount(self, queryset, name, value):
+        # Неотмеченный чекбокс приходит как False - это "все товары", а не "без скидки"
+        if value:
+            return queryset.filter(**{name: True})
+        return queryset
+
     class Meta:
         model = Product
-        fields = ['category', 'sizes', 'price_min', 'price_max', 'color', 'status_discount', 'name']
\ No newline at end of file
+        fields = ['q', 'category', 'sizes', 'price_min', 'price_max', 'rating_min', 'color', 'status_discount', 'name']
\ No newline at end of file
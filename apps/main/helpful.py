@@ -0,0 +1,121 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from apps.main.review_models import Review, ReviewHelpful, ReviewHelpfulDelta
+
+
+# Голоса "полезно" не пишут в строку Review: голос - это вставка или удаление
+# ReviewHelpful и строка +1/-1 в ReviewHelpfulDelta. Review.helpful_count
+# догоняет журнал пачками (rollup_votes, команда rollup_helpful_votes),
+# rebuild_helpful_counts пересчитывает счетчики из самих голосов.
+
+
+def _votes(review_ref):
+    return Coalesce(Subquery(
+        ReviewHelpful.objects.filter(review_id=review_ref).order_by()
+        .values('review_id').annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+def _pending(review_ref):
+    return Coalesce(Subquery(
+        ReviewHelpfulDelta.objects.filter(review_id=review_ref).order_by()
+        .values('review_id').annotate(total=Sum('delta')).values('total')
+    ), 0)
+
+
+def current_count(review_id):
+    """helpful_count вместе с еще не свернутым журналом - один запрос, один снимок"""
+    return (
+        Review.objects.filter(id=review_id)
+        .annotate(current=F('helpful_count') + _pending(OuterRef('id')))
+        .values_list('current', flat=True)
+        .get()
+    )
+
+
+def toggle_vote(review, user):
+    """
+    Поставить или снять голос пользователя за отзыв.
+    Возвращает (голос стоит, актуальное число голосов).
+    """
+    with transaction.atomic():
+        removed, _ = ReviewHelpful.objects.filter(review=review, user=user).delete()
+        if removed:
+            delta = -1
+        else:
+            try:
+                with transaction.atomic():
+                    ReviewHelpful.objects.create(review=review, user=user)
+            except IntegrityError:
+                # Параллельный запрос того же пользователя уже поставил голос
+                return True, current_count(review.id)
+            delta = 1
+        ReviewHelpfulDelta.objects.create(review=review, delta=delta)
+    return delta > 0, current_count(review.id)
+
+
+def rollup_votes(batch_size=5000):
+    """
+    Свернуть пачку журнала в Review.helpful_count: один UPDATE с F-выражениями
+    на все затронутые отзывы. Возвращает число свернутых строк журнала.
+
+    Журнал берется через SKIP LOCKED, поэтому несколько обработчиков не мешают
+    друг другу; строки Review блокируются в порядке id и не ловят deadlock.
+    """
+    with transaction.atomic():
+        rows = list(
+            ReviewHelpfulDelta.objects
+            .select_for_update(skip_locked=True)
+            .order_by('id')
+            .values_list('id', 'review_id', 'delta')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        deltas = {}
+        for _, review_id, delta in rows:
+            deltas[review_id] = deltas.get(review_id, 0) + delta
+        deltas = {review_id: delta for review_id, delta in deltas.items() if delta}
+        if deltas:
+            list(Review.objects.select_for_update().filter(id__in=deltas).order_by('id').values_list('id'))
+            Review.objects.filter(id__in=deltas).update(helpful_count=Greatest(
+                Case(
+                    *(When(id=review_id, then=F('helpful_count') + delta) for review_id, delta in deltas.items()),
+                    output_field=IntegerField(),
+                ),
+                Value(0),
+            ))
+        ReviewHelpfulDelta.objects.filter(id__in=[row_id for row_id, _, _ in rows]).delete()
+    return len(rows)
+
+
+def rebuild_helpful_counts(batch_size=1000):
+    """
+    Пересчитать helpful_count всех отзывов из ReviewHelpful (исправление
+    расхождений). Обновляются только разошедшиеся отзывы. Возвращает их число.
+
+    Счетчик = голоса - еще не свернутый журнал: голос и его строка журнала
+    пишутся в одной транзакции, поэтому в одном снимке они видны вместе.
+    Отзывы пачки заблокированы, и rollup_votes не свернет журнал между чтением и записью.
+    """
+    expected = _votes(OuterRef('id')) - _pending(OuterRef('id'))
+    updated = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Review.objects.select_for_update()
+                .filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return updated
+            updated += (
+                Review.objects.filter(id__in=ids)
+                .alias(expected=expected)
+                .exclude(helpful_count=F('expected'))
+                .update(helpful_count=expected)
+            )
+        last_id = ids[-1]
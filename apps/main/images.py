@@ -0,0 +1,122 @@
+import hashlib
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# Ширина производных в пикселях
+RENDITIONS = {
+    'thumb': 160,
+    'card': 480,
+    'zoom': 1600,
+}
+
+# формат -> (формат Pillow, расширение, параметры сохранения)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def rendition_name(name, digest, rendition, extension):
+    """products/main/coat.png -> products/main/coat.card.1a2b3c4d5e6f.webp"""
+    root, _ = os.path.splitext(name)
+    return f'{root}.{rendition}.{digest}.{extension}'
+
+
+def _normalize_mode(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+class InvalidImage(ValueError):
+    """Загрузка не является допустимым фото - повторная обработка не поможет"""
+
+
+# Фото отзывов (prepare_upload): допустимые форматы и размеры оригинала
+UPLOAD_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+UPLOAD_MIN_SIDE = 200
+UPLOAD_MAX_SIDE = 4000
+UPLOAD_JPEG_OPTIONS = {'quality': 85, 'optimize': True, 'progressive': True}
+
+
+def prepare_upload(data, max_side):
+    """
+    Проверить загруженное фото и перекодировать его в JPEG: поворот по EXIF
+    применяется к пикселям, метаданные (EXIF с GPS, ICC, комментарии) не
+    переносятся, длинная сторона - не больше max_side. Возвращает байты JPEG,
+    InvalidImage - если это не фото допустимого формата и размера.
+
+    Выполняется в процессе пула (apps.main.review_uploads): на входе и выходе
+    только байты, без БД и хранилища.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in UPLOAD_FORMATS:
+                raise InvalidImage(f'unsupported format {image.format}')
+            if min(image.size) < UPLOAD_MIN_SIDE:
+                raise InvalidImage(f'image must be at least {UPLOAD_MIN_SIDE}x{UPLOAD_MIN_SIDE} pixels')
+            if max(image.size) > UPLOAD_MAX_SIDE:
+                raise InvalidImage(f'image must not exceed {UPLOAD_MAX_SIDE}x{UPLOAD_MAX_SIDE} pixels')
+            image = _normalize_mode(ImageOps.exif_transpose(image))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        # Pillow сообщает о битом или обрезанном файле через OSError/SyntaxError
+        raise InvalidImage(f'invalid or corrupted image ({e})')
+
+    if image.mode == 'RGBA':
+        # JPEG без прозрачности: прозрачные области - белые
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', **UPLOAD_JPEG_OPTIONS)
+    return buffer.getvalue()
+
+
+def generate_renditions(name, storage=default_storage):
+    """
+    Создать недостающие производные для оригинала рядом с ним и вернуть манифест:
+    {'hash': ..., 'renditions': {'card': {'width': 480, 'webp': name, 'jpeg': name}, ...}}
+
+    Имена содержат хеш содержимого оригинала, поэтому замена файла дает новые
+    имена и их можно кешировать навсегда. Уже существующие файлы не пересоздаются.
+
+    Выполняется в процессе пула (apps.main.renditions): только хранилище, без БД и кеша.
+    """
+    with storage.open(name, 'rb') as original_file:
+        data = original_file.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+
+    manifest = {'hash': digest, 'renditions': {}}
+    with Image.open(io.BytesIO(data)) as original:
+        original = _normalize_mode(ImageOps.exif_transpose(original))
+
+        widths = set()
+        for rendition, width in sorted(RENDITIONS.items(), key=lambda item: item[1]):
+            # Не увеличиваем: узкий оригинал дает одну производную его ширины
+            width = min(width, original.width)
+            if width in widths:
+                continue
+            widths.add(width)
+
+            height = max(1, round(original.height * width / original.width))
+            resized = None
+            entry = {'width': width}
+            for image_format, (pil_format, extension, options) in FORMATS.items():
+                output_name = rendition_name(name, digest, rendition, extension)
+                if not storage.exists(output_name):
+                    if resized is None:
+                        resized = original.resize((width, height), Image.LANCZOS)
+                    image = resized if pil_format != 'JPEG' else resized.convert('RGB')
+                    buffer = io.BytesIO()
+                    image.save(buffer, pil_format, **options)
+                    output_name = storage.save(output_name, ContentFile(buffer.getvalue()))
+                entry[image_format] = output_name
+            manifest['renditions'][rendition] = entry
+    return manifest
@@ -0,0 +1,253 @@
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import django
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.main.models import Category, Product, ProductSize
+from apps.main.review_models import Review
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+CHECKOUT_FORM = {
+    'email': 'bench@example.com',
+    'first_name': 'Bench',
+    'last_name': 'Mark',
+    'phone': '+10000000000',
+    'address_line1': '1 Bench street',
+    'city': 'Bench City',
+    'postal_code': '00000',
+    'country': 'Benchland',
+}
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values, digits=2):
+    return {
+        'mean': round(sum(values) / len(values), digits),
+        **{f'p{percent}': round(percentile(values, percent), digits) for percent in PERCENTILES},
+        'max': round(max(values), digits),
+    }
+
+
+class FakeStripe:
+    """Подмена stripe.PaymentIntent: бенчмарк не ходит в сеть и меряет только наш код"""
+
+    def __init__(self):
+        self.intents = {}
+
+    def create(self, amount, currency, **kwargs):
+        intent_id = f'pi_bench_{len(self.intents) + 1}'
+        intent = SimpleNamespace(
+            id=intent_id,
+            amount=amount,
+            currency=currency,
+            client_secret=f'{intent_id}_secret',
+            status='succeeded',
+            latest_charge=f'ch_bench_{len(self.intents) + 1}',
+            metadata=kwargs.get('metadata', {}),
+        )
+        self.intents[intent_id] = intent
+        return intent
+
+    def modify(self, intent_id, **kwargs):
+        intent = self.intents[intent_id]
+        intent.amount = kwargs.get('amount', intent.amount)
+        return intent
+
+    def retrieve(self, intent_id, **kwargs):
+        return self.intents[intent_id]
+
+    @contextlib.contextmanager
+    def patch(self):
+        with mock.patch.object(stripe.PaymentIntent, 'create', side_effect=self.create), \
+                mock.patch.object(stripe.PaymentIntent, 'modify', side_effect=self.modify), \
+                mock.patch.object(stripe.PaymentIntent, 'retrieve', side_effect=self.retrieve):
+            yield self
+
+
+class Recorder:
+    """Время и число SQL-запросов каждого запроса к view, сгруппированные по сценарию"""
+
+    def __init__(self):
+        self.samples = {}
+        self.queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def request(self, client, name, method, path, record=True, **kwargs):
+        self.queries = 0
+        # Некоторые view печатают отладку в stdout - она не должна попасть в JSON
+        with connection.execute_wrapper(self.count_query), contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            response = getattr(client, method)(path, **kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        if record:
+            sample = self.samples.setdefault(name, {'latency': [], 'queries': [], 'status': {}})
+            sample['latency'].append(elapsed)
+            sample['queries'].append(self.queries)
+            sample['status'][response.status_code] = sample['status'].get(response.status_code, 0) + 1
+        return response
+
+    def report(self):
+        return {
+            name: {
+                'requests': len(sample['latency']),
+                'status': {str(code): count for code, count in sorted(sample['status'].items())},
+                'latency_ms': summarize(sample['latency']),
+                'queries': summarize(sample['queries'], digits=1),
+            }
+            for name, sample in sorted(self.samples.items())
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the main views through the Django test client and report latency percentiles '
+        'and SQL query counts as JSON. Run seed_store first; all writes are rolled back.'
+    )
+
+    scenarios = ('catalog', 'catalog_filtered', 'catalog_search', 'product_detail', 'review_list', 'checkout')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Unrecorded iterations to fill caches before measuring')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--scenario', action='append', choices=self.scenarios,
+                            help='Run only these scenarios (repeatable)')
+        parser.add_argument('--output', help='Write the JSON report to a file instead of stdout')
+
+    def handle(self, *args, **options):
+        if not Product.objects.exists():
+            raise CommandError('No products to benchmark, run seed_store first')
+
+        self.rng = random.Random(options['seed'])
+        self.recorder = Recorder()
+        self.client = Client()
+        scenarios = options['scenario'] or self.scenarios
+        self.load_targets()
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+                FakeStripe().patch(), transaction.atomic():
+            for iteration in range(options['warmup'] + options['iterations']):
+                record = iteration >= options['warmup']
+                for scenario in scenarios:
+                    getattr(self, f'run_{scenario}')(record)
+            # Заказы, списания и корзины бенчмарка не должны остаться в базе
+            transaction.set_rollback(True)
+
+        report = {
+            'meta': self.meta(options, scenarios),
+            'results': self.recorder.report(),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+            self.stderr.write(f'Benchmark report written to {options["output"]}')
+        else:
+            self.stdout.write(output)
+
+    def load_targets(self):
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+        self.product_ids = list(
+            Product.objects.order_by('-rating_count', 'id').values_list('id', 'slug')[:200]
+        )
+        self.reviewed_product_ids = list(
+            Product.objects.filter(rating_count__gt=0).order_by('-rating_count').values_list('id', flat=True)[:50]
+        )
+        self.stock = list(
+            ProductSize.objects.filter(stock__gte=10).order_by('id').values_list('product_id', 'size_id')[:200]
+        )
+        self.words = list(Product.objects.order_by('id').values_list('name', flat=True)[:200])
+
+    def meta(self, options, scenarios):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'seed': options['seed'],
+            'scenarios': list(scenarios),
+            'database': connection.vendor,
+            'products': Product.objects.count(),
+            'reviews': Review.objects.count(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
+
+    def run_catalog(self, record):
+        self.recorder.request(self.client, 'catalog', 'get', reverse('main:product_catalog'), record)
+
+    def run_catalog_filtered(self, record):
+        rng = self.rng
+        params = {
+            'category': rng.sample(self.category_ids, min(2, len(self.category_ids))),
+            'price_min': rng.choice((0, 50, 100)),
+            'price_max': rng.choice((150, 250, 400)),
+            'ordering': rng.choice(('price', '-price', '-created_at', '-rating')),
+        }
+        self.recorder.request(self.client, 'catalog_filtered', 'get', reverse('main:product_catalog'), record,
+                              data=params)
+
+    def run_catalog_search(self, record):
+        term = self.rng.choice(self.words).split()[self.rng.randrange(2)]
+        self.recorder.request(self.client, 'catalog_search', 'get', reverse('main:product_catalog'), record,
+                              data={'q': term})
+
+    def run_product_detail(self, record):
+        product_id, slug = self.rng.choice(self.product_ids)
+        self.recorder.request(self.client, 'product_detail', 'get',
+                              reverse('main:product_detail', args=[product_id, slug]), record)
+
+    def run_review_list(self, record):
+        if not self.reviewed_product_ids:
+            return
+        product_id = self.rng.choice(self.reviewed_product_ids)
+        self.recorder.request(self.client, 'review_list', 'get', reverse('reviews:review_list', args=[product_id]),
+                              record, data={'sort': self.rng.choice(('recent', 'helpful', 'rating_high'))},
+                              headers={'HX-Request': 'true'})
+
+    def run_checkout(self, record):
+        """Полный путь покупателя: корзина -> checkout -> оплата (фейковый Stripe) -> заказ"""
+        if not self.stock:
+            return
+        request = self.recorder.request
+        for product_id, size_id in self.rng.sample(self.stock, min(3, len(self.stock))):
+            request(self.client, 'cart_add', 'post', reverse('cart:cart_add', args=[product_id]), record,
+                    data={'size_id': size_id, 'quantity': 1})
+        request(self.client, 'cart_detail', 'get', reverse('cart:cart_detail'), record)
+        request(self.client, 'checkout', 'get', reverse('payments:checkout'), record)
+        request(self.client, 'checkout_submit', 'post', reverse('payments:checkout'), record, data=CHECKOUT_FORM)
+        request(self.client, 'payment_success', 'post', reverse('payments:payment_success'), record)
@@ -0,0 +1,141 @@
+import json
+import queue
+import threading
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from apps.main.helpful import current_count, rollup_votes, toggle_vote
+from apps.main.management.commands.benchmark import summarize
+from apps.main.review_models import Review, ReviewHelpful
+
+
+def row_update_vote(review, user):
+    """Прежняя схема: get_or_create голоса и helpful_count += 1 в Python - для сравнения"""
+    review = Review.objects.get(id=review.id)
+    _, created = ReviewHelpful.objects.get_or_create(review=review, user=user)
+    review.helpful_count += 1 if created else -1
+    review.save(update_fields=['helpful_count'])
+
+
+STRATEGIES = {
+    'journal': toggle_vote,
+    'row-update': row_update_vote,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Cast helpful votes for one review from many threads at once and report throughput, '
+        'latency percentiles and lost increments as JSON. Voters are temporary users, removed afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--review', type=int, help='Review id (default: the most voted review)')
+        parser.add_argument('--votes', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--hold-ms', type=float, default=5.0,
+                            help='Keep each vote transaction open this long, like the rest of a request')
+        parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='journal')
+
+    def handle(self, *args, **options):
+        review = self.pick_review(options['review'])
+        rollup_votes()
+        baseline = current_count(review.id)
+        voters = self.create_voters(options['votes'], review)
+        try:
+            latencies, errors, elapsed = self.run_votes(
+                review, voters, STRATEGIES[options['strategy']], options['threads'], options['hold_ms'] / 1000,
+            )
+            while rollup_votes():
+                pass
+            final = Review.objects.values_list('helpful_count', flat=True).get(id=review.id)
+        finally:
+            self.remove_voters(voters, review, baseline)
+
+        added = final - baseline
+        report = {
+            'review': review.id,
+            'strategy': options['strategy'],
+            'threads': options['threads'],
+            'hold_ms': options['hold_ms'],
+            'votes': len(voters),
+            'errors': errors,
+            'counted': added,
+            'lost_increments': len(voters) - errors - added,
+            'elapsed_s': round(elapsed, 3),
+            'votes_per_s': round(len(voters) / elapsed, 1),
+            'latency_ms': summarize(latencies) if latencies else None,
+            'database': connection.vendor,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def pick_review(self, review_id):
+        reviews = Review.objects.all()
+        if review_id is not None:
+            reviews = reviews.filter(id=review_id)
+        review = reviews.order_by('-helpful_count', 'id').first()
+        if review is None:
+            raise CommandError('No review to vote for, run seed_store first')
+        return review
+
+    def create_voters(self, count, review):
+        run = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        return User._default_manager.bulk_create([
+            User(email=f'helpful-bench-{run}-{index}@example.invalid', first_name='Bench', last_name='Voter')
+            for index in range(count)
+        ])
+
+    def run_votes(self, review, voters, vote, threads, hold):
+        pending = queue.Queue()
+        for voter in voters:
+            pending.put(voter)
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def worker():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        voter = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        # Транзакция как у запроса с ATOMIC_REQUESTS: держится до конца ответа
+                        with transaction.atomic():
+                            vote(review, voter)
+                            time.sleep(hold)
+                    except Exception as e:
+                        with lock:
+                            errors.append(repr(e))
+                        continue
+                    with lock:
+                        latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        return latencies, len(errors), time.perf_counter() - started
+
+    def remove_voters(self, voters, review, baseline):
+        # Голоса удаляются каскадом мимо журнала - счетчик возвращается вручную
+        get_user_model()._default_manager.filter(id__in=[voter.id for voter in voters]).delete()
+        rollup_votes()
+        Review.objects.filter(id=review.id).update(
+            helpful_count=F('helpful_count') - (current_count(review.id) - baseline)
+        )
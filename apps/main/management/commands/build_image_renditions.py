@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.main.models import ImageRenditions, Product, ProductImage
+from apps.main.renditions import enqueue_renditions
+from apps.main.review_models import ReviewImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue thumb/card/zoom renditions for existing product and review images '
+        '(process_image_renditions builds them)'
+    )
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in ((Product, 'main_image'), (ProductImage, 'image'), (ReviewImage, 'image')):
+            names.update(model.objects.exclude(**{field: ''}).values_list(field, flat=True).distinct())
+
+        queued_before = ImageRenditions.objects.count()
+        enqueue_renditions(names)
+        queued = ImageRenditions.objects.count() - queued_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Queued renditions for {queued} images ({len(names) - queued} already queued or built)'
+        ))
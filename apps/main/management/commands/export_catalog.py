@@ -0,0 +1,36 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.main.catalog_io import export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Export the catalog (products with category, stock per size and images) as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' for stdout")
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='File format (default: by extension)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Products fetched per server-side cursor round trip')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        started = time.perf_counter()
+        count = 0
+
+        stream = sys.stdout if options['path'] == '-' else open(options['path'], 'w', newline='', encoding='utf-8')
+        try:
+            for count, _ in enumerate(write_rows(export_rows(options['chunk_size']), stream, file_format), start=1):
+                if count % options['chunk_size'] == 0:
+                    self.stderr.write(f'{count} rows, {count / (time.perf_counter() - started):.0f} rows/s')
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)'
+        ))
@@ -0,0 +1,75 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.main.catalog_io import CatalogImporter, CatalogRowError, parse_row, read_rows
+from apps.main.facets import invalidate_facets
+from apps.main.reference import invalidate_reference
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream a CSV or JSONL catalog file and upsert categories, products, stock and images in chunks. '
+        'Products are matched by slug; columns missing from a row are left unchanged.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, '-' for stdin")
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='File format (default: by extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per transaction')
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Report and skip rows that fail validation instead of stopping')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        self.importer = CatalogImporter()
+        self.started = time.perf_counter()
+        self.skip_invalid = options['skip_invalid']
+        self.skipped = 0
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            chunk = []
+            for line_number, raw in read_rows(stream, file_format):
+                try:
+                    chunk.append(parse_row(line_number, raw))
+                except CatalogRowError as e:
+                    if not self.skip_invalid:
+                        raise CommandError(f'{e} (earlier chunks were imported)')
+                    self.report_skipped(e)
+                    continue
+                if len(chunk) >= options['chunk_size']:
+                    self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk)
+        except CatalogRowError as e:
+            raise CommandError(f'{e} (earlier chunks were imported)')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            # bulk_create не отправляет сигналы - сбрасываем кеши вручную
+            invalidate_facets()
+            invalidate_reference()
+
+        stats = self.importer.stats
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["rows"]} rows in {elapsed:.1f}s ({stats["rows"] / max(elapsed, 1e-9):.0f} rows/s): '
+            f'{stats["products_created"]} products created, {stats["products_updated"]} updated, '
+            f'{stats["stock_rows"]} stock rows, {stats["images"]} images added, {self.skipped} rows skipped'
+        ))
+
+    def report_skipped(self, error):
+        self.stderr.write(f'Skipped {error}')
+        self.skipped += 1
+
+    def import_chunk(self, chunk):
+        for error in self.importer.import_chunk(chunk, skip_invalid=self.skip_invalid):
+            self.report_skipped(error)
+        rows = self.importer.stats['rows']
+        elapsed = time.perf_counter() - self.started
+        self.stderr.write(f'{rows} rows, {rows / max(elapsed, 1e-9):.0f} rows/s')
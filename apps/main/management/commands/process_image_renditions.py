@@ -0,0 +1,17 @@
+from apps.main.queues import PoolWorkerCommand
+from apps.main.renditions import process_pending
+
+
+class Command(PoolWorkerCommand):
+    help = (
+        'Generate thumb/card/zoom renditions for queued product and review images in a process pool '
+        '(pages show the original until the renditions are ready)'
+    )
+    processes_setting = 'IMAGE_RENDITION_WORKERS'
+    batch_size_help = 'Images per batch (default: twice the pool size)'
+
+    def process_pending(self, executor, batch_size):
+        return process_pending(executor, batch_size=batch_size)
+
+    def report(self, succeeded, failed):
+        self.stdout.write(f'Built renditions for {succeeded} images, {failed} failed')
@@ -0,0 +1,17 @@
+from apps.main.queues import PoolWorkerCommand
+from apps.main.review_uploads import process_pending
+
+
+class Command(PoolWorkerCommand):
+    help = (
+        'Validate, strip EXIF, re-encode and resize queued review photos in a process pool '
+        'and attach them to their reviews (retries failed photos with exponential backoff)'
+    )
+    processes_setting = 'REVIEW_IMAGE_WORKERS'
+    batch_size_help = 'Photos per batch (default: twice the pool size)'
+
+    def process_pending(self, executor, batch_size):
+        return process_pending(executor, batch_size=batch_size)
+
+    def report(self, succeeded, failed):
+        self.stdout.write(f'Attached {succeeded} review images, {failed} failed')
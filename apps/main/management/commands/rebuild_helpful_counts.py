@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.main.helpful import rebuild_helpful_counts
+
+
+class Command(BaseCommand):
+    help = 'Recalculate Review.helpful_count from ReviewHelpful votes (fixes drift)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = rebuild_helpful_counts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Helpful counts fixed for {updated} reviews'))
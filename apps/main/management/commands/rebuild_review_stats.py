@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.main.ratings import rebuild_product_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recalculate per-product review statistics (average, count, star histogram) from Review'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = rebuild_product_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Review statistics rebuilt for {updated} products'))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.main.helpful import rollup_votes
+
+
+class Command(BaseCommand):
+    help = 'Fold the helpful-vote journal into Review.helpful_count in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the journal is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the journal and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            close_old_connections()
+            folded = rollup_votes(batch_size=batch_size)
+            if folded:
+                self.stdout.write(f'Folded {folded} helpful votes')
+
+            # Полная пачка - вероятно, в журнале есть еще, берем следующую сразу
+            if folded >= batch_size:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,251 @@
+import itertools
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.main.facets import invalidate_facets
+from apps.main.models import Category, Product, ProductSize, Size
+from apps.main.ratings import rebuild_product_ratings
+from apps.main.reference import invalidate_reference
+from apps.main.review_models import Review, ReviewHelpful
+from apps.payments.models import Order, OrderItem
+
+
+# Все сгенерированные данные помечены так, чтобы их можно было найти и удалить
+SEED_PREFIX = 'seed-'
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+SEED_PASSWORD = 'seed-password'
+
+SIZES = ('XS', 'S', 'M', 'L', 'XL', 'XXL')
+COLORS = ('black', 'white', 'grey', 'navy', 'red', 'green', 'beige', 'brown', 'olive', 'blue')
+ADJECTIVES = ('Classic', 'Oversized', 'Slim', 'Relaxed', 'Cropped', 'Vintage', 'Technical', 'Heavy', 'Light', 'Urban')
+NOUNS = ('Hoodie', 'Jacket', 'Coat', 'Shirt', 'Tee', 'Sweater', 'Jeans', 'Cargo', 'Parka', 'Vest', 'Shorts', 'Blazer')
+WORDS = (
+    'fit', 'fabric', 'quality', 'color', 'size', 'warm', 'soft', 'comfortable', 'delivery', 'price',
+    'great', 'good', 'bad', 'stitching', 'pockets', 'washes', 'well', 'true', 'small', 'large',
+)
+HISTORY_DAYS = 180
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic store (catalog, users, reviews, helpful votes, orders)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--helpful-votes', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=3000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete previously seeded data first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            if options['replace']:
+                self.delete_seeded()
+            elif Product.objects.filter(slug__startswith=SEED_PREFIX).exists():
+                raise CommandError('Seeded data already exists, use --replace to regenerate it')
+
+            sizes = self.create_sizes()
+            categories = self.create_categories(options['categories'])
+            products = self.create_products(options['products'], categories)
+            product_sizes = self.create_stock(products, sizes)
+            users = self.create_users(options['users'])
+            reviews = self.create_reviews(options['reviews'], products, users, options['helpful_votes'])
+            orders = self.create_orders(options['orders'], product_sizes, users)
+
+            rebuild_product_ratings(batch_size=self.batch_size)
+
+        # bulk_create не отправляет сигналы - сбрасываем кеши вручную
+        invalidate_facets()
+        invalidate_reference()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(categories)} categories, {len(products)} products, {len(product_sizes)} stock rows, '
+            f'{len(users)} users, {reviews} reviews, {orders} orders '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def delete_seeded(self):
+        User = get_user_model()
+        Order.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').delete()
+        Product.objects.filter(slug__startswith=SEED_PREFIX).delete()
+        Category.objects.filter(slug__startswith=SEED_PREFIX).delete()
+        User._default_manager.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').delete()
+
+    def past(self, days=HISTORY_DAYS):
+        return timezone.now() - timedelta(seconds=self.rng.randrange(days * 24 * 60 * 60))
+
+    def create_sizes(self):
+        existing = {size.name: size for size in Size.objects.filter(name__in=SIZES)}
+        missing = Size.objects.bulk_create([Size(name=name) for name in SIZES if name not in existing])
+        existing.update((size.name, size) for size in missing)
+        return [existing[name] for name in SIZES]
+
+    def create_categories(self, count):
+        categories = [
+            Category(name=f'{NOUNS[index % len(NOUNS)]}s {index + 1}', slug=f'{SEED_PREFIX}category-{index + 1}')
+            for index in range(count)
+        ]
+        return Category.objects.bulk_create(categories)
+
+    def create_products(self, count, categories):
+        rng = self.rng
+        products = []
+        for index in range(count):
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index + 1}'
+            products.append(Product(
+                name=name,
+                slug=f'{SEED_PREFIX}product-{index + 1}',
+                description=' '.join(rng.choices(WORDS, k=rng.randint(10, 40))),
+                price=Decimal(rng.randint(1500, 40000)) / 100,
+                color=rng.choice(COLORS),
+                category=rng.choice(categories),
+                status_discount=rng.random() < 0.2,
+            ))
+        products = Product.objects.bulk_create(products, batch_size=self.batch_size)
+
+        # created_at - auto_now_add: bulk_create перезаписывает его текущим временем,
+        # поэтому даты в прошлом проставляем отдельным bulk_update
+        for product in products:
+            product.created_at = self.past()
+        Product.objects.bulk_update(products, ['created_at'], batch_size=self.batch_size)
+        return products
+
+    def create_stock(self, products, sizes):
+        rng = self.rng
+        product_sizes = []
+        for product in products:
+            for size in rng.sample(sizes, rng.randint(2, len(sizes))):
+                # Часть размеров распродана - так выглядит реальный каталог
+                stock = 0 if rng.random() < 0.1 else rng.randint(1, 50)
+                product_sizes.append(ProductSize(product=product, size=size, stock=stock))
+        return ProductSize.objects.bulk_create(product_sizes, batch_size=self.batch_size)
+
+    def create_users(self, count):
+        User = get_user_model()
+        # Хешировать пароль для каждого пользователя слишком долго, у всех один
+        password = make_password(SEED_PASSWORD)
+        users = [
+            User(
+                email=f'user{index + 1}@{SEED_EMAIL_DOMAIN}',
+                first_name=f'User{index + 1}',
+                last_name='Seed',
+                password=password,
+                city='Seed City',
+                country='Seedland',
+            )
+            for index in range(count)
+        ]
+        return User._default_manager.bulk_create(users, batch_size=self.batch_size)
+
+    def create_reviews(self, count, products, users, helpful_votes):
+        rng = self.rng
+        # Популярные товары получают больше отзывов (распределение с длинным хвостом)
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(products))))
+        pairs = set()
+        attempts = 0
+        while len(pairs) < count and attempts < count * 5:
+            attempts += 1
+            product = rng.choices(products, cum_weights=cum_weights)[0]
+            pairs.add((product.id, rng.choice(users).id))
+
+        reviews = []
+        for product_id, user_id in sorted(pairs):
+            rating = rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 2, 4, 6))[0]
+            reviews.append(Review(
+                product_id=product_id,
+                user_id=user_id,
+                rating=rating,
+                title=' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize(),
+                content=' '.join(rng.choices(WORDS, k=rng.randint(10, 80))).capitalize(),
+                is_verified_purchase=rng.random() < 0.6,
+            ))
+
+        votes = set()
+        if reviews:
+            attempts = 0
+            while len(votes) < helpful_votes and attempts < helpful_votes * 5:
+                attempts += 1
+                votes.add((rng.randrange(len(reviews)), rng.choice(users).id))
+        for index, _ in votes:
+            reviews[index].helpful_count += 1
+
+        reviews = Review.objects.bulk_create(reviews, batch_size=self.batch_size)
+        for review in reviews:
+            review.created_at = self.past()
+        Review.objects.bulk_update(reviews, ['created_at'], batch_size=self.batch_size)
+
+        ReviewHelpful.objects.bulk_create(
+            [ReviewHelpful(review=reviews[index], user_id=user_id) for index, user_id in sorted(votes)],
+            batch_size=self.batch_size,
+        )
+        return len(reviews)
+
+    def create_orders(self, count, product_sizes, users):
+        rng = self.rng
+        statuses = ('paid', 'paid', 'paid', 'shipped', 'delivered', 'delivered', 'cancelled', 'refunded')
+        orders = []
+        order_lines = []
+        for index in range(count):
+            user = rng.choice(users) if rng.random() < 0.7 else None
+            lines = [
+                (product_size, rng.randint(1, 3))
+                for product_size in rng.sample(product_sizes, rng.randint(1, 4))
+            ]
+            subtotal = sum(product_size.product.price * quantity for product_size, quantity in lines)
+            shipping = Decimal('0.00') if subtotal >= 200 else Decimal('15.00')
+            tax = ((subtotal + shipping) * Decimal('0.10')).quantize(Decimal('0.01'))
+            orders.append(Order(
+                user=user,
+                email=user.email if user else f'guest{index + 1}@{SEED_EMAIL_DOMAIN}',
+                first_name=user.first_name if user else 'Guest',
+                last_name='Seed',
+                phone='+10000000000',
+                address_line1=f'{index + 1} Seed street',
+                city='Seed City',
+                postal_code='00000',
+                country='Seedland',
+                total_amount=subtotal + shipping + tax,
+                shipping_cost=shipping,
+                tax_amount=tax,
+                status=rng.choice(statuses),
+                stripe_payment_intent_id=f'pi_{SEED_PREFIX}{index + 1}',
+                stripe_charge_id=f'ch_{SEED_PREFIX}{index + 1}',
+            ))
+            order_lines.append(lines)
+
+        orders = Order.objects.bulk_create(orders, batch_size=self.batch_size)
+        for order in orders:
+            order.created_at = self.past()
+        Order.objects.bulk_update(orders, ['created_at'], batch_size=self.batch_size)
+
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product=product_size.product,
+                    size=product_size,
+                    price=product_size.product.price,
+                    quantity=quantity,
+                )
+                for order, lines in zip(orders, order_lines)
+                for product_size, quantity in lines
+            ],
+            batch_size=self.batch_size,
+        )
+        return len(orders)
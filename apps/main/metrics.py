@@ -0,0 +1,190 @@
+import bisect
+import contextlib
+import contextvars
+import heapq
+import threading
+import time
+
+from django.db import connections
+
+
+# Верхние границы корзин гистограммы, мс (последняя - все, что дольше)
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+SLOWEST_QUERIES = 3
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Метрики одного запроса: SQL (количество, суммарное время, самые медленные),
+    и именованные таймеры (шаблоны, Stripe). Активный экземпляр лежит в
+    contextvar, поэтому хуки в любом месте кода пишут в метрики своего запроса.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []
+        self.timers = {}
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            entry = (duration, self.queries, sql)
+            if len(self.slowest) < SLOWEST_QUERIES:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def slowest_queries(self):
+        return [
+            {'ms': round(duration * 1000, 2), 'sql': sql[:500]}
+            for duration, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+@contextlib.contextmanager
+def collect():
+    """Собирать метрики для кода внутри блока (все подключения к БД)"""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.execute_wrapper))
+            yield metrics
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Засечь время блока в метриках текущего запроса, например:
+        with metrics.timer('stripe'):
+            stripe.PaymentIntent.retrieve(...)
+    Вне запроса (команды, воркеры) ничего не делает.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, time.perf_counter() - started)
+
+
+def instrument_templates():
+    """
+    Учитывать время рендера шаблонов Django в таймере 'template'.
+    Оборачивается верхний уровень (render/render_to_string); вложенные
+    include уже входят в его время, вложенный render_to_string не считается дважды.
+    """
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'instrumented', False):
+        return
+    original = Template.render
+    depth = contextvars.ContextVar('template_render_depth', default=0)
+
+    def render(self, context=None, request=None):
+        if _current.get() is None or depth.get():
+            return original(self, context, request)
+        token = depth.set(1)
+        try:
+            with timer('template'):
+                return original(self, context, request)
+        finally:
+            depth.reset(token)
+
+    render.instrumented = True
+    Template.render = render
+
+
+class LatencyHistograms:
+    """Гистограммы времени ответа и числа запросов по имени URL, в памяти процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, name, milliseconds, queries):
+        index = bisect.bisect_left(LATENCY_BUCKETS, milliseconds)
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                entry = self._data[name] = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'queries': 0,
+                    'max_queries': 0,
+                    'buckets': [0] * len(LATENCY_BUCKETS),
+                }
+            entry['count'] += 1
+            entry['total_ms'] += milliseconds
+            entry['max_ms'] = max(entry['max_ms'], milliseconds)
+            entry['queries'] += queries
+            entry['max_queries'] = max(entry['max_queries'], queries)
+            entry['buckets'][index] += 1
+
+    def snapshot(self):
+        with self._lock:
+            data = {name: dict(entry, buckets=list(entry['buckets'])) for name, entry in self._data.items()}
+
+        result = {}
+        for name, entry in sorted(data.items()):
+            count = entry['count']
+            result[name] = {
+                'count': count,
+                'mean_ms': round(entry['total_ms'] / count, 2),
+                'max_ms': round(entry['max_ms'], 2),
+                'p50_ms': _bucket_percentile(entry['buckets'], count, 50),
+                'p95_ms': _bucket_percentile(entry['buckets'], count, 95),
+                'p99_ms': _bucket_percentile(entry['buckets'], count, 99),
+                'mean_queries': round(entry['queries'] / count, 1),
+                'max_queries': entry['max_queries'],
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else str(bound)): bucket
+                    for bound, bucket in zip(LATENCY_BUCKETS, entry['buckets'])
+                },
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _bucket_percentile(buckets, count, percent):
+    """Верхняя граница корзины, в которую попадает процентиль (None для последней)"""
+    target = percent / 100 * count
+    seen = 0
+    for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+        seen += bucket
+        if seen >= target:
+            return None if bound == float('inf') else bound
+    return None
+
+
+histograms = LatencyHistograms()
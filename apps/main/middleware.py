@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from apps.main import metrics, routers, versions
+
+logger = logging.getLogger('apps.main.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Для каждого запроса: число SQL-запросов и время БД, самые медленные
+    запросы, время шаблонов и Stripe. Результат - заголовок Server-Timing,
+    строка лога в JSON и гистограммы по имени URL (apps.main.metrics.histograms,
+    staff-страница request_metrics).
+
+    Ставится первым в MIDDLEWARE, чтобы total включал остальные middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        metrics.instrument_templates()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with metrics.collect() as collected:
+            response = self.get_response(request)
+        return self.finish(request, response, collected)
+
+    async def __acall__(self, request):
+        with metrics.collect() as collected:
+            response = await self.get_response(request)
+        return self.finish(request, response, collected)
+
+    def finish(self, request, response, collected):
+        total_ms = collected.total_time * 1000
+        view_name = self.view_name(request)
+        metrics.histograms.record(view_name, total_ms, collected.queries)
+
+        if getattr(settings, 'SERVER_TIMING_HEADER', True):
+            response['Server-Timing'] = self.server_timing(collected, total_ms)
+
+        if logger.isEnabledFor(logging.INFO):
+            self.log(request, response, view_name, collected, total_ms)
+        return response
+
+    @staticmethod
+    def log(request, response, view_name, collected, total_ms):
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'queries': collected.queries,
+            'db_ms': round(collected.db_time * 1000, 2),
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in collected.timers.items()},
+            'slowest_queries': collected.slowest_queries(),
+        }))
+
+    @staticmethod
+    def view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '<unresolved>'
+        return match.view_name or match._func_path
+
+    @staticmethod
+    def server_timing(collected, total_ms):
+        entries = [f'db;dur={collected.db_time * 1000:.2f};desc="{collected.queries} queries"']
+        entries += [
+            f'{name};dur={seconds * 1000:.2f}'
+            for name, seconds in sorted(collected.timers.items())
+        ]
+        entries.append(f'total;dur={total_ms:.2f}')
+        return ', '.join(entries)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Read-your-writes для ReplicaRouter: после запроса, в котором пользователь
+    что-то записал в каталог или отзывы (отзыв, заказ со списанием остатков),
+    ставится cookie, и следующие REPLICA_STICKY_SECONDS все его чтения
+    идут на primary, пока реплики догоняют.
+    """
+    cookie_name = 'db_primary_until'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.state(request)
+        token = routers.activate(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = self.state(request)
+        token = routers.activate(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state)
+
+    def state(self, request):
+        try:
+            primary_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            primary_until = 0
+        return routers.ReplicaState(pinned=primary_until > time.time())
+
+    def finish(self, response, state):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            sticky = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                self.cookie_name, f'{time.time() + sticky:.0f}',
+                max_age=sticky, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class VersionMemoMiddleware:
+    """
+    Версии общего кеша (apps.main.versions) читаются в запросе один раз:
+    справочники, фасеты и ETag обращаются к ним много раз за рендеринг.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = versions.activate()
+        try:
+            return self.get_response(request)
+        finally:
+            versions.deactivate(token)
+
+    async def __acall__(self, request):
+        token = versions.activate()
+        try:
+            return await self.get_response(request)
+        finally:
+            versions.deactivate(token)
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:32
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+SEARCH_VECTOR_SQL = """
+CREATE FUNCTION main_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(
+            (SELECT name FROM main_category WHERE id = NEW.category_id), ''
+        )), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description, category_id ON main_product
+    FOR EACH ROW EXECUTE FUNCTION main_product_search_vector_update();
+
+CREATE FUNCTION main_category_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE main_product SET name = name WHERE category_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_category_search_vector_trigger
+    AFTER UPDATE OF name ON main_category
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION main_category_search_vector_update();
+
+UPDATE main_product SET name = name;
+"""
+
+SEARCH_VECTOR_REVERSE_SQL = """
+DROP TRIGGER IF EXISTS main_category_search_vector_trigger ON main_category;
+DROP FUNCTION IF EXISTS main_category_search_vector_update();
+DROP TRIGGER IF EXISTS main_product_search_vector_trigger ON main_product;
+DROP FUNCTION IF EXISTS main_product_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_product_keyset_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='main_product_search_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='main_product_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('color'), name='gin_trgm_ops'), name='main_product_color_trgm'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, SEARCH_VECTOR_REVERSE_SQL),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:34
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q
+
+
+def fill_rating_summary(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    Review = apps.get_model('main', 'Review')
+    summaries = Review.objects.order_by().values('product_id').annotate(
+        avg=Avg('rating'),
+        total=Count('id'),
+        **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+    )
+    for row in summaries.iterator():
+        Product.objects.filter(id=row['product_id']).update(
+            rating_avg=round(row['avg'], 2),
+            rating_count=row['total'],
+            **{f'rating_{rating}': row[f'rating_{rating}'] for rating in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_avg', 'id'], name='main_produc_rating__89f60c_idx'),
+        ),
+        migrations.RunPython(fill_rating_summary, migrations.RunPython.noop),
+    ]
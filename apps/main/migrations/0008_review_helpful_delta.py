@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_product_rating_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewHelpfulDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.SmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='helpful_deltas', to='main.review')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def swap_timestamps(apps, schema_editor):
+    # auto_now и auto_now_add были перепутаны: в created_at лежит время последнего
+    # сохранения, в updated_at - создания. В UPDATE правые части берутся из старой строки.
+    Product = apps.get_model('main', 'Product')
+    Product.objects.update(created_at=F('updated_at'), updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_review_image_uploads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(swap_timestamps, swap_timestamps),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='main_produc_updated_32fc5b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-updated_at'], name='main_review_product_3285e3_idx'),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
+from django.utils import timezone
 from django.utils.text import slugify
 
 class Category(models.Model):
@@ -28,8 +32,10 @@ class Product(models.Model):
     slug = models.SlugField(max_length=58, unique=True)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    created_at = models.DateTimeField(auto_now=True)
-    updated_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Меняется и вместе со сводкой отзывов - входит в ETag страниц товара и каталога
+    # (apps.main.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
     color = models.CharField(max_length=100)
     main_image = models.ImageField(upload_to='products/main/')
 
@@ -37,6 +43,33 @@ class Product(models.Model):
 
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name = 'products')
 
+    # Заполняется триггером в БД (название, категория, описание), см. apps.main.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Сводка по отзывам, обновляется в apps.main.ratings вместе с отзывом
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # Составные индексы под курсорную пагинацию каталога (сортировка + id)
+        indexes = [
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['rating_avg', 'id']),
+            # Последнее изменение каталога для ETag (apps.main.conditional.catalog_version)
+            models.Index(fields=['updated_at']),
+            GinIndex(fields=['search_vector'], name='main_product_search_gin'),
+            # icontains на PostgreSQL - это UPPER(col) LIKE UPPER(...), индекс по тому же выражению
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='main_product_name_trgm'),
+            GinIndex(OpClass(Upper('color'), name='gin_trgm_ops'), name='main_product_color_trgm'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -49,4 +82,40 @@ class ProductImage(models.Model):
     image = models.ImageField(upload_to='products/extra/')
 
 
-from apps.main.review_models import Review, ReviewImage, ReviewHelpful
+class ImageRenditions(models.Model):
+    """
+    Производные оригинала name (apps.main.images): строка - задание очереди
+    команды process_image_renditions, после обработки в manifest - манифест
+    производных. Пока задание не выполнено, страницы показывают оригинал.
+    failed - оригинал битый или не обработался за RETRY_POLICY.max_attempts попыток.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255, unique=True)
+    manifest = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Очередь воркера: pending с наступившим next_attempt_at
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                name='main_rendition_queue_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+from apps.main.review_models import Review, ReviewImage, ReviewImageUpload, ReviewHelpful, ReviewHelpfulDelta
@@ -0,0 +1,127 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder обрезает микросекунды, а курсору нужно точное значение
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Курсорная (keyset) пагинация: каждая страница - это WHERE по значениям
+    последней строки предыдущей страницы, поэтому страница N стоит столько же,
+    сколько первая, без OFFSET и COUNT(*).
+
+    ordering - поля сортировки, последним должен идти уникальный ключ (id),
+    иначе строки с одинаковым значением будут теряться на границе страниц.
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field, _ in self.fields]
+        raw = json.dumps({'o': self.ordering, 'v': values}, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Значения ключа из курсора, приведенные к типам полей сортировки.
+        Курсор приходит от клиента: любой неверный - InvalidCursor, а не 500.
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            ordering, values = tuple(data['o']), data['v']
+            # Курсор от другой сортировки не имеет смысла для текущей выборки
+            if ordering != self.ordering or not isinstance(values, list) or len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            return [self._to_python(field, value) for (field, _), value in zip(self.fields, values)]
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise InvalidCursor(cursor)
+
+    def _to_python(self, name, value):
+        if value is None:
+            raise ValueError(f'{name} is null')
+        # Поле сортировки - поле модели или аннотация (search_rank)
+        annotation = self.queryset.query.annotations.get(name)
+        field = annotation.output_field if annotation is not None else self.queryset.model._meta.get_field(name)
+        return field.to_python(value)
+
+    def _after(self, values):
+        """
+        Условие "строго после" для составного ключа:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.fields, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        return KeysetPage(rows, next_cursor)
+
+
+def approximate_table_count(model, using=None):
+    """Оценка размера всей таблицы из статистики pg_class (reltuples)"""
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return model._default_manager.using(using).count()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # reltuples = -1, пока таблицу ни разу не анализировали
+    if row is None or row[0] < 0:
+        return model._default_manager.using(using).count()
+    return row[0]
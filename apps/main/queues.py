@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+# Общее для очередей в БД (фото отзывов apps.main.review_uploads, производные
+# apps.main.renditions, webhook Stripe apps.payments.webhooks): повторы с
+# экспоненциальной паузой и команда-воркер, которая разбирает очередь пачками.
+# Сама пачка (SELECT ... FOR UPDATE SKIP LOCKED и обработка) - в модуле очереди.
+
+
+class RetryPolicy:
+    """Повторы с паузой base_delay, 2 * base_delay, 4 * base_delay ... но не больше max_delay"""
+
+    def __init__(self, max_attempts, base_delay=30, max_delay=60 * 60):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def exhausted(self, attempts):
+        """Попытки кончились - задание получает статус failed"""
+        return attempts >= self.max_attempts
+
+    def delay(self, attempts):
+        """Пауза перед следующей попыткой после attempts неудачных"""
+        return timedelta(seconds=min(self.base_delay * 2 ** (attempts - 1), self.max_delay))
+
+
+class QueueWorkerCommand(BaseCommand):
+    """
+    Команда-воркер очереди: берет пачки process_batch, пока они полные, потом
+    ждет --interval секунд (или завершается с --once). Подкласс задает
+    process_batch и report.
+    """
+    default_batch_size = 100
+    batch_size_help = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=self.default_batch_size, help=self.batch_size_help)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever')
+
+    def process_batch(self, batch_size):
+        """Обработать одну пачку очереди, вернуть (успешно, с ошибкой)"""
+        raise NotImplementedError
+
+    def report(self, succeeded, failed):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        self.run(options['batch_size'], options['interval'], options['once'])
+
+    def run(self, batch_size, interval, once):
+        while True:
+            close_old_connections()
+            succeeded, failed = self.process_batch(batch_size)
+            if succeeded or failed:
+                self.report(succeeded, failed)
+
+            # Полная пачка - вероятно, в очереди есть еще, берем следующую сразу
+            if succeeded + failed >= batch_size:
+                continue
+            if once:
+                break
+            time.sleep(interval)
+
+
+class PoolWorkerCommand(QueueWorkerCommand):
+    """
+    Воркер, который обрабатывает пачку в пуле процессов: размер пула
+    (--processes, по умолчанию settings.<processes_setting>) ограничивает
+    нагрузку на CPU. Подкласс задает process_pending(executor, batch_size).
+    """
+    default_batch_size = None
+    processes_setting = None
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--processes', type=int, default=getattr(settings, self.processes_setting),
+                            help='Size of the image processing pool')
+
+    def process_pending(self, executor, batch_size):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        self.processes = max(1, options['processes'])
+        # Пачка по умолчанию - вдвое больше пула
+        batch_size = options['batch_size'] or self.processes * 2
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            self.run(batch_size, options['interval'], options['once'])
+        finally:
+            self.executor.shutdown()
+
+    def process_batch(self, batch_size):
+        while True:
+            try:
+                return self.process_pending(self.executor, batch_size)
+            except BrokenProcessPool as e:
+                # Процесс пула умер - попытки пачки уже записаны, пул создается заново
+                self.stderr.write(f'Image pool broke ({e}), restarting it')
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = ProcessPoolExecutor(max_workers=self.processes)
@@ -0,0 +1,111 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count, DecimalField, F, Q, Value
+from django.db.models.functions import Cast, Coalesce, Now, NullIf
+from django.utils import timezone
+
+from apps.main.models import Product
+from apps.main.review_models import Review
+
+
+RATINGS = (1, 2, 3, 4, 5)
+
+
+def rating_stats(product):
+    """Статистика отзывов для шаблонов (те же ключи, что раньше давал aggregate())"""
+    return {
+        'avg_rating': product.rating_avg if product.rating_count else None,
+        'total_reviews': product.rating_count,
+        'rating_5': product.rating_5,
+        'rating_4': product.rating_4,
+        'rating_3': product.rating_3,
+        'rating_2': product.rating_2,
+        'rating_1': product.rating_1,
+    }
+
+
+def update_product_rating(product_id, added=None, removed=None):
+    """
+    Применить к сводке Product изменение одного отзыва:
+    создание - added=rating, удаление - removed=rating, правка - оба.
+
+    Один UPDATE с F-выражениями: конкурентные отзывы на один товар
+    не теряют инкременты, а среднее считается из уже новых счетчиков.
+    """
+    deltas = dict.fromkeys(RATINGS, 0)
+    if added:
+        deltas[added] += 1
+    if removed:
+        deltas[removed] -= 1
+    if not any(deltas.values()):
+        return
+
+    counts = {rating: F(f'rating_{rating}') + deltas[rating] for rating in RATINGS}
+    total = F('rating_count') + sum(deltas.values())
+    weighted = sum((rating * counts[rating] for rating in RATINGS), Value(0))
+    average = Coalesce(
+        Cast(weighted, DecimalField(max_digits=12, decimal_places=4)) / NullIf(total, 0),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+    with transaction.atomic():
+        # Сводка видна на страницах товара и каталога - updated_at меняется вместе с ней (ETag)
+        Product.objects.filter(id=product_id).update(
+            updated_at=Now(),
+            rating_avg=average,
+            rating_count=total,
+            **{f'rating_{rating}': counts[rating] for rating in RATINGS},
+        )
+
+
+def rebuild_product_ratings(batch_size=1000):
+    """
+    Пересчитать сводки всех товаров из Review (исправление расхождений).
+    Записываются только товары, у которых сводка разошлась с отзывами: updated_at
+    входит в ETag (apps.main.conditional), и пересчет без изменений не должен
+    сбрасывать кеш страниц. Возвращает количество обновленных товаров.
+    """
+    summary_fields = ['rating_avg', 'rating_count'] + [f'rating_{rating}' for rating in RATINGS]
+    summaries = (
+        Review.objects
+        .order_by()
+        # Текущая сводка товара - для сравнения с пересчитанной
+        .values('product_id', *(f'product__{field}' for field in summary_fields))
+        .annotate(
+            avg=Avg('rating'),
+            total=Count('id'),
+            **{f'count_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS},
+        )
+    )
+
+    fields = summary_fields + ['updated_at']
+    updated = 0
+    batch = []
+    now = timezone.now()
+    with transaction.atomic():
+        for row in summaries.iterator(chunk_size=batch_size):
+            product = Product(id=row['product_id'], updated_at=now)
+            # Округление как у numeric в PostgreSQL (update_product_rating): 4.125 -> 4.13
+            product.rating_avg = Decimal(str(row['avg'])).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            product.rating_count = row['total']
+            for rating in RATINGS:
+                setattr(product, f'rating_{rating}', row[f'count_{rating}'])
+            if all(getattr(product, field) == row[f'product__{field}'] for field in summary_fields):
+                continue
+            batch.append(product)
+            if len(batch) >= batch_size:
+                updated += Product.objects.bulk_update(batch, fields)
+                batch = []
+        if batch:
+            updated += Product.objects.bulk_update(batch, fields)
+
+        # Товары, у которых отзывов больше нет, но в сводке что-то осталось
+        updated += (
+            Product.objects
+            .exclude(id__in=Review.objects.values('product_id'))
+            .exclude(rating_count=0)
+            .update(rating_avg=0, rating_count=0, updated_at=now, **{f'rating_{rating}': 0 for rating in RATINGS})
+        )
+    return updated
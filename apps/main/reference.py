@@ -0,0 +1,58 @@
+import threading
+
+from apps.main.versions import bump_version, get_version
+
+
+REFERENCE_VERSION_KEY = 'catalog:reference:version'
+
+# model -> (версия, кортеж объектов); у каждого процесса (воркера) свой
+_loaded = {}
+_lock = threading.Lock()
+
+
+def reference_version():
+    return get_version(REFERENCE_VERSION_KEY)
+
+
+def invalidate_reference():
+    """Все процессы перечитают справочники при следующем обращении"""
+    bump_version(REFERENCE_VERSION_KEY)
+
+
+def reference_objects(model):
+    """
+    Все объекты справочной модели (Category, Size) из памяти процесса.
+
+    Справочники почти не меняются, поэтому читаются из БД один раз и дальше
+    отдаются без запросов. Актуальность проверяется по версии в общем кеше
+    Django (settings.CACHES), которую меняют сигналы post_save/post_delete:
+    после правки в админке каждый воркер перечитает таблицу один раз. В запросе
+    версия читается из кеша один раз (apps.main.versions), повторные обращения
+    (фильтры, выбор в форме, карточки) запросов не делают.
+    """
+    version = reference_version()
+    loaded = _loaded.get(model)
+    if loaded is None or loaded[0] != version:
+        with _lock:
+            loaded = _loaded.get(model)
+            if loaded is None or loaded[0] != version:
+                ordering = model._meta.ordering or ['pk']
+                loaded = _loaded[model] = (version, tuple(model._default_manager.order_by(*ordering)))
+    return loaded[1]
+
+
+def attach_reference(objects, field_name):
+    """
+    Проставить объектам FK на справочник из кеша вместо select_related/prefetch:
+    attach_reference(product.productsize_set.all(), 'size')
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    field = objects[0]._meta.get_field(field_name)
+    by_pk = {obj.pk: obj for obj in reference_objects(field.related_model)}
+    for obj in objects:
+        related = by_pk.get(getattr(obj, field.attname))
+        if related is not None:
+            setattr(obj, field_name, related)
+    return objects
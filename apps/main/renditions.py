@@ -0,0 +1,208 @@
+import hashlib
+import logging
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from apps.main.images import generate_renditions
+from apps.main.models import ImageRenditions
+from apps.main.queues import RetryPolicy
+from apps.main.versions import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+
+# Производные (apps.main.images) не создаются при рендеринге страницы: оригинал
+# ставится в очередь ImageRenditions (при сохранении модели или при первом
+# показе), а пул процессов команды process_image_renditions создает файлы и
+# записывает манифест (process_pending). Пока манифеста нет, страница
+# показывает оригинал. Манифест читается из общего кеша, при промахе - из БД;
+# view читает манифесты всех фото страницы разом (attach_renditions).
+
+MANIFEST_CACHE_PREFIX = 'image:renditions:'
+VERSION_KEY = 'image:renditions:version'
+# Пока производных нет, страницы спрашивают БД не чаще раза в минуту на фото
+PENDING_MANIFEST_TIMEOUT = 60
+# Битые оригиналы - раз в 10 минут
+FAILED_MANIFEST_TIMEOUT = 60 * 10
+NO_RENDITIONS = {'hash': None, 'renditions': {}}
+# Атрибут FieldFile с уже прочитанным манифестом (attach_renditions)
+MANIFEST_ATTR = '_renditions_manifest'
+# 5 попыток с паузой 30с, 1м, 2м, 4м: обычно оригинал еще не виден в хранилище
+RETRY_POLICY = RetryPolicy(max_attempts=5)
+
+
+def _manifest_key(name):
+    return MANIFEST_CACHE_PREFIX + hashlib.md5(name.encode()).hexdigest()
+
+
+def renditions_version():
+    """Меняется, когда готовы новые производные - входит в ETag страниц (apps.main.conditional)"""
+    return get_version(VERSION_KEY)
+
+
+def enqueue_renditions(names):
+    """
+    Поставить оригиналы в очередь, если их там еще нет. Строка очереди пишется
+    прямо в default мимо роутера: служебная запись со страницы не должна
+    переводить чтения пользователя на primary (apps.main.routers).
+    """
+    names = {name for name in names if name}
+    if names:
+        ImageRenditions.objects.using('default').bulk_create(
+            [ImageRenditions(name=name) for name in sorted(names)],
+            ignore_conflicts=True,
+        )
+
+
+def attach_renditions(field_files):
+    """
+    Прочитать манифесты всех фото страницы одним cache.get_many (промахи - одним
+    запросом к ImageRenditions) и запомнить их на самих FieldFile: теги шаблона
+    (rendition_url, srcset) для этих фото кеш больше не читают.
+    attach_renditions(product.main_image for product in page)
+    """
+    pending = {}
+    for field_file in field_files:
+        if field_file and not hasattr(field_file, MANIFEST_ATTR):
+            pending.setdefault(field_file.name, []).append(field_file)
+    if not pending:
+        return
+
+    keys = {_manifest_key(name): name for name in pending}
+    manifests = {keys[key]: manifest for key, manifest in cache.get_many(keys).items()}
+    missing = [name for name in pending if name not in manifests]
+    if missing:
+        jobs = {
+            job['name']: job
+            for job in ImageRenditions.objects.filter(name__in=missing).values('name', 'status', 'manifest')
+        }
+        timeouts = {}
+        for name in missing:
+            job = jobs.get(name)
+            if job is not None and job['status'] == 'done':
+                manifest, timeout = job['manifest'], None
+            elif job is not None and job['status'] == 'failed':
+                manifest, timeout = NO_RENDITIONS, FAILED_MANIFEST_TIMEOUT
+            else:
+                manifest, timeout = NO_RENDITIONS, PENDING_MANIFEST_TIMEOUT
+            manifests[name] = manifest
+            timeouts.setdefault(timeout, {})[_manifest_key(name)] = manifest
+        enqueue_renditions(name for name in missing if name not in jobs)
+        for timeout, values in timeouts.items():
+            cache.set_many(values, timeout)
+
+    for name, files in pending.items():
+        for field_file in files:
+            setattr(field_file, MANIFEST_ATTR, manifests[name])
+
+
+def get_renditions(field_file):
+    """Манифест производных для ImageField или None - тогда показывается оригинал"""
+    if not field_file:
+        return None
+    attach_renditions([field_file])
+    manifest = getattr(field_file, MANIFEST_ATTR)
+    return manifest if manifest['renditions'] else None
+
+
+def rendition_url(field_file, rendition='card', image_format='jpeg'):
+    """URL производной, а если ее нет - оригинала"""
+    manifest = get_renditions(field_file)
+    if manifest is None:
+        return field_file.url if field_file else ''
+
+    entries = manifest['renditions']
+    entry = entries.get(rendition)
+    if entry is None:
+        # Узкий оригинал: берем самую широкую из созданных
+        entry = max(entries.values(), key=lambda item: item['width'])
+    return field_file.storage.url(entry[image_format])
+
+
+def srcset(field_file, image_format='webp'):
+    """Значение атрибута srcset: 'url 160w, url 480w, ...'"""
+    manifest = get_renditions(field_file)
+    if manifest is None:
+        return ''
+    entries = sorted(manifest['renditions'].values(), key=lambda item: item['width'])
+    return ', '.join(
+        f"{field_file.storage.url(entry[image_format])} {entry['width']}w"
+        for entry in entries
+    )
+
+
+def _publish(manifests):
+    cache.set_many({_manifest_key(name): manifest for name, manifest in manifests.items()}, None)
+    bump_version(VERSION_KEY)
+
+
+def process_pending(executor, batch_size=10):
+    """
+    Обработать одну пачку оригиналов из очереди. Возвращает (готово, с ошибкой).
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет запускать несколько воркеров,
+    производные пачки создаются параллельно в executor. Битый оригинал сразу
+    получает статус failed, прочие ошибки (например, файл еще не виден в
+    хранилище) повторяются с паузой. Сломанный пул пробрасывается, как в
+    apps.main.review_uploads.process_pending.
+    """
+    done = []
+    failed = []
+    broken = None
+    with transaction.atomic():
+        jobs = list(
+            ImageRenditions.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        futures = []
+        for job in jobs:
+            job.attempts += 1
+            try:
+                futures.append((job, executor.submit(generate_renditions, job.name)))
+            except Exception as e:
+                futures.append((job, e))
+
+        now = timezone.now()
+        for job, future in futures:
+            job.updated_at = now
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                job.manifest = future.result()
+            except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+                job.status = 'failed'
+                job.last_error = str(e)
+                failed.append(job)
+                logger.warning(f'Cannot build renditions for {job.name}: {e}')
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    broken = e
+                job.last_error = f'{type(e).__name__}: {e}'
+                if RETRY_POLICY.exhausted(job.attempts):
+                    job.status = 'failed'
+                    failed.append(job)
+                    logger.error(f'Renditions for {job.name} failed permanently: {job.last_error}')
+                else:
+                    job.next_attempt_at = now + RETRY_POLICY.delay(job.attempts)
+                    logger.warning(f'Renditions for {job.name} failed, attempt {job.attempts}: {job.last_error}')
+            else:
+                job.status = 'done'
+                job.last_error = ''
+                done.append(job)
+
+        if jobs:
+            ImageRenditions.objects.bulk_update(
+                jobs, ['manifest', 'status', 'attempts', 'next_attempt_at', 'last_error', 'updated_at']
+            )
+        if done:
+            manifests = {job.name: job.manifest for job in done}
+            transaction.on_commit(lambda: _publish(manifests))
+    if broken is not None:
+        raise broken
+    return len(done), len(failed)
@@ -0,0 +1,71 @@
+from apps.main.pagination import KeysetPaginator
+from apps.main.review_models import Review, ReviewHelpful
+
+
+REVIEWS_PER_PAGE = 10
+
+# Сортировки списка отзывов (?sort=...). Последним идет id - уникальный ключ
+# для курсора; под каждую сортировку, с фильтром по оценке и без, есть
+# составной индекс Review (см. Review.Meta.indexes)
+REVIEW_ORDERINGS = {
+    'recent': ('-created_at', '-id'),
+    'helpful': ('-helpful_count', '-created_at', '-id'),
+    'rating_high': ('-rating', '-created_at', '-id'),
+    'rating_low': ('rating', '-created_at', '-id'),
+}
+
+
+def review_queryset(product):
+    """Отзывы товара вместе с авторами и фотографиями"""
+    return (
+        Review.objects
+        .filter(product=product)
+        .select_related('user')
+        .prefetch_related('images')
+    )
+
+
+def mark_helpful(user, reviews):
+    """
+    Одним запросом получить голоса пользователя за эти отзывы и проставить
+    review.marked_helpful - шаблону не нужен запрос на каждый отзыв.
+    """
+    reviews = list(reviews)
+    helpful_ids = set()
+    if user.is_authenticated and reviews:
+        helpful_ids = set(
+            ReviewHelpful.objects
+            .filter(user=user, review_id__in=[review.id for review in reviews])
+            .values_list('review_id', flat=True)
+        )
+    for review in reviews:
+        review.marked_helpful = review.id in helpful_ids
+    return reviews
+
+
+def review_page(product, user, sort='recent', rating=None, cursor=None, per_page=REVIEWS_PER_PAGE):
+    """
+    Страница отзывов по курсору: без COUNT(*) и OFFSET, поэтому дальние страницы
+    популярного товара стоят столько же, сколько первая. Неверный курсор - InvalidCursor.
+    """
+    reviews = review_queryset(product)
+    if rating:
+        reviews = reviews.filter(rating=rating)
+    ordering = REVIEW_ORDERINGS.get(sort, REVIEW_ORDERINGS['recent'])
+    page = KeysetPaginator(reviews, ordering, per_page=per_page).get_page(cursor)
+    mark_helpful(user, page.object_list)
+    return page
+
+
+def load_review_feed(product, user, limit=REVIEWS_PER_PAGE):
+    """
+    Первая страница отзывов для карточки товара за фиксированное число запросов:
+    отзывы с авторами, фотографии, голоса текущего пользователя.
+    """
+    page = review_page(product, user, per_page=limit)
+    return {
+        'reviews': page.object_list,
+        # Лишняя строка в выборке страницы говорит, есть ли еще отзывы - COUNT(*) не нужен
+        'reviews_has_more': page.has_next,
+        'reviews_next_cursor': page.next_cursor,
+    }
@@ -1,7 +1,5 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from PIL import Image
-from io import BytesIO
 import re
 
 
@@ -71,6 +69,11 @@ class ReviewForm(forms.Form):
         return content
     
     def clean_images(self):
+        """
+        Только дешевые проверки по заголовкам загрузки. Содержимое файла
+        (формат, размеры, целостность) проверяется при обработке вне запроса -
+        apps.main.images.prepare_upload в команде process_review_images.
+        """
         images = self.files.getlist('images')
         
         if len(images) > 5:
@@ -85,19 +88,6 @@ class ReviewForm(forms.Form):
             
             if image.size > max_size:
                 raise ValidationError('Each image must be less than 5MB.')
-            
-            try:
-                img = Image.open(image)
-                img.verify()
-                
-                if img.size[0] < 200 or img.size[1] < 200:
-                    raise ValidationError('Images must be at least 200x200 pixels.')
-                
-                if img.size[0] > 4000 or img.size[1] > 4000:
-                    raise ValidationError('Images must not exceed 4000x4000 pixels.')
-                
-            except Exception:
-                raise ValidationError('Invalid or corrupted image file.')
         
         return images
 
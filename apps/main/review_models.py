@@ -24,13 +24,24 @@ class Review(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_verified_purchase = models.BooleanField(default=False)
     helpful_count = models.PositiveIntegerField(default=0)
+    # Фото в очереди на обработку (ReviewImageUpload): пока не 0, отзыв
+    # показывает заглушку "processing"
+    images_pending = models.PositiveSmallIntegerField(default=0)
     
     class Meta:
         ordering = ['-created_at']
         unique_together = ['product', 'user']
+        # Под каждую сортировку списка отзывов (apps.main.review_feed.REVIEW_ORDERINGS)
+        # и фильтр по оценке - свой составной индекс: курсор идет по индексу без сортировки
         indexes = [
-            models.Index(fields=['product', '-created_at']),
+            models.Index(fields=['product', '-created_at', '-id']),
+            models.Index(fields=['product', '-helpful_count', '-created_at', '-id']),
+            models.Index(fields=['product', '-rating', '-created_at', '-id']),
+            models.Index(fields=['product', 'rating', '-created_at', '-id']),
+            models.Index(fields=['product', 'rating', '-helpful_count', '-created_at', '-id']),
             models.Index(fields=['user', '-created_at']),
+            # Последняя правка отзывов товара для ETag (apps.main.conditional.product_version)
+            models.Index(fields=['product', '-updated_at']),
         ]
     
     def __str__(self):
@@ -57,6 +68,47 @@ class ReviewImage(models.Model):
         return f'Image for review #{self.review.id}'
 
 
+class ReviewImageUpload(models.Model):
+    """
+    Фото отзыва, ждущее обработки: загруженный файл лежит во временной области
+    хранилища (file - имя в default_storage). Обрабатывает команда
+    process_review_images (apps.main.review_uploads): готовое фото становится
+    ReviewImage, а строка удаляется. failed - фото отклонено или не обработалось
+    за RETRY_POLICY.max_attempts попыток.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    ]
+
+    review = models.ForeignKey(
+        Review,
+        on_delete=models.CASCADE,
+        related_name='image_uploads'
+    )
+    file = models.CharField(max_length=255)
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Очередь воркера: pending с наступившим next_attempt_at
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                name='main_review_upload_queue_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.original_name or self.file} for review #{self.review_id} ({self.status})'
+
+
 class ReviewHelpful(models.Model):
     review = models.ForeignKey(
         Review, 
@@ -77,4 +129,21 @@ class ReviewHelpful(models.Model):
         ]
     
     def __str__(self):
-        return f'{self.user.email} found review #{self.review.id} helpful'
\ No newline at end of file
+        return f'{self.user.email} found review #{self.review.id} helpful'
+
+class ReviewHelpfulDelta(models.Model):
+    """
+    Журнал изменений helpful_count: голос дописывает строку +1/-1 и не трогает
+    строку Review, поэтому голоса за популярный отзыв не ждут друг друга.
+    Строки сворачивает в Review.helpful_count apps.main.helpful.rollup_votes.
+    """
+    review = models.ForeignKey(
+        Review,
+        on_delete=models.CASCADE,
+        related_name='helpful_deltas'
+    )
+    delta = models.SmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.delta:+d} for review #{self.review_id}'
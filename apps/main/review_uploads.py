@@ -0,0 +1,152 @@
+import logging
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+
+from apps.main.images import InvalidImage, prepare_upload
+from apps.main.queues import RetryPolicy
+from apps.main.review_models import Review, ReviewImage, ReviewImageUpload
+
+logger = logging.getLogger(__name__)
+
+
+# Фото отзывов не обрабатываются в запросе: view только переносит загруженные
+# файлы во временную область хранилища и ставит их в очередь (stage_uploads).
+# Проверку, удаление EXIF, перекодирование и уменьшение делает пул процессов
+# команды process_review_images (process_pending). Пока фото в очереди,
+# Review.images_pending > 0 и отзыв показывает заглушку "processing".
+
+INCOMING_DIR = 'reviews/incoming'
+# 5 попыток с паузой 30с, 1м, 2м, 4м
+RETRY_POLICY = RetryPolicy(max_attempts=5)
+
+
+def stage_uploads(review, files):
+    """
+    Сохранить загруженные файлы во временную область и поставить их в очередь.
+    Файл не читается в память: storage.save переносит временный файл загрузки
+    или копирует его по частям. Возвращает число поставленных в очередь фото.
+    """
+    if not files:
+        return 0
+    uploads = [
+        ReviewImageUpload(
+            review=review,
+            file=default_storage.save(f'{INCOMING_DIR}/{uuid.uuid4().hex}', upload),
+            original_name=(upload.name or '')[:255],
+        )
+        for upload in files
+    ]
+    ReviewImageUpload.objects.bulk_create(uploads)
+    Review.objects.filter(id=review.id).update(updated_at=Now(), images_pending=F('images_pending') + len(uploads))
+    review.images_pending += len(uploads)
+    return len(uploads)
+
+
+def _read(name):
+    with default_storage.open(name, 'rb') as upload_file:
+        return upload_file.read()
+
+
+def _finish(uploads):
+    """Уменьшить Review.images_pending на завершенные (прикрепленные или отклоненные) фото"""
+    finished = {}
+    for upload in uploads:
+        finished[upload.review_id] = finished.get(upload.review_id, 0) + 1
+    if not finished:
+        return
+    # updated_at - фото и заглушка видны на странице товара (ETag, apps.main.conditional)
+    Review.objects.filter(id__in=finished).update(updated_at=Now(), images_pending=Greatest(
+        Case(
+            *(When(id=review_id, then=F('images_pending') - count) for review_id, count in finished.items()),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    ))
+
+
+def process_pending(executor, batch_size=10):
+    """
+    Обработать одну пачку фото из очереди. Возвращает (прикреплено, с ошибкой).
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет запускать несколько воркеров.
+    Фото пачки обрабатываются параллельно в executor (пул процессов, размер
+    которого ограничивает нагрузку на CPU): в процесс уходят только байты файла,
+    запись в хранилище и БД остается здесь.
+
+    Отклоненное фото (InvalidImage) сразу получает статус failed, прочие ошибки
+    повторяются с паузой. Если пул сломался (процесс убит, например, по памяти),
+    попытки пачки записываются и BrokenProcessPool пробрасывается - вызывающий
+    создает новый пул.
+    """
+    attached = []
+    rejected = []
+    failed = []
+    broken = None
+    with transaction.atomic():
+        uploads = list(
+            ReviewImageUpload.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        futures = []
+        for upload in uploads:
+            upload.attempts += 1
+            try:
+                futures.append((upload, executor.submit(prepare_upload, _read(upload.file), settings.REVIEW_IMAGE_MAX_SIDE)))
+            except Exception as e:
+                futures.append((upload, e))
+
+        for upload, future in futures:
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                data = future.result()
+                with transaction.atomic():
+                    ReviewImage.objects.create(
+                        review_id=upload.review_id,
+                        image=ContentFile(data, name=f'{uuid.uuid4().hex}.jpg'),
+                    )
+            except InvalidImage as e:
+                upload.status = 'failed'
+                upload.last_error = str(e)
+                rejected.append(upload)
+                logger.info(f'Review image {upload.file} rejected: {e}')
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    broken = e
+                upload.last_error = f'{type(e).__name__}: {e}'
+                if RETRY_POLICY.exhausted(upload.attempts):
+                    upload.status = 'failed'
+                    failed.append(upload)
+                    logger.error(f'Review image {upload.file} failed permanently: {upload.last_error}')
+                else:
+                    upload.next_attempt_at = timezone.now() + RETRY_POLICY.delay(upload.attempts)
+                    logger.warning(f'Review image {upload.file} failed, attempt {upload.attempts}: {upload.last_error}')
+            else:
+                attached.append(upload)
+
+        if uploads:
+            ReviewImageUpload.objects.bulk_update(uploads, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+            ReviewImageUpload.objects.filter(id__in=[upload.id for upload in attached]).delete()
+            _finish(attached + rejected + failed)
+            # Временный файл больше не нужен. У не обработанных после всех
+            # повторов он остается для разбора вместе с last_error
+            done = [upload.file for upload in attached + rejected]
+            transaction.on_commit(lambda: _delete_files(done))
+    if broken is not None:
+        raise broken
+    return len(attached), len(rejected) + len(failed)
+
+
+def _delete_files(names):
+    for name in names:
+        default_storage.delete(name)
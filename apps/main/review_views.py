@@ -1,17 +1,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
 from django.views.decorators.http import require_http_methods, require_POST
-from django.db.models import Avg, Count, Q
-from django.core.paginator import Paginator
-from django.utils import timezone
 from django.db import transaction
-from django.http import HttpResponse
-from django.urls import reverse
 from apps.main.models import Product
-from apps.main.review_models import Review, ReviewImage, ReviewHelpful
+from apps.main.review_models import Review, ReviewImage
 from apps.main.review_forms import ReviewForm, ReviewEditForm
+from apps.main.ratings import rating_stats, update_product_rating
+from apps.main.renditions import attach_renditions
+from apps.main.review_feed import REVIEW_ORDERINGS, review_page
+from apps.main.review_uploads import stage_uploads
+from apps.main.helpful import toggle_vote
+from apps.main.pagination import InvalidCursor
+from apps.main.routers import use_replica
 
 
 @login_required
@@ -40,34 +42,19 @@ def review_create(request, product_id):
         
         if form.is_valid():
             # Создание отзыва
-            review = Review.objects.create(
-                product=product,
-                user=request.user,
-                rating=form.cleaned_data['rating'],
-                title=form.cleaned_data['title'],
-                content=form.cleaned_data['content']
-            )
+            with transaction.atomic():
+                review = Review.objects.create(
+                    product=product,
+                    user=request.user,
+                    rating=form.cleaned_data['rating'],
+                    title=form.cleaned_data['title'],
+                    content=form.cleaned_data['content']
+                )
+                update_product_rating(product.id, added=review.rating)
             print(f"Review created: {review.id}")
             
-            # Обработка изображений
-            images = request.FILES.getlist('images')
-            if images:
-                if len(images) > 5:
-                    messages.error(request, 'Maximum 5 images allowed.')
-                else:
-                    max_size = 5 * 1024 * 1024  # 5MB
-                    for image in images:
-                        if image.size > max_size:
-                            messages.error(request, f'{image.name} is too large (max 5MB).')
-                            continue
-                        if image.content_type not in ['image/jpeg', 'image/png', 'image/webp']:
-                            messages.error(request, f'{image.name} is not a supported format.')
-                            continue
-                        
-                        ReviewImage.objects.create(
-                            review=review,
-                            image=image
-                        )
+            # Фото обрабатываются вне запроса, до тех пор отзыв показывает заглушку
+            stage_uploads(review, form.cleaned_data['images'])
             
             messages.success(request, 'Review submitted successfully!')
             return redirect('main:product_detail', id=product.id, slug=product.slug)
@@ -114,17 +101,16 @@ def review_edit(request, review_id):
         if form.is_valid():
             try:
                 with transaction.atomic():
+                    old_rating = review.rating
                     review.rating = form.cleaned_data['rating']
                     review.title = form.cleaned_data['title']
                     review.content = form.cleaned_data['content']
-                    review.save()
+                    # Только поля формы: images_pending меняет обработчик фото
+                    review.save(update_fields=['rating', 'title', 'content', 'updated_at'])
+                    if review.rating != old_rating:
+                        update_product_rating(review.product_id, added=review.rating, removed=old_rating)
                     
-                    images = request.FILES.getlist('images')
-                    for image in images:
-                        ReviewImage.objects.create(
-                            review=review,
-                            image=image
-                        )
+                    stage_uploads(review, form.cleaned_data['images'])
                     
                     messages.success(request, 'Your review has been updated successfully!')
                     
@@ -171,7 +157,10 @@ def review_delete(request, review_id):
     product_id = review.product.id
     product_slug = review.product.slug
     
-    review.delete()
+    with transaction.atomic():
+        rating = review.rating
+        review.delete()
+        update_product_rating(product_id, removed=rating)
     messages.success(request, 'Your review has been deleted.')
     
     if request.headers.get('HX-Request'):
@@ -201,23 +190,13 @@ def review_image_delete(request, image_id):
 def review_helpful(request, review_id):
     review = get_object_or_404(Review, id=review_id)
     
-    if review.user == request.user:
+    if review.user_id == request.user.id:
         return JsonResponse({'error': 'Cannot mark own review as helpful'}, status=400)
     
-    helpful, created = ReviewHelpful.objects.get_or_create(
-        review=review,
-        user=request.user
-    )
-    
-    if not created:
-        helpful.delete()
-        review.helpful_count = max(0, review.helpful_count - 1)
-        action = 'removed'
-    else:
-        review.helpful_count += 1
-        action = 'added'
-    
-    review.save(update_fields=['helpful_count'])
+    # Голос пишется в журнал, а не в строку Review (см. apps.main.helpful)
+    created, review.helpful_count = toggle_vote(review, request.user)
+    action = 'added' if created else 'removed'
+    review.marked_helpful = created
     
     if request.headers.get('HX-Request'):
         return render(request, 'main/partials/review_helpful_button.html', {
@@ -232,45 +211,35 @@ def review_helpful(request, review_id):
     })
 
 
+@use_replica
 def review_list(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     
-    reviews = Review.objects.filter(product=product).select_related(
-        'user'
-    ).prefetch_related('images')
-    
     sort_by = request.GET.get('sort', 'recent')
+    if sort_by not in REVIEW_ORDERINGS:
+        sort_by = 'recent'
     rating_filter = request.GET.get('rating')
+    rating = int(rating_filter) if rating_filter in ('1', '2', '3', '4', '5') else None
     
-    if rating_filter and rating_filter.isdigit():
-        reviews = reviews.filter(rating=int(rating_filter))
+    try:
+        page = review_page(product, request.user, sort_by, rating, request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    attach_renditions(image.image for review in page for image in review.images.all())
     
-    if sort_by == 'helpful':
-        reviews = reviews.order_by('-helpful_count', '-created_at')
-    elif sort_by == 'rating_high':
-        reviews = reviews.order_by('-rating', '-created_at')
-    elif sort_by == 'rating_low':
-        reviews = reviews.order_by('rating', '-created_at')
-    else:
-        reviews = reviews.order_by('-created_at')
-    
-    paginator = Paginator(reviews, 10)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
-    
-    stats = Review.objects.filter(product=product).aggregate(
-        avg_rating=Avg('rating'),
-        total_reviews=Count('id'),
-        rating_5=Count('id', filter=Q(rating=5)),
-        rating_4=Count('id', filter=Q(rating=4)),
-        rating_3=Count('id', filter=Q(rating=3)),
-        rating_2=Count('id', filter=Q(rating=2)),
-        rating_1=Count('id', filter=Q(rating=1)),
-    )
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    
+    # Итоги - из сводки отзывов в Product, без COUNT(*)
+    stats = rating_stats(product)
     
     context = {
         'product': product,
-        'reviews': page_obj,
+        'reviews': page,
+        'next_query': next_query,
         'stats': stats,
         'sort_by': sort_by,
         'rating_filter': rating_filter,
@@ -0,0 +1,103 @@
+import contextlib
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+
+
+# Приложения, чтение которых можно отдавать репликам: каталог и отзывы.
+# Сессии, пользователи и заказы всегда читаются с primary.
+REPLICA_APPS = {'main'}
+
+_state = contextvars.ContextVar('replica_state', default=None)
+
+
+class ReplicaState:
+    """Состояние маршрутизации одного запроса (ставит ReplicaRoutingMiddleware)"""
+
+    def __init__(self, pinned=False):
+        # Пользователь недавно писал сам - читаем только с primary (read-your-writes)
+        self.pinned = pinned
+        self.wrote = False
+        self.allowed = 0
+        self.alias = None
+
+
+def activate(state):
+    return _state.set(state)
+
+
+def deactivate(token):
+    _state.reset(token)
+
+
+def current_state():
+    return _state.get()
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """
+    Разрешить чтение с реплики внутри блока. Вне запроса (команды, воркеры)
+    и после записи в этом же запросе чтение остается на primary.
+    """
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    state.allowed += 1
+    try:
+        yield
+    finally:
+        state.allowed -= 1
+
+
+def use_replica(view):
+    """Декоратор для read-only view: их запросы к каталогу и отзывам идут на реплику"""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads():
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Чтение моделей из REPLICA_APPS - на одну из settings.DATABASE_REPLICAS,
+    но только внутри replica_reads(), не после собственной записи
+    пользователя и не в запросе, где уже была запись. Все записи - на default.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICA_APPS:
+            return None
+        state = _state.get()
+        if state is None or not state.allowed or state.pinned or state.wrote:
+            return None
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            return None
+        # Одна реплика на весь запрос - без скачков между разными задержками репликации
+        if state.alias is None:
+            state.alias = random.choice(replicas)
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label in REPLICA_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,50 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import Case, Exists, F, FloatField, Q, When
+from django.db.models.functions import Cast, Upper
+
+
+# Конфигурация должна совпадать с триггером main_product_search_vector_update
+# (миграция 0006): названия у нас и на русском, и на английском, поэтому без стемминга
+SEARCH_CONFIG = 'simple'
+
+
+def _prefix_query(text):
+    """'black jack' -> black:* & jack:* - поиск по началу слов, пока пользователь печатает"""
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    raw = ' & '.join(f'{term}:*' for term in terms)
+    return SearchQuery(raw, config=SEARCH_CONFIG, search_type='raw')
+
+
+def search_products(queryset, text):
+    """
+    Полнотекстовый поиск по Product.search_vector (GIN-индекс) с ранжированием.
+    Если ничего не нашлось - нечеткий поиск по названию через pg_trgm (опечатки).
+
+    Выбор между ними - в том же запросе: NOT EXISTS по полнотекстовому условию
+    не зависит от строки, PostgreSQL вычисляет его один раз (InitPlan), и
+    нечеткое условие работает, только если полнотекстовых совпадений нет.
+
+    search_rank - ранг полнотекстового совпадения или сходство названия, по
+    нему каталог сортирует результаты, если пользователь не выбрал другую сортировку.
+    """
+    query = _prefix_query(text)
+    if query is None:
+        return queryset
+
+    text = text.strip().upper()
+    full_text = Q(search_vector=query)
+    # ts_rank/similarity возвращают real - приводим к double precision,
+    # чтобы значение в курсоре пагинации точно совпадало со значением в БД
+    return queryset.annotate(
+        name_upper=Upper('name'),
+        search_rank=Case(
+            When(full_text, then=Cast(SearchRank(F('search_vector'), query), FloatField())),
+            default=Cast(TrigramSimilarity(Upper('name'), text), FloatField()),
+        ),
+    ).filter(
+        full_text | (~Exists(queryset.filter(full_text)) & Q(name_upper__trigram_similar=text))
+    )
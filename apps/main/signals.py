@@ -0,0 +1,43 @@
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.main.facets import invalidate_facets
+from apps.main.models import Category, Product, ProductSize, ProductImage, Size
+from apps.main.reference import invalidate_reference
+from apps.main.renditions import enqueue_renditions
+from apps.main.review_models import Review, ReviewImage
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductSize)
+def invalidate_catalog_facets(sender, **kwargs):
+    invalidate_facets()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Size)
+def invalidate_reference_data(sender, **kwargs):
+    # Повторно после коммита: иначе воркер, перечитавший справочник до коммита,
+    # так и остался бы со старыми данными
+    invalidate_reference()
+    transaction.on_commit(invalidate_reference)
+
+
+# Производные создает воркер process_image_renditions (apps.main.renditions)
+@receiver(post_save, sender=Product)
+def queue_product_renditions(sender, instance, **kwargs):
+    enqueue_renditions([instance.main_image.name])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=ReviewImage)
+def queue_image_renditions(sender, instance, **kwargs):
+    enqueue_renditions([instance.image.name])
+
+
+@receiver([post_save, post_delete], sender=ReviewImage)
+def touch_review(sender, instance, **kwargs):
+    # Фото видны на странице товара - меняется ее версия (apps.main.conditional)
+    Review.objects.filter(id=instance.review_id).update(updated_at=timezone.now())
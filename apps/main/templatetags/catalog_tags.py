@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def facet_count(counts, value):
+    """Count for a form choice value (ModelChoiceIteratorValue or raw pk)"""
+    if not counts:
+        return 0
+    return counts.get(getattr(value, 'value', value), 0)
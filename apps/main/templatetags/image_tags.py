@@ -0,0 +1,17 @@
+from django import template
+
+from apps.main import renditions
+
+register = template.Library()
+
+
+@register.simple_tag
+def rendition_url(image, rendition='card', image_format='jpeg'):
+    """URL of a resized rendition (falls back to the original)"""
+    return renditions.rendition_url(image, rendition, image_format)
+
+
+@register.simple_tag
+def srcset(image, image_format='webp'):
+    """srcset value with every rendition of the image"""
+    return renditions.srcset(image, image_format)
@@ -41,4 +41,8 @@ def has_user_marked_helpful(user, review):
     """Check if user has marked review as helpful"""
     if not user.is_authenticated:
         return False
+    # Set by apps.main.review_feed.mark_helpful for the whole page in one query
+    marked = getattr(review, 'marked_helpful', None)
+    if marked is not None:
+        return marked
     return ReviewHelpful.objects.filter(user=user, review=review).exists()
\ No newline at end of file
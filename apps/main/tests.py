@@ -1,3 +1,1051 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse, QueryDict
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.main import facets, helpful, metrics, queues, reference, renditions, review_uploads, routers, versions
+from apps.main.filters import ProductFilter
+from apps.main.ratings import rebuild_product_ratings, update_product_rating
+from apps.main.review_feed import load_review_feed, mark_helpful
+from apps.main.search import search_products
+from apps.main.middleware import ReplicaRoutingMiddleware
+from apps.main.pagination import InvalidCursor, KeysetPaginator
+from apps.main.models import (
+    Category, ImageRenditions, Product, ProductImage, ProductSize, Review, ReviewHelpful, ReviewHelpfulDelta,
+    ReviewImage, ReviewImageUpload, Size,
+)
+from apps.payments.models import Order
+from PIL import Image
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=10)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.token = routers.activate(routers.ReplicaState())
+        self.addCleanup(routers.deactivate, self.token)
+
+    def test_reads_go_to_replica_only_when_allowed(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+            # Заказы, сессии и пользователи всегда читаются с primary
+            self.assertIsNone(self.router.db_for_read(Order))
+
+    def test_write_pins_rest_of_request_to_primary(self):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            self.assertIsNone(self.router.db_for_read(Product))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        with routers.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_migrations_run_only_on_primary(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'main'))
+        self.assertIsNone(self.router.allow_migrate('default', 'main'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=10)
+class ReplicaStickinessTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_db(self, request):
+        result = {}
+
+        def view(request):
+            with routers.replica_reads():
+                result['db'] = self.router.db_for_read(Product)
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(view)(request)
+        return result['db']
+
+    def test_own_write_sticks_user_to_primary(self):
+        def write_view(request):
+            self.router.db_for_write(Product)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(write_view)(self.factory.post('/'))
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 10)
+
+        request = self.factory.get('/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = cookie.value
+        self.assertIsNone(self.read_db(request))
+
+    def test_expired_or_missing_cookie_reads_replica(self):
+        self.assertEqual(self.read_db(self.factory.get('/')), 'replica1')
+
+        request = self.factory.get('/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = '1'
+        self.assertEqual(self.read_db(request), 'replica1')
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as catalog_file:
+            catalog_file.write(content)
+        return path
+
+    def import_catalog(self, path, **options):
+        call_command('import_catalog', path, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def export_catalog(self, name):
+        path = os.path.join(self.directory.name, name)
+        call_command('export_catalog', path, stdout=io.StringIO(), stderr=io.StringIO())
+        with open(path, encoding='utf-8') as catalog_file:
+            return catalog_file.read()
+
+    def jsonl(self, count, start=0):
+        return ''.join(json.dumps({
+            'slug': f'item-{index}', 'name': f'Item {index}', 'category': 'tops', 'category_name': 'Tops',
+            'price': '10.00', 'color': 'black', 'sizes': {'S': index, 'M': 1},
+            'images': [f'products/extra/item-{index}.jpg'],
+        }) + '\n' for index in range(start, start + count))
+
+    def test_csv_import_and_partial_update(self):
+        path = self.write('catalog.csv', (
+            'slug,name,category,category_name,price,color,status_discount,sizes,images\n'
+            'coat,Coat,outerwear,Outerwear,99.90,black,yes,S:5;M:0,products/extra/a.jpg;products/extra/b.jpg\n'
+        ))
+        self.import_catalog(path)
+
+        product = Product.objects.select_related('category').get(slug='coat')
+        self.assertEqual((product.name, product.category.name, str(product.price)), ('Coat', 'Outerwear', '99.90'))
+        self.assertTrue(product.status_discount)
+        self.assertEqual(
+            sorted(ProductSize.objects.filter(product=product).values_list('size__name', 'stock')),
+            [('M', 0), ('S', 5)],
+        )
+        self.assertEqual(ProductImage.objects.filter(product=product).count(), 2)
+
+        # Только цена и остатки: остальные поля и изображения не трогаются
+        self.import_catalog(self.write('stock.csv', 'slug,price,sizes\ncoat,79.00,M:4\n'))
+        product.refresh_from_db()
+        self.assertEqual((product.name, str(product.price)), ('Coat', '79.00'))
+        self.assertEqual(
+            sorted(ProductSize.objects.filter(product=product).values_list('size__name', 'stock')),
+            [('M', 4), ('S', 5)],
+        )
+        self.assertEqual(ProductImage.objects.filter(product=product).count(), 2)
+
+    def test_queries_per_chunk_do_not_depend_on_rows(self):
+        self.import_catalog(self.write('warmup.jsonl', self.jsonl(1, start=1000)))
+
+        counts = []
+        for name, rows in (('small.jsonl', self.jsonl(3)), ('large.jsonl', self.jsonl(30, start=100))):
+            path = self.write(name, rows)
+            with CaptureQueriesContext(connection) as captured:
+                self.import_catalog(path, chunk_size=100)
+            counts.append(len(captured))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_export_import_round_trip(self):
+        self.import_catalog(self.write('catalog.jsonl', self.jsonl(5)))
+        exported = self.export_catalog('export.jsonl')
+        self.assertEqual(len(exported.splitlines()), 5)
+        self.assertEqual(json.loads(exported.splitlines()[2])['sizes'], {'S': 2, 'M': 1})
+
+        counts = (Product.objects.count(), ProductSize.objects.count(), ProductImage.objects.count(), Size.objects.count())
+        self.import_catalog(os.path.join(self.directory.name, 'export.jsonl'))
+        self.assertEqual(
+            (Product.objects.count(), ProductSize.objects.count(), ProductImage.objects.count(), Size.objects.count()),
+            counts,
+        )
+        self.assertEqual(self.export_catalog('export.csv').splitlines()[0].split(',')[0], 'slug')
+        self.assertEqual(self.export_catalog('again.jsonl'), exported)
+
+    def test_invalid_rows(self):
+        path = self.write('bad.jsonl', self.jsonl(1) + '{"slug": "x", "price": "abc"}\n' + self.jsonl(1, start=5))
+        with self.assertRaisesMessage(CommandError, 'line 2'):
+            self.import_catalog(path, chunk_size=1)
+        # Пачки до ошибки уже загружены
+        self.assertTrue(Product.objects.filter(slug='item-0').exists())
+
+        self.import_catalog(path, skip_invalid=True)
+        self.assertTrue(Product.objects.filter(slug='item-5').exists())
+        self.assertFalse(Category.objects.filter(slug='x').exists())
+
+        path = self.write('new.csv', 'slug,price\nunknown,5\nitem-0,7\n')
+        with self.assertRaisesMessage(CommandError, 'line 2: new product needs name, category'):
+            self.import_catalog(path)
+
+        # Неполная строка нового товара пропускается, остальные строки пачки загружаются
+        stderr = io.StringIO()
+        call_command('import_catalog', path, skip_invalid=True, stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('Skipped line 2: new product needs name, category', stderr.getvalue())
+        self.assertFalse(Product.objects.filter(slug='unknown').exists())
+        self.assertEqual(str(Product.objects.get(slug='item-0').price), '7.00')
+
+
+class SeedStoreBenchmarkTests(TestCase):
+    def seed(self, **options):
+        sizes = dict(categories=2, products=5, users=3, reviews=8, helpful_votes=10, orders=3, batch_size=2)
+        sizes.update(options)
+        stdout = io.StringIO()
+        call_command('seed_store', stdout=stdout, stderr=io.StringIO(), **sizes)
+        return stdout.getvalue()
+
+    def test_seed_and_benchmark(self):
+        self.assertIn('Seeded 2 categories, 5 products', self.seed())
+        self.assertEqual(Product.objects.filter(slug__startswith='seed-').count(), 5)
+        self.assertEqual(Order.objects.filter(email__endswith='@seed.example.com').count(), 3)
+        # Даты разнесены в прошлое, а не оставлены временем вставки
+        self.assertEqual(Product.objects.values('created_at').distinct().count(), 5)
+        # Сводка отзывов пересчитана после bulk_create
+        self.assertEqual(
+            sum(Product.objects.values_list('rating_count', flat=True)), Review.objects.count()
+        )
+
+        with self.assertRaisesMessage(CommandError, 'Seeded data already exists'):
+            self.seed()
+        self.seed(replace=True, products=4)
+        self.assertEqual(Product.objects.filter(slug__startswith='seed-').count(), 4)
+
+        orders = Order.objects.count()
+        stdout = io.StringIO()
+        # Запросы бенчмарка идут через middleware метрик, как и настоящие
+        with self.assertLogs('apps.main.metrics', 'INFO'):
+            call_command('benchmark', iterations=2, warmup=1, stdout=stdout, stderr=io.StringIO())
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['meta']['products'], 4)
+        for name in ('catalog', 'catalog_filtered', 'catalog_search', 'product_detail', 'review_list'):
+            result = report['results'][name]
+            self.assertEqual(result['requests'], 2)
+            self.assertEqual(result['status'], {'200': 2})
+        # Записи бенчмарка откатываются
+        self.assertEqual(Order.objects.count(), orders)
+
+    def test_benchmark_needs_data(self):
+        with self.assertRaisesMessage(CommandError, 'run seed_store first'):
+            call_command('benchmark', iterations=1, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class HelpfulVoteTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        category = Category.objects.create(name='Outerwear')
+        product = Product.objects.create(name='Coat', slug='coat', price='50.00', color='black', category=category)
+        author = User._default_manager.create(email='author@example.com', first_name='A', last_name='Author')
+        self.voters = [
+            User._default_manager.create(email=f'voter{index}@example.com', first_name='V', last_name='Voter')
+            for index in range(3)
+        ]
+        self.review = Review.objects.create(product=product, user=author, rating=5, title='Warm', content='Warm coat')
+
+    def helpful_count(self):
+        self.review.refresh_from_db()
+        return self.review.helpful_count
+
+    def test_vote_does_not_touch_review_row(self):
+        self.client.force_login(self.voters[0])
+        url = reverse('reviews:review_helpful', args=[self.review.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+
+        self.assertEqual(response.json(), {'success': True, 'action': 'added', 'helpful_count': 1})
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "main_review"')])
+        self.assertEqual(self.helpful_count(), 0)
+
+        self.assertEqual(self.client.post(url).json()['helpful_count'], 0)
+        self.assertFalse(ReviewHelpful.objects.exists())
+
+    def test_rollup_folds_journal_in_one_update(self):
+        for voter in self.voters:
+            helpful.toggle_vote(self.review, voter)
+        helpful.toggle_vote(self.review, self.voters[0])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(helpful.rollup_votes(), 4)
+
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.helpful_count(), 2)
+        self.assertFalse(ReviewHelpfulDelta.objects.exists())
+        self.assertEqual(helpful.rollup_votes(), 0)
+
+    def test_rebuild_counts_votes_and_pending_journal(self):
+        helpful.toggle_vote(self.review, self.voters[0])
+        helpful.rollup_votes()
+        helpful.toggle_vote(self.review, self.voters[1])
+        Review.objects.filter(id=self.review.id).update(helpful_count=40)
+
+        self.assertEqual(helpful.rebuild_helpful_counts(), 1)
+        # Несвернутый голос досчитает rollup, а не rebuild
+        self.assertEqual(self.helpful_count(), 1)
+        helpful.rollup_votes()
+        self.assertEqual(self.helpful_count(), 2)
+        self.assertEqual(helpful.rebuild_helpful_counts(), 0)
+
+
+class ReviewFeedQueryTests(TestCase):
+    """Лента отзывов - одинаковое число запросов для 1 и N отзывов с фото"""
+
+    def setUp(self):
+        self.User = get_user_model()
+        self.category = Category.objects.create(name='Outerwear')
+        self.viewer = self.User._default_manager.create(email='viewer@example.com', first_name='V', last_name='Viewer')
+
+    def product_with_reviews(self, count, images):
+        product = Product.objects.create(
+            name=f'Coat {count}', slug=f'coat-{count}', price='50.00', color='black', category=self.category,
+        )
+        for index in range(count):
+            author = self.User._default_manager.create(
+                email=f'author{count}-{index}@example.com', first_name='A', last_name='Author',
+            )
+            review = Review.objects.create(product=product, user=author, rating=5, title='Warm', content='Warm coat')
+            for image_index in range(images):
+                ReviewImage.objects.create(review=review, image=f'reviews/{count}-{index}-{image_index}.jpg')
+            if index % 2:
+                ReviewHelpful.objects.create(review=review, user=self.viewer)
+        return product
+
+    def read_feed(self, product, user):
+        feed = load_review_feed(product, user)
+        return [
+            (review.user.email, review.marked_helpful, [image.image.name for image in review.images.all()])
+            for review in feed['reviews']
+        ]
+
+    def test_feed_queries_do_not_grow_with_reviews_and_images(self):
+        for count, images in ((1, 1), (8, 3)):
+            product = self.product_with_reviews(count, images)
+            # Отзывы с авторами и фото; для пользователя - еще его голоса
+            for user, queries in ((AnonymousUser(), 2), (self.viewer, 3)):
+                with self.subTest(reviews=count, images=images, authenticated=user.is_authenticated):
+                    with self.assertNumQueries(queries):
+                        feed = self.read_feed(product, user)
+                    self.assertEqual(len(feed), count)
+                    self.assertTrue(all(len(names) == images for _, _, names in feed))
+                    marked = [helpful for _, helpful, _ in feed]
+                    self.assertEqual(any(marked), user.is_authenticated and count > 1)
+
+    def test_mark_helpful_is_one_query(self):
+        for count in (1, 8):
+            reviews = list(Review.objects.filter(product=self.product_with_reviews(count, 0)))
+            with self.subTest(reviews=count):
+                with self.assertNumQueries(1):
+                    mark_helpful(self.viewer, reviews)
+                self.assertEqual(sum(review.marked_helpful for review in reviews), count // 2)
+                with self.assertNumQueries(0):
+                    mark_helpful(AnonymousUser(), reviews)
+                self.assertFalse(any(review.marked_helpful for review in reviews))
+
+
+@override_settings(CATALOG_PAGE_SIZE=2)
+class CatalogPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Outerwear')
+        # Одинаковые цены попадают на границы страниц
+        for index, price in enumerate(['10.00', '10.00', '10.00', '20.00', '20.00', '30.00', '30.00']):
+            Product.objects.create(name=f'Coat {index}', slug=f'coat-{index}', price=price, color='black', category=category)
+
+    def cursor(self, data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+    def test_ties_are_not_lost_between_pages(self):
+        for ordering in (('price', 'id'), ('-price', '-id'), ('-id',)):
+            with self.subTest(ordering=ordering):
+                paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=2)
+                ids, cursor = [], None
+                while True:
+                    page = paginator.get_page(cursor)
+                    ids += [product.id for product in page]
+                    if not page.has_next:
+                        break
+                    cursor = page.next_cursor
+                self.assertEqual(ids, list(Product.objects.order_by(*ordering).values_list('id', flat=True)))
+
+    def test_malformed_and_foreign_cursors(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('price', 'id'), per_page=2)
+        cursors = [
+            'garbage!',
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+            self.cursor('text'),
+            self.cursor({'o': ['price', 'id'], 'v': 5}),
+            self.cursor({'o': ['price', 'id'], 'v': [10]}),
+            self.cursor({'o': ['price', 'id'], 'v': ['abc', 1]}),
+            self.cursor({'o': ['price', 'id'], 'v': [{'a': 1}, 1]}),
+            self.cursor({'o': ['price', 'id'], 'v': [None, 1]}),
+            self.cursor({'o': 5, 'v': []}),
+            # Курсор другой сортировки
+            self.cursor({'o': ['name', 'id'], 'v': ['Coat 0', 1]}),
+            KeysetPaginator(Product.objects.all(), ('-id',)).encode_cursor(Product.objects.first()),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginator.get_page(cursor)
+                response = self.client.get(reverse('main:product_catalog_more'), {'ordering': 'price', 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                response = self.client.get(reverse('main:product_catalog'), {'ordering': 'price', 'cursor': cursor})
+                self.assertRedirects(response, reverse('main:product_catalog'))
+
+    def test_load_more_renders_next_page_partial(self):
+        response = self.client.get(reverse('main:product_catalog'), {'ordering': 'price'})
+        names = [product.name for product in response.context['page']]
+        query = response.context['next_query']
+        while query is not None:
+            response = self.client.get(f"{reverse('main:product_catalog_more')}?{query}", headers={'HX-Request': 'true'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTemplateUsed(response, 'main/partials/catalog_page.html')
+            self.assertTemplateNotUsed(response, 'main/catalog.html')
+            names += [product.name for product in response.context['page']]
+            query = response.context['next_query']
+            if query is not None:
+                self.assertContains(response, f"{reverse('main:product_catalog_more')}?{query}".replace('&', '&amp;'))
+            else:
+                self.assertNotContains(response, 'catalogLoadMore')
+        self.assertEqual(names, list(Product.objects.order_by('price', 'id').values_list('name', flat=True)))
+
+
+class ReviewListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        category = Category.objects.create(name='Outerwear')
+        cls.product = Product.objects.create(
+            name='Coat', slug='coat', price='50.00', color='black', category=category,
+        )
+        for index in range(23):
+            user = User._default_manager.create(email=f'author{index}@example.com', first_name='A', last_name='B')
+            Review.objects.create(
+                product=cls.product, user=user, rating=1 + index % 5, title='Title', content='Text',
+                helpful_count=index % 4,
+            )
+
+    def walk(self, **params):
+        """Пройти все страницы по курсору; вернуть id отзывов и запросы к main_review"""
+        url = reverse('reviews:review_list', args=[self.product.id])
+        ids, queries, query = [], [], '&'.join(f'{key}={value}' for key, value in params.items())
+        while query is not None:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(f'{url}?{query}', headers={'HX-Request': 'true'})
+            self.assertEqual(response.status_code, 200)
+            ids += [review.id for review in response.context['reviews']]
+            queries += [item['sql'] for item in captured if 'main_review' in item['sql']]
+            query = response.context['next_query']
+        return ids, queries
+
+    def test_every_sort_and_filter_matches_full_ordering(self):
+        orderings = {
+            'recent': ('-created_at', '-id'),
+            'helpful': ('-helpful_count', '-created_at', '-id'),
+            'rating_high': ('-rating', '-created_at', '-id'),
+            'rating_low': ('rating', '-created_at', '-id'),
+        }
+        for sort, ordering in orderings.items():
+            for rating in (None, 3):
+                with self.subTest(sort=sort, rating=rating):
+                    expected = Review.objects.filter(product=self.product).order_by(*ordering)
+                    params = {'sort': sort}
+                    if rating:
+                        expected = expected.filter(rating=rating)
+                        params['rating'] = rating
+
+                    ids, queries = self.walk(**params)
+
+                    self.assertEqual(ids, list(expected.values_list('id', flat=True)))
+                    self.assertFalse([sql for sql in queries if 'COUNT(' in sql or 'OFFSET' in sql])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse('reviews:review_list', args=[self.product.id]), {'cursor': 'garbage'},
+            headers={'HX-Request': 'true'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Outerwear')
+        self.jacket = Product.objects.create(
+            name='Black Jacket', slug='black-jacket', price='90.00', color='black', category=self.category,
+            description='Warm wool lining',
+        )
+        self.scarf = Product.objects.create(
+            name='Wool Scarf', slug='wool-scarf', price='20.00', color='grey', category=self.category,
+        )
+
+    def search(self, text):
+        return list(search_products(Product.objects.all(), text).order_by('-search_rank', 'id'))
+
+    def test_trigger_maintains_search_vector(self):
+        # Название, категория и описание - без явной записи search_vector
+        self.assertEqual(self.search('jack'), [self.jacket])
+        self.assertEqual(self.search('outer'), [self.jacket, self.scarf])
+        # Совпадение в названии (вес A) выше, чем в описании (вес C)
+        self.assertEqual(self.search('wool'), [self.scarf, self.jacket])
+
+        self.jacket.name = 'Red Parka'
+        self.jacket.save()
+        self.assertEqual(self.search('parka'), [self.jacket])
+        self.assertEqual(self.search('jacket'), [])
+
+        # Переименование категории обновляет товары триггером на main_category
+        self.category.name = 'Coats'
+        self.category.save()
+        self.assertEqual(self.search('coats'), [self.jacket, self.scarf])
+
+    def test_trigram_fallback_only_without_full_text_matches(self):
+        Product.objects.create(name='Jackat Blue', slug='jackat-blue', price='80.00', color='blue', category=self.category)
+
+        # Полнотекстовые совпадения есть - нечеткие не подмешиваются
+        self.assertEqual([product.name for product in self.search('jacket')], ['Black Jacket'])
+
+        # Опечатка: полнотекстовых совпадений нет, находит pg_trgm
+        with self.assertNumQueries(1):
+            found = self.search('blak jaket')
+        self.assertEqual(found[0], self.jacket)
+        self.assertTrue(all(product.search_rank > 0 for product in found))
+
+        response = self.client.get(reverse('main:product_catalog'), {'q': 'blak jaket'})
+        self.assertContains(response, 'Black Jacket')
+        self.assertNotContains(response, 'Wool Scarf')
+
+
+@override_settings(REVIEW_IMAGE_MAX_SIDE=300)
+class ReviewImageUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        category = Category.objects.create(name='Outerwear')
+        self.product = Product.objects.create(name='Coat', slug='coat', price='50.00', color='black', category=category)
+        self.user = get_user_model()._default_manager.create(email='author@example.com', first_name='A', last_name='B')
+        self.client.force_login(self.user)
+
+    def photo(self):
+        """JPEG 600x400 с EXIF: поворот на 90 градусов и координаты GPS"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {2: (55.0, 45.0, 0.0)}
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_photos_are_processed_off_request(self):
+        fake = SimpleUploadedFile('notes.png', b'not an image', content_type='image/png')
+        response = self.client.post(reverse('reviews:review_create', args=[self.product.id]), {
+            'rating': 5, 'title': 'Warm coat', 'content': 'Very warm coat, fits well and looks great.',
+            'images': [self.photo(), fake],
+        })
+        self.assertEqual(response.status_code, 302)
+
+        review = Review.objects.get(product=self.product)
+        self.assertEqual(review.images_pending, 2)
+        self.assertFalse(ReviewImage.objects.exists())
+        staged = list(ReviewImageUpload.objects.values_list('file', flat=True))
+        self.assertTrue(all(name.startswith(review_uploads.INCOMING_DIR) for name in staged))
+        list_url = reverse('reviews:review_list', args=[self.product.id])
+        self.assertContains(self.client.get(list_url, headers={'HX-Request': 'true'}), 'Processing 2 photos')
+
+        with ProcessPoolExecutor(max_workers=1) as executor, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(review_uploads.process_pending(executor), (1, 1))
+
+        review.refresh_from_db()
+        self.assertEqual(review.images_pending, 0)
+        with Image.open(review.images.get().image.path) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (200, 300)))
+            self.assertFalse(image.getexif())
+        rejected = ReviewImageUpload.objects.get()
+        self.assertEqual(rejected.status, 'failed')
+        self.assertIn('invalid or corrupted', rejected.last_error)
+        self.assertFalse(any(default_storage.exists(name) for name in staged))
+        self.assertNotContains(self.client.get(list_url, headers={'HX-Request': 'true'}), 'Processing')
+
+    def test_unreadable_upload_is_retried(self):
+        review = Review.objects.create(product=self.product, user=self.user, rating=4, title='Title', content='Text')
+        review_uploads.stage_uploads(review, [self.photo()])
+        default_storage.delete(ReviewImageUpload.objects.get().file)
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(review_uploads.process_pending(executor), (0, 0))
+            upload = ReviewImageUpload.objects.get()
+            self.assertEqual((upload.status, upload.attempts), ('pending', 1))
+            self.assertGreater(upload.next_attempt_at, review.created_at)
+            # Следующая попытка - только после паузы
+            self.assertEqual(review_uploads.process_pending(executor), (0, 0))
+        self.assertEqual(ReviewImageUpload.objects.get().attempts, 1)
+        review.refresh_from_db()
+        self.assertEqual(review.images_pending, 1)
+
+
+class ImageRenditionTests(TestCase):
+    template = Template("{% load image_tags %}{% rendition_url image 'card' %}|{% srcset image %}")
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.category = Category.objects.create(name='Outerwear')
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 300), 'navy').save(buffer, 'PNG')
+        self.original = buffer.getvalue()
+        self.product = Product.objects.create(
+            name='Coat', slug='coat', price='50.00', color='black', category=self.category,
+            main_image=SimpleUploadedFile('coat.png', self.original, content_type='image/png'),
+        )
+
+    def render(self, image):
+        return self.template.render(Context({'image': image}))
+
+    def build(self):
+        with ProcessPoolExecutor(max_workers=1) as executor, self.captureOnCommitCallbacks(execute=True):
+            return renditions.process_pending(executor)
+
+    def test_page_shows_original_until_renditions_are_built(self):
+        image = self.product.main_image
+        self.assertEqual(ImageRenditions.objects.get().name, image.name)
+        self.assertEqual(self.render(image), f'{image.url}|')
+        self.assertEqual(os.listdir(os.path.dirname(image.path)), ['coat.png'])
+
+        self.assertEqual(self.build(), (1, 0))
+        # Манифест запоминается на FieldFile до конца запроса - следующий запрос читает товар заново
+        image = Product.objects.get(id=self.product.id).main_image
+
+        # Имена производных - по хешу содержимого оригинала, узкий оригинал не увеличивается
+        digest = hashlib.sha256(self.original).hexdigest()[:12]
+        url = lambda rendition, extension: default_storage.url(f'products/main/coat.{rendition}.{digest}.{extension}')
+        expected = (
+            f"{url('card', 'jpg')}|"
+            f"{url('thumb', 'webp')} 160w, {url('card', 'webp')} 480w, {url('zoom', 'webp')} 600w"
+        )
+        self.assertEqual(self.render(image), expected)
+        with Image.open(default_storage.path(f'products/main/coat.zoom.{digest}.webp')) as zoom:
+            self.assertEqual((zoom.format, zoom.size), ('WEBP', (600, 300)))
+
+        # Манифест из общего кеша, а без него - из БД
+        cache.clear()
+        self.assertEqual(self.render(Product.objects.get(id=self.product.id).main_image), expected)
+
+    def test_catalog_reads_all_manifests_at_once(self):
+        for index in range(4):
+            Product.objects.create(
+                name=f'Jacket {index}', slug=f'jacket-{index}', price='30.00', color='black', category=self.category,
+                main_image=SimpleUploadedFile(f'jacket{index}.png', self.original, content_type='image/png'),
+            )
+        stdout = io.StringIO()
+        # Воркер закрывает устаревшие соединения - в TestCase (открытая транзакция) это сама база теста
+        with mock.patch('apps.main.queues.close_old_connections'), self.captureOnCommitCallbacks(execute=True):
+            call_command('process_image_renditions', once=True, processes=1, stdout=stdout, stderr=io.StringIO())
+        # Пачки по умолчанию вдвое больше пула
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'Built renditions for 2 images, 0 failed',
+            'Built renditions for 2 images, 0 failed',
+            'Built renditions for 1 images, 0 failed',
+        ])
+        url = reverse('main:product_catalog')
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(len(re.findall(r' src="[^"]+\.card\.[0-9a-f]{12}\.jpg"', response.content.decode())), 5)
+        # Версии, фасеты и манифесты всех пяти карточек - по одному чтению кеша
+        cache_queries = [query['sql'] for query in captured if 'django_cache' in query['sql']]
+        self.assertEqual(len(cache_queries), 3, cache_queries)
+
+    def test_broken_original_is_not_retried(self):
+        product = Product.objects.create(
+            name='Hat', slug='hat', price='10.00', color='red', category=self.category,
+            main_image=SimpleUploadedFile('hat.png', b'not an image', content_type='image/png'),
+        )
+        self.assertEqual(self.build(), (1, 1))
+        job = ImageRenditions.objects.get(name=product.main_image.name)
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertEqual(self.render(product.main_image), f'{product.main_image.url}|')
+
+    def test_page_queues_unknown_image_without_pinning_to_primary(self):
+        # Например, товары импорта: bulk_create не отправляет post_save
+        ImageRenditions.objects.all().delete()
+        state = routers.ReplicaState()
+        token = routers.activate(state)
+        self.addCleanup(routers.deactivate, token)
+        with routers.replica_reads():
+            self.assertEqual(self.render(self.product.main_image), f'{self.product.main_image.url}|')
+        self.assertFalse(state.wrote)
+        self.assertEqual(ImageRenditions.objects.get().status, 'pending')
+
+
+class QueueWorkerTests(SimpleTestCase):
+    def test_retry_policy_backs_off_up_to_max_delay(self):
+        policy = queues.RetryPolicy(max_attempts=4, base_delay=30, max_delay=100)
+        self.assertEqual([policy.delay(attempts).total_seconds() for attempts in (1, 2, 3, 4)], [30, 60, 100, 100])
+        self.assertFalse(policy.exhausted(3))
+        self.assertTrue(policy.exhausted(4))
+
+    def test_pool_worker_restarts_broken_pool_and_retries_batch(self):
+        results = [BrokenProcessPool('killed'), (2, 0), (0, 1)]
+        executors = []
+
+        class Command(queues.PoolWorkerCommand):
+            processes_setting = 'IMAGE_RENDITION_WORKERS'
+
+            def process_pending(self, executor, batch_size):
+                executors.append(executor)
+                result = results.pop(0)
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            def report(self, succeeded, failed):
+                self.stdout.write(f'{succeeded} ok, {failed} failed')
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(Command(), once=True, processes=1, stdout=stdout, stderr=stderr)
+        self.assertEqual(stdout.getvalue().splitlines(), ['2 ok, 0 failed', '0 ok, 1 failed'])
+        self.assertIn('Image pool broke (killed), restarting it', stderr.getvalue())
+        # После поломки пачка повторяется в новом пуле
+        self.assertIsNot(executors[0], executors[1])
+        self.assertIs(executors[1], executors[2])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.histograms.reset()
+        self.addCleanup(metrics.histograms.reset)
+
+    def test_collect_counts_queries_and_keeps_slowest(self):
+        with metrics.collect() as collected:
+            with connection.cursor() as cursor:
+                for _ in range(4):
+                    cursor.execute('SELECT 1')
+                cursor.execute('SELECT pg_sleep(0.02)')
+            with metrics.timer('stripe'):
+                pass
+            with metrics.timer('stripe'):
+                pass
+
+        self.assertEqual(collected.queries, 5)
+        self.assertGreaterEqual(collected.db_time, 0.02)
+        slowest = collected.slowest_queries()
+        self.assertEqual(len(slowest), metrics.SLOWEST_QUERIES)
+        self.assertEqual(slowest[0]['sql'], 'SELECT pg_sleep(0.02)')
+        self.assertEqual(slowest, sorted(slowest, key=lambda query: query['ms'], reverse=True))
+        self.assertEqual(list(collected.timers), ['stripe'])
+
+        # Вне collect() хуки ничего не делают
+        self.assertIsNone(metrics.current())
+        with metrics.timer('stripe'):
+            pass
+
+    def test_server_timing_header_and_histogram(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('main:product_catalog'))
+
+        match = re.fullmatch(
+            r'db;dur=\d+\.\d{2};desc="(\d+) queries", template;dur=\d+\.\d{2}, total;dur=\d+\.\d{2}',
+            response['Server-Timing'],
+        )
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertEqual(int(match[1]), len(captured))
+
+        snapshot = metrics.histograms.snapshot()['main:product_catalog']
+        self.assertEqual((snapshot['count'], snapshot['max_queries']), (1, len(captured)))
+        self.assertEqual(sum(snapshot['buckets'].values()), 1)
+
+        with override_settings(SERVER_TIMING_HEADER=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('main:product_catalog')))
+
+    def test_log_line_is_opt_in(self):
+        # По умолчанию (REQUEST_METRICS_LOG_LEVEL не задан) строка лога не пишется
+        self.assertFalse(logging.getLogger('apps.main.metrics').isEnabledFor(logging.INFO))
+
+        with self.assertLogs('apps.main.metrics', 'INFO') as logs:
+            self.client.get(reverse('main:product_catalog'))
+        [line] = logs.records
+        entry = json.loads(line.getMessage())
+        self.assertEqual((entry['event'], entry['view'], entry['status']), ('request', 'main:product_catalog', 200))
+        self.assertGreater(entry['queries'], 0)
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('main:request_metrics')
+        self.client.get(reverse('main:product_catalog'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        User = get_user_model()
+        user = User._default_manager.create(email='customer@example.com', first_name='C', last_name='D')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        User._default_manager.filter(id=user.id).update(is_staff=True)
+        response = self.client.get(url, {'reset': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('main:product_catalog', response.json()['views'])
+        self.assertNotIn('main:product_catalog', self.client.get(url).json()['views'])
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Outerwear')
+        self.product = Product.objects.create(name='Coat', slug='coat', price='50.00', color='black', category=category)
+        self.other = Product.objects.create(name='Hat', slug='hat', price='10.00', color='red', category=category)
+        self.users = [
+            get_user_model()._default_manager.create(email=f'author{index}@example.com', first_name='A', last_name='B')
+            for index in range(8)
+        ]
+
+    def summary(self):
+        fields = ['rating_avg', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+        return list(Product.objects.order_by('id').values_list(*fields))
+
+    def assertMatchesRebuild(self, rating_avg, rating_count):
+        incremental = self.summary()
+        self.assertEqual(incremental[0][:2], (Decimal(rating_avg), rating_count))
+        updated_at = list(Product.objects.order_by('id').values_list('updated_at', flat=True))
+        # Сводки совпадают - пересчет ничего не пишет и не меняет ETag страниц
+        self.assertEqual(rebuild_product_ratings(), 0)
+        self.assertEqual(self.summary(), incremental)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('updated_at', flat=True)), updated_at)
+
+    def review_form(self, rating):
+        return {'rating': rating, 'title': 'Warm coat', 'content': 'Very warm coat, fits well and looks great.'}
+
+    def test_add_edit_delete_match_rebuild(self):
+        # 33 / 8 = 4.125: граница округления
+        for user, rating in zip(self.users, (5, 5, 5, 4, 4, 4, 3, 3)):
+            self.client.force_login(user)
+            self.client.post(reverse('reviews:review_create', args=[self.product.id]), self.review_form(rating))
+        self.assertMatchesRebuild('4.13', 8)
+
+        review = Review.objects.get(user=self.users[-1])
+        self.client.force_login(self.users[-1])
+        self.client.post(reverse('reviews:review_edit', args=[review.id]), self.review_form(5))
+        self.assertMatchesRebuild('4.38', 8)
+
+        self.client.post(reverse('reviews:review_delete', args=[review.id]))
+        self.assertMatchesRebuild('4.29', 7)
+
+        for user in self.users[:-1]:
+            self.client.force_login(user)
+            self.client.post(reverse('reviews:review_delete', args=[Review.objects.get(user=user).id]))
+        self.assertMatchesRebuild('0.00', 0)
+
+    def test_rebuild_fixes_drifted_summary(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=2, title='Title', content='Text')
+        update_product_rating(self.product.id, added=2)
+        Product.objects.filter(id=self.product.id).update(rating_count=5, rating_5=4)
+        Product.objects.filter(id=self.other.id).update(rating_avg='3.00', rating_count=1, rating_3=1)
+
+        self.assertEqual(rebuild_product_ratings(), 2)
+        self.assertEqual(self.summary(), [
+            (Decimal('2.00'), 1, 0, 1, 0, 0, 0),
+            (Decimal('0.00'), 0, 0, 0, 0, 0, 0),
+        ])
+        self.assertEqual(rebuild_product_ratings(), 0)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Outerwear')
+        self.product = Product.objects.create(name='Coat', slug='coat', price='50.00', color='black', category=category)
+        self.stock = ProductSize.objects.create(product=self.product, size=Size.objects.create(name='M'), stock=3)
+        self.url = reverse('main:product_detail', args=[self.product.id, self.product.slug])
+
+    def revalidate(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        return response, [query['sql'] for query in queries]
+
+    def assert_revalidated(self, url, etag):
+        response, queries = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 304)
+        # SAVEPOINT и RELEASE от ATOMIC_REQUESTS, все версии из общего кеша
+        # одним запросом (DatabaseCache) и версия страницы
+        self.assertEqual(len(queries), 4, queries)
+        self.assertEqual(len([sql for sql in queries if 'django_cache' in sql]), 1)
+        return response
+
+    def test_product_page_answers_304_with_one_version_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.assert_revalidated(self.url, etag)
+        self.assertFalse(response.templates)
+        self.assertEqual(response['ETag'], etag)
+
+        # Остатки, сводка отзывов и правка отзыва меняют версию
+        ProductSize.objects.filter(id=self.stock.id).update(stock=2)
+        response, _ = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        user = get_user_model()._default_manager.create(email='author@example.com', first_name='A', last_name='B')
+        review = Review.objects.create(product=self.product, user=user, rating=4, title='Title', content='Text')
+        update_product_rating(self.product.id, added=4)
+        response, _ = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        review.content = 'Edited'
+        review.save(update_fields=['content', 'updated_at'])
+        self.assertEqual(self.revalidate(self.url, etag)[0].status_code, 200)
+
+    def test_personalized_pages_are_always_rendered(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'session'
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_catalog_answers_304_until_product_changes(self):
+        url = reverse('main:product_catalog')
+        etag = self.client.get(url)['ETag']
+
+        self.assert_revalidated(url, etag)
+
+        self.product.price = '40.00'
+        self.product.save()
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 200)
+
+    def test_updated_at_moves_and_created_at_stays(self):
+        created_at, updated_at = self.product.created_at, self.product.updated_at
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.created_at, created_at)
+        self.assertGreater(self.product.updated_at, updated_at)
+
+
+class ReferenceCacheTests(TestCase):
+    def test_version_is_shared_between_workers(self):
+        # Версия в кеше процесса: сброс увидел бы только один воркер
+        self.assertNotIn('locmem', settings.CACHES['default']['BACKEND'])
+
+    def test_save_bumps_version_and_every_worker_reloads(self):
+        Size.objects.create(name='S')
+        self.assertEqual([size.name for size in reference.reference_objects(Size)], ['S'])
+        # Справочник, загруженный другим воркером до правки
+        stale = dict(reference._loaded)
+        version = reference.reference_version()
+
+        Size.objects.create(name='M')
+
+        self.assertNotEqual(reference.reference_version(), version)
+        reference._loaded.clear()
+        reference._loaded.update(stale)
+        with self.assertNumQueries(2):
+            # Чтение версии из общего кеша и один запрос справочника
+            self.assertEqual([size.name for size in reference.reference_objects(Size)], ['S', 'M'])
+        with self.assertNumQueries(1):
+            # Вне запроса версия читается из общего кеша при каждом обращении
+            reference.reference_objects(Size)
+
+    def test_version_is_read_once_per_request(self):
+        Size.objects.create(name='S')
+        Category.objects.create(name='Tops')
+        reference.reference_objects(Size)
+        reference.reference_objects(Category)
+
+        token = versions.activate()
+        self.addCleanup(versions.deactivate, token)
+        with self.assertNumQueries(1):
+            reference.reference_objects(Size)
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                reference.reference_objects(Size)
+                reference.reference_objects(Category)
+
+        # Правка в том же запросе видна сразу, без повторного чтения версии
+        Size.objects.create(name='M')
+        with self.assertNumQueries(1):
+            self.assertEqual([size.name for size in reference.reference_objects(Size)], ['S', 'M'])
+
+    def test_warm_catalog_reads_version_once(self):
+        Size.objects.create(name='S')
+        Category.objects.create(name='Tops')
+        self.client.get(reverse('main:product_catalog'))
+
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('main:product_catalog'))
+        version_reads = [query for query in captured if reference.REFERENCE_VERSION_KEY in query['sql']]
+        self.assertEqual(len(version_reads), 1)
+        self.assertFalse([query for query in captured if 'main_size' in query['sql']])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.tops = Category.objects.create(name='Tops')
+        self.pants = Category.objects.create(name='Pants')
+        self.small = Size.objects.create(name='S')
+        self.medium = Size.objects.create(name='M')
+        for name, category, color, price, discount, sizes in (
+            ('Tee', self.tops, 'red', '20.00', True, [self.small]),
+            ('Shirt', self.tops, 'blue', '80.00', False, [self.small, self.medium]),
+            ('Jeans', self.pants, 'red', '150.00', False, [self.medium]),
+        ):
+            product = Product.objects.create(
+                name=name, slug=name.lower(), category=category, color=color, price=price, status_discount=discount,
+            )
+            for size in sizes:
+                ProductSize.objects.create(product=product, size=size, stock=1)
+
+    def facets(self, query):
+        return facets.get_facets(ProductFilter(QueryDict(query), queryset=Product.objects.all()))
+
+    def test_each_facet_ignores_its_own_filter(self):
+        result = self.facets(f'category={self.tops.id}')
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(result['category'], {self.tops.id: 2, self.pants.id: 1})
+        self.assertEqual(result['color'], [('blue', 1), ('red', 1)])
+        self.assertEqual(result['size'], {self.small.id: 2, self.medium.id: 1})
+        self.assertEqual(result['discount'], 1)
+        self.assertEqual([bucket['count'] for bucket in result['price']], [1, 1, 0, 0])
+
+        result = self.facets(f'category={self.tops.id}&color=red')
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['category'], {self.tops.id: 1, self.pants.id: 1})
+        self.assertEqual(result['color'], [('blue', 1), ('red', 1)])
+        self.assertEqual(result['size'], {self.small.id: 1})
+
+    def test_catalog_count_uses_all_filters(self):
+        response = self.client.get(reverse('main:product_catalog'), {'category': self.tops.id, 'sizes': self.medium.id})
+        self.assertEqual(response.context['results_count'], 1)
+
+    def test_equivalent_filters_share_cache_entry(self):
+        first = self.facets(f'color=Red&category={self.pants.id}&category={self.tops.id}&ordering=price')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.facets(f'category={self.tops.id}&category={self.pants.id}&color=red ')
+        self.assertEqual(second, first)
+        self.assertFalse([query for query in queries if 'main_product' in query['sql']])
+
+    def test_product_change_invalidates_cached_facets(self):
+        self.assertEqual(self.facets('')['total'], 3)
+        Product.objects.create(name='Coat', slug='coat', category=self.tops, color='black', price='99.00')
+        self.assertEqual(self.facets('')['total'], 4)
 
-# Create your tests here.
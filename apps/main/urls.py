@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import main_page,product_catalog,product_detail,wishlist
+from .views import main_page,product_catalog,product_catalog_more,product_detail,wishlist,request_metrics
 
 
 app_name = 'main'
@@ -8,6 +8,8 @@ app_name = 'main'
 urlpatterns = [
     path('',main_page, name='main_page'),
     path('catalog',product_catalog, name='product_catalog'),
+    path('catalog/more',product_catalog_more, name='product_catalog_more'),
     path('wishlist', wishlist, name='wishlist'),
+    path('metrics/requests', request_metrics, name='request_metrics'),
     path('<int:id>/<slug:slug>', product_detail, name='product_detail'),
 ]
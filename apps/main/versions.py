@@ -0,0 +1,55 @@
+import contextvars
+import uuid
+
+from django.core.cache import cache
+
+
+# Версии в общем кеше (справочники, фасеты, производные фото): по ним воркеры
+# узнают, что их данные устарели. С DatabaseCache каждое чтение кеша - SQL-запрос,
+# поэтому в запросе (VersionMemoMiddleware) каждая версия читается один раз,
+# а недостающие версии - одним cache.get_many. Вне запроса (команды, воркеры)
+# версии читаются из кеша при каждом обращении.
+
+_memo = contextvars.ContextVar('cache_versions', default=None)
+
+
+def activate():
+    return _memo.set({})
+
+
+def deactivate(token):
+    _memo.reset(token)
+
+
+def new_version():
+    # Случайная, а не счетчик: кеш в БД откатывается вместе с транзакцией,
+    # и счетчик мог бы снова выдать версию, под которой воркер запомнил другие данные
+    return uuid.uuid4().hex
+
+
+def get_versions(*keys):
+    """Версии по ключам в том же порядке; отсутствующие в кеше создаются"""
+    memo = _memo.get()
+    if memo is None:
+        memo = {}
+    missing = [key for key in keys if key not in memo]
+    if missing:
+        found = cache.get_many(missing)
+        for key in missing:
+            if key not in found:
+                found[key] = cache.get_or_set(key, new_version, None)
+        memo.update(found)
+    return [memo[key] for key in keys]
+
+
+def get_version(key):
+    return get_versions(key)[0]
+
+
+def bump_version(key):
+    """Новая версия для всех воркеров; текущий запрос видит ее сразу"""
+    version = new_version()
+    cache.set(key, version, None)
+    memo = _memo.get()
+    if memo is not None:
+        memo[key] = version
@@ -1,62 +1,151 @@
-from django.shortcuts import render, get_object_or_404
-from apps.main.models import Category, Size, Product
+import os
+
+from django.conf import settings
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render, get_object_or_404, redirect
+from apps.main.models import Product
+from apps.main.reference import attach_reference
+from apps.main.routers import use_replica
 from apps.main.filters import ProductFilter
-from django.db.models import Count, Avg, Q
-from apps.main.review_models import Review  # ← ЭТО ВАЖНО
+from apps.main import metrics
+from apps.main.conditional import catalog_version, conditional_page, product_version
+from apps.main.facets import get_facets
+from apps.main.ratings import rating_stats
+from apps.main.renditions import attach_renditions
+from apps.main.review_feed import load_review_feed
+from apps.main.pagination import KeysetPaginator, InvalidCursor, approximate_table_count
 
 
 def main_page(request):
     return render(request, 'main/main.html')
 
 
-def product_catalog(request):
-    products = Product.objects.all().select_related('category').prefetch_related('productsize_set__size')
-    
+def _catalog_ordering(product_filter):
+    """Сортировка из ProductFilter + id как уникальный ключ для курсора"""
+    cleaned_data = product_filter.form.cleaned_data if product_filter.is_valid() else {}
+    ordering = cleaned_data.get('ordering')
+    if not ordering:
+        # При поиске по умолчанию - по релевантности (аннотация из search_products)
+        if 'search_rank' in product_filter.qs.query.annotations:
+            return ('-search_rank', '-id')
+        return ('-id',)
+    # Параметр сортировки -> поле модели (?ordering=-rating -> -rating_avg)
+    field = product_filter.filters['ordering'].get_ordering_value(ordering[0])
+    return (field, '-id' if field.startswith('-') else 'id')
+
+
+def _catalog_page(request):
+    # Размеры в карточках каталога не выводятся - без prefetch productsize_set__size
+    products = Product.objects.all().select_related('category')
+
     product_filter = ProductFilter(request.GET, queryset=products)
-    filtered_products = product_filter.qs
-    
-    categories = Category.objects.annotate(product_count=Count('products'))
-    sizes = Size.objects.annotate(product_count=Count('product_size'))
-    
-    total_products = Product.objects.count()
-    filtered_count = filtered_products.count()
-    
+    paginator = KeysetPaginator(
+        product_filter.qs,
+        ordering=_catalog_ordering(product_filter),
+        per_page=settings.CATALOG_PAGE_SIZE,
+    )
+    page = paginator.get_page(request.GET.get('cursor'))
+    # Манифесты производных всех карточек страницы - одним чтением кеша
+    attach_renditions(product.main_image for product in page)
+
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+
+    return product_filter, page, next_query
+
+
+@use_replica
+@conditional_page(catalog_version)
+def product_catalog(request):
+    try:
+        product_filter, page, next_query = _catalog_page(request)
+    except InvalidCursor:
+        return redirect('main:product_catalog')
+
+    facets = get_facets(product_filter)
+
+    # Число товаров со всеми фильтрами считается вместе с фасетами, отдельный count() не нужен
+    filtered_count = facets['total']
+
+    approximate = settings.CATALOG_APPROXIMATE_COUNT
+    if approximate:
+        total_products = approximate_table_count(Product)
+    else:
+        total_products = Product.objects.count()
+
     context = {
         'filter': product_filter,
-        'products': filtered_products,
-        'categories': categories,
-        'sizes': sizes,
+        'page': page,
+        'next_query': next_query,
+        'facets': facets,
         'results_count': filtered_count,
         'total_products': total_products,
+        'approximate_count': approximate,
     }
-    
+
     return render(request, 'main/catalog.html', context)
 
 
+@use_replica
+@conditional_page(catalog_version)
+def product_catalog_more(request):
+    """HTMX: следующая страница каталога по курсору"""
+    try:
+        product_filter, page, next_query = _catalog_page(request)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+
+    context = {
+        'page': page,
+        'next_query': next_query,
+    }
+    return render(request, 'main/partials/catalog_page.html', context)
+
+
+@use_replica
+@conditional_page(product_version)
 def product_detail(request, id, slug):
     product = get_object_or_404(
-        Product.objects.select_related('category').prefetch_related('images', 'productsize_set__size'),
+        Product.objects.select_related('category').prefetch_related('images', 'productsize_set'),
         id=id,
         slug=slug
     )
+    # Размеры - из кеша справочников (apps.main.reference), без отдельного запроса
+    attach_reference(product.productsize_set.all(), 'size')
     
-    # Статистика отзывов
-    stats = Review.objects.filter(product=product).aggregate(
-        avg_rating=Avg('rating'),
-        total_reviews=Count('id'),
-        rating_5=Count('id', filter=Q(rating=5)),
-        rating_4=Count('id', filter=Q(rating=4)),
-        rating_3=Count('id', filter=Q(rating=3)),
-        rating_2=Count('id', filter=Q(rating=2)),
-        rating_1=Count('id', filter=Q(rating=1)),
-    )
+    # Статистика отзывов (денормализована в Product, см. apps.main.ratings)
+    stats = rating_stats(product)
     
+    feed = load_review_feed(product, request.user)
+    attach_renditions([
+        product.main_image,
+        *(image.image for image in product.images.all()),
+        *(image.image for review in feed['reviews'] for image in review.images.all()),
+    ])
+
     context = {
         'product': product,
         'stats': stats,
+        **feed,
     }
     return render(request, 'main/product_detail.html', context=context)
 
 
+def request_metrics(request):
+    """
+    Гистограммы времени ответа по имени URL (RequestMetricsMiddleware), ?reset=1 - обнулить.
+    Только для staff; остальным - 403, а не редирект на вход в админку (JSON читают скрипты).
+    """
+    if not (request.user.is_active and request.user.is_staff):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    snapshot = metrics.histograms.snapshot()
+    if request.GET.get('reset') == '1':
+        metrics.histograms.reset()
+    return JsonResponse({'pid': os.getpid(), 'views': snapshot})
+
+
 def wishlist(request):
     return render(request, 'main/wishlist.html', context={})
\ No newline at end of file
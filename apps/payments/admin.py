@@ -1,5 +1,39 @@
+from decimal import Decimal
+
 from django.contrib import admin
-from .models import Order, OrderItem
+from django.core.paginator import Paginator
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from apps.main.pagination import approximate_table_count
+from . import rollups
+from .models import Order, OrderItem, StockReservation, WebhookEvent
+
+
+def items_subtotal():
+    """Сумма позиций заказа одним подзапросом - вычисляется только для строк страницы"""
+    subtotal = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(
+        subtotal=Sum(F('price') * F('quantity')),
+    ).values('subtotal')
+    return Coalesce(
+        Subquery(subtotal, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0.00')),
+    )
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Без фильтров и поиска число строк берется из статистики PostgreSQL:
+    COUNT(*) по миллионам заказов занимает секунды на каждом открытии списка.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            return approximate_table_count(self.object_list.model, using=self.object_list.db)
+        return super().count
 
 
 class OrderItemInline(admin.TabularInline):
@@ -8,12 +42,26 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ['product', 'size', 'price', 'quantity', 'get_cost']
     can_delete = False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product', 'size')
+
+    def has_add_permission(self, request, obj=None):
+        # Все поля только для чтения - пустая форма новой позиции не нужна
+        return False
+
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'email', 'status', 'total_amount', 'created_at']
-    list_filter = ['status', 'created_at']
-    search_fields = ['id', 'email', 'first_name', 'last_name', 'stripe_payment_intent_id']
+    list_display = ['id', 'email', 'status', 'total_amount', 'get_total_cost', 'created_at']
+    # Оба фильтра по индексам: (status, -created_at) и (-created_at);
+    # фильтр даты - диапазоны created_at__gte/__lt
+    list_filter = ['status', ('created_at', admin.DateFieldListFilter)]
+    # id и payment intent - точное совпадение по индексу, см. get_search_results
+    search_fields = ['=stripe_payment_intent_id', 'email', 'first_name', 'last_name']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     readonly_fields = [
         'created_at', 'updated_at', 'stripe_payment_intent_id',
         'stripe_charge_id', 'get_total_cost'
@@ -42,15 +90,57 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(items_subtotal=items_subtotal())
+
+    def get_search_results(self, request, queryset, search_term):
+        # "#123" или "123" - номер заказа: поиск по первичному ключу, а не icontains по тексту
+        order_id = search_term.strip().lstrip('#')
+        if order_id.isdigit():
+            return queryset.filter(id=int(order_id)), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data:
+            # Смена статуса переносит заказ между строками сводок продаж
+            rollups.record_order(obj, form.initial['status'])
+
+    @admin.display(description='Total Cost')
     def get_total_cost(self, obj):
         return f'${obj.get_total_cost()}'
 
-    get_total_cost.short_description = 'Total Cost'
-
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'product', 'size', 'quantity', 'price', 'get_cost']
-    list_filter = ['order__created_at']
-    search_fields = ['order__id', 'product__name']
-    readonly_fields = ['get_cost']
\ No newline at end of file
+    list_filter = ['order__status', ('order__created_at', admin.DateFieldListFilter)]
+    # Номер заказа ищется в get_search_results по order_id
+    search_fields = ['product__name']
+    list_select_related = ['order', 'product', 'size']
+    raw_id_fields = ['order', 'product', 'size']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    readonly_fields = ['get_cost']
+
+    def get_search_results(self, request, queryset, search_term):
+        order_id = search_term.strip().lstrip('#')
+        if order_id.isdigit():
+            return queryset.filter(order_id=int(order_id)), False
+        return super().get_search_results(request, queryset, search_term)
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_id', 'type', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id']
+    readonly_fields = ['event_id', 'type', 'payload', 'created_at', 'processed_at', 'last_error']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'key', 'product_size', 'quantity', 'expires_at', 'created_at']
+    search_fields = ['=key']
+    list_select_related = ['product_size']
+    raw_id_fields = ['product_size']
+    readonly_fields = ['key', 'product_size', 'quantity', 'expires_at', 'created_at']
@@ -1,5 +1,8 @@
+from datetime import timedelta
+
 from django import forms
 from django.core.validators import RegexValidator
+from django.utils import timezone
 import re
 
 
@@ -156,4 +159,24 @@ class CheckoutForm(forms.Form):
     def clean_postal_code(self):
         """Clean postal code"""
         postal_code = self.cleaned_data.get('postal_code', '').strip().upper()
-        return postal_code
\ No newline at end of file
+        return postal_code
+
+class SalesReportForm(forms.Form):
+    """Период отчета о продажах; по умолчанию - последние 30 дней"""
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 366 * 3
+
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        end = cleaned_data.get('end') or timezone.localdate()
+        start = cleaned_data.get('start') or end - timedelta(days=self.DEFAULT_DAYS - 1)
+        if start > end:
+            raise forms.ValidationError('Start date must not be after end date')
+        if (end - start).days >= self.MAX_DAYS:
+            raise forms.ValidationError(f'The period cannot exceed {self.MAX_DAYS} days')
+        cleaned_data['start'] = start
+        cleaned_data['end'] = end
+        return cleaned_data
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from apps.main import metrics
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def configure():
+    """
+    Настроить клиент Stripe: ключ, адрес API, таймаут и общий пул HTTP-соединений
+    (keep-alive к api.stripe.com вместо нового TLS-рукопожатия на каждый вызов).
+    Вызывается из PaymentsConfig.ready(); тесты вызывают повторно для своего сервера.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_MAX_CONNECTIONS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    stripe.default_http_client = stripe.http_client.RequestsClient(
+        timeout=settings.STRIPE_TIMEOUT, session=session,
+    )
+
+
+def _get_executor():
+    # Отдельный пул: медленный Stripe не занимает потоки, в которых работает ORM
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.STRIPE_MAX_CONNECTIONS, thread_name_prefix='stripe',
+                )
+    return _executor
+
+
+def _in_executor(func):
+    async def wrapper(*args, **kwargs):
+        return await sync_to_async(func, thread_sensitive=False, executor=_get_executor())(*args, **kwargs)
+
+    wrapper.__name__ = f'a{func.__name__}'
+    wrapper.__doc__ = f'Асинхронный вариант {func.__name__} (в пуле потоков Stripe)'
+    return wrapper
+
+
+def create_payment_intent(amount, currency, metadata=None, idempotency_key=None):
+    """amount - в минимальных единицах валюты (центах)"""
+    with metrics.timer('stripe'):
+        return stripe.PaymentIntent.create(
+            amount=amount,
+            currency=currency,
+            metadata=metadata or {},
+            idempotency_key=idempotency_key,
+        )
+
+
+def modify_payment_intent(intent_id, amount, metadata=None, idempotency_key=None):
+    with metrics.timer('stripe'):
+        return stripe.PaymentIntent.modify(
+            intent_id,
+            amount=amount,
+            metadata=metadata or {},
+            idempotency_key=idempotency_key,
+        )
+
+
+def retrieve_payment_intent(intent_id):
+    with metrics.timer('stripe'):
+        return stripe.PaymentIntent.retrieve(intent_id)
+
+
+acreate_payment_intent = _in_executor(create_payment_intent)
+amodify_payment_intent = _in_executor(modify_payment_intent)
+aretrieve_payment_intent = _in_executor(retrieve_payment_intent)
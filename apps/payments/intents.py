@@ -0,0 +1,114 @@
+import hashlib
+import json
+import uuid
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import gateway
+
+
+# Ключи сессии: PaymentIntent текущего оформления и id попытки оформления
+SESSION_KEY = 'payment_intent'
+ATTEMPT_KEY = 'checkout_attempt'
+
+
+def cart_fingerprint(cart, amount, metadata):
+    """
+    Хеш содержимого корзины, суммы и metadata. Пока он не изменился,
+    уже созданный PaymentIntent подходит без обращения к Stripe.
+    """
+    lines = sorted(
+        (item['product_id'], item['size_id'], item['quantity'], item['price'])
+        for item in cart.cart.values()
+    )
+    data = json.dumps([lines, amount, settings.STRIPE_CURRENCY, metadata], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+def checkout_attempt(session):
+    """
+    Id попытки оформления - основа ключа идемпотентности для create. Живет в
+    сессии до создания заказа: повторная отправка формы (двойной клик, повтор
+    после таймаута) с той же корзиной получает тот же PaymentIntent от самого Stripe.
+    """
+    attempt = session.get(ATTEMPT_KEY)
+    if attempt is None:
+        attempt = session[ATTEMPT_KEY] = uuid.uuid4().hex
+    return attempt
+
+
+def stored_intent(session):
+    """{'id', 'client_secret', 'fingerprint', 'revision'} или None"""
+    return session.get(SESSION_KEY)
+
+
+def forget_intent(session):
+    """Оформление завершено (или intent больше не годится): следующая оплата - новый intent"""
+    session.pop(SESSION_KEY, None)
+    session.pop(ATTEMPT_KEY, None)
+
+
+def _load(session):
+    return stored_intent(session), checkout_attempt(session)
+
+
+def _remember(session, intent, fingerprint, revision):
+    session[SESSION_KEY] = {
+        'id': intent.id,
+        'client_secret': intent.client_secret,
+        'fingerprint': fingerprint,
+        'revision': revision,
+    }
+
+
+def _amodify(intent_id, amount, metadata, revision):
+    return gateway.amodify_payment_intent(
+        intent_id,
+        amount=amount,
+        metadata=metadata,
+        idempotency_key=f'pi-{intent_id}-rev{revision}',
+    )
+
+
+async def aprepare_intent(session, fingerprint, amount, metadata):
+    """
+    PaymentIntent для текущей корзины:
+      - корзина и сумма не менялись - сохраненный intent, без запросов к Stripe;
+      - изменились - PaymentIntent.modify того же intent;
+      - intent уже нельзя менять (оплачен, отменен) или его нет - create.
+    Каждый запрос к Stripe идет с ключом идемпотентности, поэтому повтор
+    того же вызова (ретраи, двойная отправка) не создает второй intent.
+    Возвращает dict из stored_intent. Ошибки Stripe пробрасываются.
+    """
+    stored, attempt = await sync_to_async(_load)(session)
+    if stored is not None and stored['fingerprint'] == fingerprint:
+        return stored
+
+    if stored is not None:
+        revision = stored['revision'] + 1
+        try:
+            try:
+                intent = await _amodify(stored['id'], amount, metadata, revision)
+            except stripe.error.IdempotencyError:
+                # Ключ этой ревизии уже ушел в Stripe с другой корзиной (ответ или
+                # сохранение сессии потерялись) - один повтор со следующей ревизией
+                revision += 1
+                intent = await _amodify(stored['id'], amount, metadata, revision)
+        except stripe.error.InvalidRequestError:
+            stored = None
+            await sync_to_async(forget_intent)(session)
+            attempt = await sync_to_async(checkout_attempt)(session)
+        else:
+            await sync_to_async(_remember)(session, intent, fingerprint, revision)
+            return stored_intent(session)
+
+    intent = await gateway.acreate_payment_intent(
+        amount=amount,
+        currency=settings.STRIPE_CURRENCY,
+        metadata=metadata,
+        idempotency_key=f'checkout-{attempt}-{fingerprint}',
+    )
+    await sync_to_async(_remember)(session, intent, fingerprint, 0)
+    return stored_intent(session)
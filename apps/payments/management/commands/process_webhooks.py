@@ -0,0 +1,12 @@
+from apps.main.queues import QueueWorkerCommand
+from apps.payments.webhooks import process_pending
+
+
+class Command(QueueWorkerCommand):
+    help = 'Process queued Stripe webhook events (retries failed events with exponential backoff)'
+
+    def process_batch(self, batch_size):
+        return process_pending(batch_size=batch_size)
+
+    def report(self, succeeded, failed):
+        self.stdout.write(f'Processed {succeeded} webhook events, {failed} failed')
@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.payments.models import Order
+from apps.payments.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute daily sales rollups from orders for a date window (idempotent). '
+        'By default yesterday and today; run nightly to fix drift.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2,
+                            help='Rebuild this many days ending today')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day, YYYY-MM-DD')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day, YYYY-MM-DD (default today)')
+        parser.add_argument('--all', action='store_true', help='Rebuild from the first order')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Days per transaction: rollup tables are locked while a chunk is rebuilt')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        if options['all']:
+            first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            start = timezone.localdate(first) if first else end
+        elif options['start']:
+            start = options['start']
+        else:
+            start = end - timedelta(days=options['days'] - 1)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        chunk = timedelta(days=options['chunk_days'])
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + chunk - timedelta(days=1), end)
+            rebuild(chunk_start, chunk_end)
+            self.stdout.write(f'Rebuilt sales rollups for {chunk_start}..{chunk_end}')
+            chunk_start = chunk_end + timedelta(days=1)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.payments.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Return expired checkout stock reservations to stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Seconds to sleep when nothing has expired')
+        parser.add_argument('--once', action='store_true',
+                            help='Release what has expired and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            close_old_connections()
+            released = release_expired(batch_size=batch_size)
+            if released:
+                self.stdout.write(f'Released {released} expired reservations')
+
+            # Полная пачка - вероятно, истекших больше, берем следующую сразу
+            if released >= batch_size:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
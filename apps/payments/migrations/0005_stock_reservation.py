@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_product_rating_summary'),
+        ('payments', '0004_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32)),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product_size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='main.productsize')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='payments_reservation_exp_idx')],
+                'constraints': [models.UniqueConstraint(fields=('key', 'product_size'), name='payments_reservation_unique')],
+            },
+        ),
+    ]
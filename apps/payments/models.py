@@ -1,8 +1,9 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from decimal import Decimal
-from apps.main.models import Product, ProductSize
+from apps.main.models import Category, Product, ProductSize
 
 
 class Order(models.Model):
@@ -72,6 +73,7 @@ class Order(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
+            models.Index(fields=['status', '-created_at']),
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['stripe_payment_intent_id']),
         ]
@@ -81,7 +83,10 @@ class Order(models.Model):
 
     def get_total_cost(self):
         """Calculate total cost including shipping and tax"""
-        subtotal = sum(item.get_cost() for item in self.items.all())
+        # items_subtotal - аннотация из OrderAdmin.get_queryset (без запроса к позициям)
+        subtotal = getattr(self, 'items_subtotal', None)
+        if subtotal is None:
+            subtotal = sum(item.get_cost() for item in self.items.all())
         return subtotal + self.shipping_cost + self.tax_amount
 
 
@@ -98,7 +103,124 @@ class OrderItem(models.Model):
         ]
 
     def __str__(self):
-        return f'{self.quantity}x {self.product.name} - Order #{self.order.id}'
+        return f'{self.quantity}x {self.product.name} - Order #{self.order_id}'
 
     def get_cost(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class WebhookEvent(models.Model):
+    """
+    Входящие события Stripe. Вебхук только сохраняет событие и отвечает 200,
+    обрабатывает их команда process_webhooks (apps.payments.webhooks).
+    Уникальный event_id отсекает повторную доставку одного события.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Очередь воркера: pending с наступившим next_attempt_at
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                name='payments_webhook_queue_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.type} {self.event_id} ({self.status})'
+
+
+# Сводки продаж по дням (apps.payments.rollups): отчеты читают только их,
+# а не Order/OrderItem. День - дата created_at заказа в текущем часовом поясе.
+
+class DailySales(models.Model):
+    """Число заказов и выручка (total_amount) за день по статусу заказа"""
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['date', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='payments_dailysales_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.status}: {self.orders} orders, {self.revenue}'
+
+
+class DailyProductSales(models.Model):
+    """Продано единиц и выручка по позициям (без доставки и налога) за день по товару и размеру"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    size = models.ForeignKey(ProductSize, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['date', 'product', 'size']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product', 'size'], name='payments_dailyproductsales_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} product {self.product_id} size {self.size_id}: {self.units}'
+
+
+class DailyCategorySales(models.Model):
+    """Продано единиц и выручка по позициям за день по категории товара"""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['date', 'category']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='payments_dailycategorysales_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} category {self.category_id}: {self.units}'
+
+
+class StockReservation(models.Model):
+    """
+    Остаток, отложенный под оформляемый заказ. При создании резерва единицы
+    сразу вычитаются из ProductSize.stock, поэтому витрина и другие покупатели
+    видят уже уменьшенный остаток. Резерв превращается в заказ в payment_success
+    или возвращается на склад по истечении expires_at (release_reservations).
+    """
+    # Ключ резерва из сессии покупателя (apps.payments.reservations.reservation_key)
+    key = models.CharField(max_length=32)
+    product_size = models.ForeignKey(ProductSize, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'product_size'], name='payments_reservation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='payments_reservation_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity}x product size {self.product_size_id} until {self.expires_at} ({self.key})'
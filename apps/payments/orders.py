@@ -0,0 +1,132 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+
+from apps.main.models import ProductSize
+from . import rollups
+from .models import Order, OrderItem
+
+
+class InsufficientStock(Exception):
+    """Остатка не хватает хотя бы для одной позиции, заказ не создан"""
+
+    def __init__(self, shortages):
+        # [(product_id, size_id, запрошено, в наличии), ...]
+        self.shortages = shortages
+        super().__init__(', '.join(
+            f'product {product_id} size {size_id}: requested {requested}, available {available}'
+            for product_id, size_id, requested, available in shortages
+        ))
+
+
+def _quantities(lines):
+    """Количества по (product_id, size_id): одинаковые позиции складываются"""
+    quantities = {}
+    for line in lines:
+        key = (line['product'].id, int(line['size_id']))
+        quantities[key] = quantities.get(key, 0) + line['quantity']
+    return quantities
+
+
+def reserve_stock(quantities, held=None):
+    """
+    Списать остатки для {(product_id, size_id): количество} и вернуть
+    {(product_id, size_id): ProductSize}. Вызывать внутри transaction.atomic().
+
+    held - то, что покупатель уже держит (резерв checkout, см. apps.payments.reservations):
+    эти единицы уже вычтены из stock, поэтому списывается только разница,
+    а лишнее из held возвращается на склад. quantities={} - просто вернуть held.
+
+    Строки ProductSize блокируются в порядке id, поэтому два заказа с
+    пересекающимися позициями не ловят взаимную блокировку, а ждут друг друга.
+    Само списание - один UPDATE ... WHERE stock >= qty для всех строк сразу;
+    если он затронул не все строки, остатка не хватило.
+    """
+    held = held or {}
+    keys = set(quantities) | set(held)
+    if not keys:
+        return {}
+    lookup = reduce(or_, (Q(product_id=product_id, size_id=size_id) for product_id, size_id in keys))
+    product_sizes = {
+        (product_size.product_id, product_size.size_id): product_size
+        for product_size in ProductSize.objects.select_for_update().filter(lookup).order_by('id')
+    }
+
+    shortages = []
+    for (product_id, size_id), quantity in quantities.items():
+        product_size = product_sizes.get((product_id, size_id))
+        available = (product_size.stock if product_size else 0) + held.get((product_id, size_id), 0)
+        if available < quantity:
+            shortages.append((product_id, size_id, quantity, available))
+    if shortages:
+        raise InsufficientStock(shortages)
+
+    # Сколько списать (> 0) или вернуть (< 0) по каждой позиции
+    delta_by_key = {
+        key: quantities.get(key, 0) - held.get(key, 0)
+        for key in keys if key in product_sizes and quantities.get(key, 0) != held.get(key, 0)
+    }
+    if delta_by_key:
+        delta_by_id = {product_sizes[key].id: delta for key, delta in delta_by_key.items()}
+        updated = ProductSize.objects.filter(
+            reduce(or_, (Q(id=pk, stock__gte=max(delta, 0)) for pk, delta in delta_by_id.items()))
+        ).update(
+            stock=Case(*(When(id=pk, then=F('stock') - delta) for pk, delta in delta_by_id.items()))
+        )
+        if updated != len(delta_by_id):
+            # Строки заблокированы, так что сюда попасть не должны - но если
+            # остаток изменили в обход блокировки, откатываем весь заказ
+            raise InsufficientStock([
+                (product_id, size_id, quantity, None) for (product_id, size_id), quantity in quantities.items()
+            ])
+
+    for key, delta in delta_by_key.items():
+        product_sizes[key].stock -= delta
+    return product_sizes
+
+
+def place_order(lines, held=None, **order_fields):
+    """
+    Создать заказ из позиций корзины (dict с product, size_id, price, quantity)
+    и списать остатки. Все или ничего: при нехватке любой позиции
+    поднимается InsufficientStock, заказ и остатки не меняются.
+    held - уже зарезервированные покупателем количества (см. reserve_stock).
+
+    Запросы не зависят от числа позиций: блокировка, списание,
+    INSERT заказа и один bulk_create позиций.
+    """
+    lines = list(lines)
+    if not lines:
+        raise ValueError('Cannot place an order without items')
+
+    with transaction.atomic():
+        product_sizes = reserve_stock(_quantities(lines), held)
+
+        order = Order.objects.create(**order_fields)
+        items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=line['product'],
+                size=product_sizes[(line['product'].id, int(line['size_id']))],
+                price=line['price'],
+                quantity=line['quantity'],
+            )
+            for line in lines
+        ])
+        rollups.record_order(order, items=items)
+    return order
+
+
+def restore_stock(order):
+    """Вернуть на склад остатки позиций заказа (отмена, возврат) одним UPDATE"""
+    quantities = {}
+    for product_size_id, quantity in order.items.values_list('size_id', 'quantity'):
+        quantities[product_size_id] = quantities.get(product_size_id, 0) + quantity
+    if not quantities:
+        return 0
+
+    return ProductSize.objects.filter(id__in=quantities).update(
+        stock=Case(*(When(id=pk, then=F('stock') + quantity) for pk, quantity in quantities.items()))
+    )
@@ -0,0 +1,108 @@
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from apps.main.models import Category, Product, ProductSize, Size
+from apps.main.reference import reference_objects
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order
+from .rollups import SOLD_STATUSES
+
+
+# Отчеты о продажах: читают только сводки (DailySales, DailyProductSales,
+# DailyCategorySales), поэтому год данных - это сотни строк, а не все заказы.
+
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+
+def daily_sales(start, end):
+    """
+    По дням: заказы и выручка по статусам и итог по проданным
+    (SOLD_STATUSES). Дни без заказов пропускаются.
+    """
+    days = {}
+    for row in DailySales.objects.filter(date__gte=start, date__lte=end).order_by('date', 'status'):
+        day = days.setdefault(row.date, {
+            'date': row.date, 'orders': 0, 'revenue': Decimal('0.00'), 'statuses': {},
+        })
+        day['statuses'][row.status] = {'orders': row.orders, 'revenue': row.revenue}
+        if row.status in SOLD_STATUSES:
+            day['orders'] += row.orders
+            day['revenue'] += row.revenue
+    return list(days.values())
+
+
+def status_totals(start, end):
+    rows = (
+        DailySales.objects.filter(date__gte=start, date__lte=end)
+        .values('status').annotate(orders=Sum('orders'), revenue=Sum('revenue')).order_by('status')
+    )
+    return [
+        {'status': row['status'], 'label': STATUS_LABELS.get(row['status'], row['status']),
+         'orders': row['orders'], 'revenue': row['revenue']}
+        for row in rows
+    ]
+
+
+def top_products(start, end, limit=20):
+    """Самые продаваемые товар+размер за период; названия дочитываются только для top-N"""
+    rows = list(
+        DailyProductSales.objects.filter(date__gte=start, date__lte=end)
+        .values('product_id', 'size_id').annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .filter(units__gt=0).order_by('-units', '-revenue', 'product_id')[:limit]
+    )
+    products = Product.objects.only('name').in_bulk({row['product_id'] for row in rows})
+    product_sizes = ProductSize.objects.only('size_id').in_bulk({row['size_id'] for row in rows})
+    sizes = {size.id: size for size in reference_objects(Size)}
+    for row in rows:
+        product = products.get(row['product_id'])
+        product_size = product_sizes.get(row['size_id'])
+        size = sizes.get(product_size.size_id) if product_size else None
+        row['product'] = product.name if product else f'#{row["product_id"]}'
+        row['size'] = size.name if size else ''
+    return rows
+
+
+def category_sales(start, end):
+    categories = {category.id: category for category in reference_objects(Category)}
+    rows = list(
+        DailyCategorySales.objects.filter(date__gte=start, date__lte=end)
+        .values('category_id').annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue', 'category_id')
+    )
+    for row in rows:
+        category = categories.get(row['category_id'])
+        row['category'] = category.name if category else f'#{row["category_id"]}'
+    return rows
+
+
+def _daily_csv(start, end):
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    yield ['date', 'orders', 'revenue'] + [
+        f'{status}_{column}' for status in statuses for column in ('orders', 'revenue')
+    ]
+    for day in daily_sales(start, end):
+        row = [day['date'].isoformat(), day['orders'], day['revenue']]
+        for status in statuses:
+            values = day['statuses'].get(status, {'orders': 0, 'revenue': Decimal('0.00')})
+            row += [values['orders'], values['revenue']]
+        yield row
+
+
+def _products_csv(start, end):
+    yield ['product_id', 'product', 'size', 'units', 'revenue']
+    for row in top_products(start, end, limit=None):
+        yield [row['product_id'], row['product'], row['size'], row['units'], row['revenue']]
+
+
+def _categories_csv(start, end):
+    yield ['category_id', 'category', 'units', 'revenue']
+    for row in category_sales(start, end):
+        yield [row['category_id'], row['category'], row['units'], row['revenue']]
+
+
+# CSV-выгрузки: имя отчета -> генератор строк (первая - заголовок)
+CSV_REPORTS = {
+    'daily': _daily_csv,
+    'products': _products_csv,
+    'categories': _categories_csv,
+}
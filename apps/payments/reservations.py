@@ -0,0 +1,124 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from apps.main.models import ProductSize
+from .models import StockReservation
+from .orders import _quantities, place_order, reserve_stock
+
+
+# Ключ сессии, под которым лежит ключ резерва покупателя
+SESSION_KEY = 'stock_reservation'
+
+
+def reservation_key(session):
+    """
+    Ключ резервов покупателя. Хранится в данных сессии, а не равен session_key:
+    при входе в аккаунт Django меняет session_key, а данные сессии переносит.
+    """
+    key = session.get(SESSION_KEY)
+    if key is None:
+        key = session[SESSION_KEY] = uuid.uuid4().hex
+    return key
+
+
+def _held(key):
+    """Заблокировать резервы покупателя и вернуть {(product_id, size_id): количество}"""
+    return {
+        (product_id, size_id): quantity
+        for product_id, size_id, quantity in StockReservation.objects
+        .select_for_update(of=('self',))
+        .filter(key=key)
+        .order_by('id')
+        .values_list('product_size__product_id', 'product_size__size_id', 'quantity')
+    }
+
+
+def reserve_cart(session, lines):
+    """
+    Зарезервировать позиции корзины на STOCK_RESERVATION_SECONDS.
+
+    Прежний резерв того же покупателя учитывается: совпадает с корзиной - только
+    продлевается, иначе остатки списываются или возвращаются на разницу одним
+    условным UPDATE (orders.reserve_stock). При нехватке - InsufficientStock,
+    прежний резерв остается как был. Возвращает время окончания резерва.
+    """
+    key = reservation_key(session)
+    quantities = _quantities(lines)
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_SECONDS)
+
+    with transaction.atomic():
+        held = _held(key)
+        if held == quantities:
+            StockReservation.objects.filter(key=key).update(expires_at=expires_at)
+            return expires_at
+
+        product_sizes = reserve_stock(quantities, held)
+        StockReservation.objects.filter(key=key).delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(key=key, product_size=product_sizes[item], quantity=quantity, expires_at=expires_at)
+            for item, quantity in quantities.items()
+        ])
+    return expires_at
+
+
+def release(session):
+    """Вернуть на склад резерв покупателя (оформление не удалось)"""
+    key = session.get(SESSION_KEY)
+    if key is None:
+        return
+    with transaction.atomic():
+        held = _held(key)
+        if held:
+            reserve_stock({}, held)
+            StockReservation.objects.filter(key=key).delete()
+
+
+def place_reserved_order(session, lines, **order_fields):
+    """
+    Создать заказ из корзины, засчитав резерв покупателя: зарезервированные
+    единицы уже списаны, со склада берется только разница с корзиной. Если резерв
+    истек и его забрал release_expired, остатки проверяются и списываются заново.
+    """
+    key = session.get(SESSION_KEY)
+    with transaction.atomic():
+        held = _held(key) if key else {}
+        order = place_order(lines, held=held, **order_fields)
+        if held:
+            StockReservation.objects.filter(key=key).delete()
+    session.pop(SESSION_KEY, None)
+    return order
+
+
+def release_expired(batch_size=500):
+    """
+    Вернуть на склад одну пачку истекших резервов. Возвращает число снятых резервов.
+
+    Резервы берутся через SKIP LOCKED: резерв, который сейчас превращается в
+    заказ, пропускается. Строки ProductSize блокируются в порядке id, как в
+    orders.reserve_stock, поэтому очистка не ловит deadlock с оформлением заказов.
+    """
+    with transaction.atomic():
+        expired = list(
+            StockReservation.objects
+            .select_for_update(skip_locked=True)
+            .filter(expires_at__lte=timezone.now())
+            .order_by('expires_at', 'id')
+            .values_list('id', 'product_size_id', 'quantity')[:batch_size]
+        )
+        if not expired:
+            return 0
+
+        quantities = {}
+        for _, product_size_id, quantity in expired:
+            quantities[product_size_id] = quantities.get(product_size_id, 0) + quantity
+        list(ProductSize.objects.select_for_update().filter(id__in=quantities).order_by('id').values_list('id'))
+        ProductSize.objects.filter(id__in=quantities).update(
+            stock=Case(*(When(id=pk, then=F('stock') + quantity) for pk, quantity in quantities.items()))
+        )
+        StockReservation.objects.filter(id__in=[reservation_id for reservation_id, _, _ in expired]).delete()
+    return len(expired)
@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+
+
+# Статусы, в которых единицы заказа считаются проданными (сводки по товарам и категориям)
+SOLD_STATUSES = frozenset({'paid', 'processing', 'shipped', 'delivered'})
+
+ROLLUP_MODELS = (DailySales, DailyProductSales, DailyCategorySales)
+
+
+def _increment(model, key_fields, value_fields, rows):
+    """
+    Прибавить значения к строкам сводки одним
+    INSERT ... ON CONFLICT (ключ) DO UPDATE SET v = v + EXCLUDED.v.
+    rows - {ключ (tuple): [значения]}. Строки идут в порядке ключа, поэтому
+    параллельные заказы блокируют общие строки в одном порядке и не ловят deadlock.
+    """
+    rows = {key: values for key, values in rows.items() if any(values)}
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    keys = [quote(model._meta.get_field(name).column) for name in key_fields]
+    values = [quote(model._meta.get_field(name).column) for name in value_fields]
+
+    row_sql = '(' + ', '.join(['%s'] * (len(keys) + len(values))) + ')'
+    sql = (
+        f'INSERT INTO {table} ({", ".join(keys + values)}) '
+        f'VALUES {", ".join([row_sql] * len(rows))} '
+        f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET '
+        + ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in values)
+    )
+    params = []
+    for key in sorted(rows):
+        params.extend(key)
+        params.extend(rows[key])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _item_rows(order, items):
+    """(product_id, size_id, category_id, price, quantity) позиций заказа"""
+    if items is not None:
+        return [
+            (item.product_id, item.size_id, item.product.category_id, item.price, item.quantity)
+            for item in items
+        ]
+    return list(order.items.values_list('product_id', 'size_id', 'product__category_id', 'price', 'quantity'))
+
+
+def record_order(order, old_status=None, items=None):
+    """
+    Учесть заказ в сводках в той же транзакции, что и его изменение.
+    old_status=None - новый заказ; иначе заказ переходит из old_status
+    в order.status (возврат, отмена, смена статуса в админке).
+    items - уже загруженные OrderItem с product, чтобы не читать их заново.
+    """
+    new_status = order.status
+    if old_status == new_status:
+        return
+    day = timezone.localdate(order.created_at)
+
+    sales = {(day, new_status): [1, order.total_amount]}
+    if old_status is not None:
+        sales[(day, old_status)] = [-1, -order.total_amount]
+    _increment(DailySales, ['date', 'status'], ['orders', 'revenue'], sales)
+
+    sign = (new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES)
+    if not sign:
+        return
+    products = {}
+    categories = {}
+    for product_id, size_id, category_id, price, quantity in _item_rows(order, items):
+        for rows, key in ((products, (day, product_id, size_id)), (categories, (day, category_id))):
+            row = rows.setdefault(key, [0, 0])
+            row[0] += sign * quantity
+            row[1] += sign * price * quantity
+    _increment(DailyProductSales, ['date', 'product', 'size'], ['units', 'revenue'], products)
+    _increment(DailyCategorySales, ['date', 'category'], ['units', 'revenue'], categories)
+
+
+def _day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), tz),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz),
+    )
+
+
+def rebuild(start, end):
+    """
+    Пересчитать сводки за дни start..end (включительно) из Order/OrderItem.
+    Идемпотентно: строки окна удаляются и вставляются заново.
+
+    Таблицы сводок блокируются (SHARE ROW EXCLUSIVE) до конца транзакции:
+    заказ, который успел обновить сводку, к этому моменту закоммичен и попадет
+    в пересчет, а остальные подождут и прибавятся к уже пересчитанным строкам.
+    """
+    since, until = _day_bounds(start, end)
+    orders = Order.objects.filter(created_at__gte=since, created_at__lt=until)
+    items = OrderItem.objects.filter(
+        order__created_at__gte=since, order__created_at__lt=until, order__status__in=SOLD_STATUSES,
+    ).annotate(date=TruncDate('order__created_at'))
+    item_totals = {'units': Sum('quantity'), 'revenue': Sum(F('price') * F('quantity'))}
+
+    with transaction.atomic():
+        connection = connections[router.db_for_write(DailySales)]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                    ', '.join(connection.ops.quote_name(model._meta.db_table) for model in ROLLUP_MODELS)
+                ))
+        for model in ROLLUP_MODELS:
+            model.objects.filter(date__gte=start, date__lte=end).delete()
+
+        DailySales.objects.bulk_create(
+            DailySales(**row) for row in orders.annotate(date=TruncDate('created_at'))
+            .values('date', 'status').annotate(orders=Count('id'), revenue=Sum('total_amount')).order_by()
+        )
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(**row) for row in items
+            .values('date', 'product_id', 'size_id').annotate(**item_totals).order_by()
+        )
+        DailyCategorySales.objects.bulk_create(
+            DailyCategorySales(date=row['date'], category_id=row['product__category_id'],
+                               units=row['units'], revenue=row['revenue'])
+            for row in items.values('date', 'product__category_id').annotate(**item_totals).order_by()
+        )
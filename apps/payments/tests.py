@@ -1,3 +1,804 @@
-from django.test import TestCase
+import csv
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.main.models import Category, Product, ProductSize, Size
+from . import gateway, intents, reservations
+from . import rollups
+from .models import (
+    DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, StockReservation, WebhookEvent,
+)
+from .orders import InsufficientStock, place_order, restore_stock
+from .webhooks import RETRY_POLICY, handle_refund, process_pending
+
+
+ORDER_FIELDS = {
+    'email': 'buyer@example.com',
+    'first_name': 'Test',
+    'last_name': 'Buyer',
+    'phone': '+10000000000',
+    'address_line1': 'Main st. 1',
+    'city': 'City',
+    'postal_code': '00000',
+    'country': 'Country',
+    'total_amount': Decimal('100.00'),
+    'status': 'paid',
+}
+
+
+def create_stock(stocks):
+    """Товар с размерами и остатками: {'S': 5, 'M': 0} -> (product, {'S': ProductSize, ...})"""
+    category = Category.objects.create(name='Outerwear')
+    product = Product.objects.create(
+        name='Coat', slug='coat', price=Decimal('50.00'), color='black', category=category,
+    )
+    product_sizes = {
+        name: ProductSize.objects.create(product=product, size=Size.objects.create(name=name), stock=stock)
+        for name, stock in stocks.items()
+    }
+    return product, product_sizes
+
+
+def line(product, product_size, quantity):
+    return {
+        'product': product,
+        'size_id': str(product_size.size_id),
+        'price': product.price,
+        'quantity': quantity,
+    }
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.product, self.sizes = create_stock({'S': 5, 'M': 2})
+
+    def test_places_order_and_decrements_stock(self):
+        lines = [line(self.product, self.sizes['S'], 3), line(self.product, self.sizes['M'], 2)]
+
+        # блокировка, списание, заказ, позиции, три сводки продаж (+ savepoint)
+        with self.assertNumQueries(9):
+            order = place_order(lines, **ORDER_FIELDS)
+
+        self.assertEqual(order.items.count(), 2)
+        self.sizes['S'].refresh_from_db()
+        self.sizes['M'].refresh_from_db()
+        self.assertEqual(self.sizes['S'].stock, 2)
+        self.assertEqual(self.sizes['M'].stock, 0)
+
+    def test_short_stock_changes_nothing(self):
+        lines = [line(self.product, self.sizes['S'], 1), line(self.product, self.sizes['M'], 3)]
+
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(lines, **ORDER_FIELDS)
+
+        self.assertEqual(raised.exception.shortages, [(self.product.id, self.sizes['M'].size_id, 3, 2)])
+        self.assertFalse(Order.objects.exists())
+        self.sizes['S'].refresh_from_db()
+        self.assertEqual(self.sizes['S'].stock, 5)
+
+    def test_restore_stock(self):
+        order = place_order([line(self.product, self.sizes['S'], 4)], **ORDER_FIELDS)
+
+        restore_stock(order)
+
+        self.sizes['S'].refresh_from_db()
+        self.assertEqual(self.sizes['S'].stock, 5)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Row locking needs PostgreSQL')
+class PlaceOrderConcurrencyTests(TransactionTestCase):
+    """Параллельные покупатели не должны продать больше, чем есть на складе"""
+
+    buyers = 12
+    stock = 5
+
+    def test_concurrent_orders_do_not_oversell(self):
+        product, sizes = create_stock({'S': self.stock, 'M': self.stock})
+        barrier = threading.Barrier(self.buyers)
+        results = []
+
+        def buy(index):
+            # Половина покупателей кладет размеры в корзину в обратном порядке:
+            # блокировки все равно берутся по id, взаимоблокировки быть не должно
+            lines = [line(product, sizes['S'], 1), line(product, sizes['M'], 1)]
+            if index % 2:
+                lines.reverse()
+            try:
+                barrier.wait()
+                place_order(lines, **ORDER_FIELDS)
+                results.append('placed')
+            except InsufficientStock:
+                results.append('short')
+            except Exception as e:
+                results.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(index,)) for index in range(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('placed'), self.stock, results)
+        self.assertEqual(results.count('short'), self.buyers - self.stock, results)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(OrderItem.objects.count(), self.stock * 2)
+        for product_size in sizes.values():
+            product_size.refresh_from_db()
+            self.assertEqual(product_size.stock, 0)
+
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.product, self.sizes = create_stock({'S': 5})
+        self.order = place_order(
+            [line(self.product, self.sizes['S'], 2)], stripe_charge_id='ch_1', **ORDER_FIELDS
+        )
+
+    def post_event(self, event_id, event_type='charge.refunded', obj=None):
+        payload = json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': obj or {'id': 'ch_1', 'object': 'charge'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return self.client.post(
+            reverse('payments:stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_rejects_bad_signature(self):
+        response = self.client.post(
+            reverse('payments:stripe_webhook'), '{}', content_type='application/json',
+            HTTP_STRIPE_SIGNATURE='t=1,v1=bad',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_duplicate_delivery_is_applied_once(self):
+        # Вебхук только ставит событие в очередь: один INSERT (+ savepoint ATOMIC_REQUESTS)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.post_event('evt_1').status_code, 200)
+        self.assertEqual(self.post_event('evt_1').status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+        self.assertEqual(process_pending(), (1, 0))
+        self.assertEqual(process_pending(), (0, 0))
+
+        # Второе событие возврата по тому же заказу не возвращает остатки еще раз
+        self.post_event('evt_2')
+        self.assertEqual(process_pending(), (1, 0))
+
+        self.order.refresh_from_db()
+        self.sizes['S'].refresh_from_db()
+        self.assertEqual(self.order.status, 'refunded')
+        self.assertEqual(self.sizes['S'].stock, 5)
+
+    def test_failed_event_is_retried_with_backoff(self):
+        self.post_event('evt_1')
+
+        with mock.patch('apps.payments.webhooks.restore_stock', side_effect=RuntimeError('db down')):
+            self.assertEqual(process_pending(), (0, 1))
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        # Откат savepoint: заказ не остался наполовину обработанным
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+        # До наступления next_attempt_at событие не берется
+        self.assertEqual(process_pending(), (0, 0))
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_pending(), (1, 0))
+        self.sizes['S'].refresh_from_db()
+        self.assertEqual(self.sizes['S'].stock, 5)
+
+    def test_gives_up_after_max_attempts(self):
+        self.post_event('evt_1')
+        WebhookEvent.objects.update(attempts=RETRY_POLICY.max_attempts - 1)
+
+        with mock.patch('apps.payments.webhooks.restore_stock', side_effect=RuntimeError('db down')):
+            self.assertEqual(process_pending(), (0, 1))
+
+        self.assertEqual(WebhookEvent.objects.get().status, 'failed')
+
+    def test_worker_command_drains_queue(self):
+        self.post_event('evt_1')
+        self.post_event('evt_2', 'payment_intent.succeeded', {'id': 'pi_1', 'object': 'payment_intent'})
+
+        stdout = io.StringIO()
+        # Пачка полная - следующая берется сразу, --once выходит на пустой очереди
+        # Воркер закрывает устаревшие соединения - в TestCase (открытая транзакция) это сама база теста
+        with mock.patch('apps.main.queues.close_old_connections'):
+            call_command('process_webhooks', once=True, batch_size=1, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), ['Processed 1 webhook events, 0 failed'] * 2)
+        self.assertFalse(WebhookEvent.objects.filter(status='pending').exists())
+
+
+def rollup_rows():
+    return (
+        list(DailySales.objects.values_list('date', 'status', 'orders', 'revenue')),
+        list(DailyProductSales.objects.values_list('date', 'product', 'size', 'units', 'revenue')),
+        list(DailyCategorySales.objects.values_list('date', 'category', 'units', 'revenue')),
+    )
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.product, self.sizes = create_stock({'S': 50, 'M': 50})
+        self.today = timezone.localdate()
+
+    def place(self, size, quantity, **fields):
+        return place_order([line(self.product, self.sizes[size], quantity)], **{**ORDER_FIELDS, **fields})
+
+    def test_orders_and_refunds_update_rollups(self):
+        self.place('S', 2)
+        order = self.place('M', 1, total_amount=Decimal('60.00'), stripe_charge_id='ch_1')
+
+        self.assertEqual(
+            list(DailySales.objects.values_list('status', 'orders', 'revenue')),
+            [('paid', 2, Decimal('160.00'))],
+        )
+        self.assertEqual(
+            list(DailyCategorySales.objects.values_list('category', 'units', 'revenue')),
+            [(self.product.category_id, 3, Decimal('150.00'))],
+        )
+
+        with transaction.atomic():
+            handle_refund({'id': 'ch_1'})
+
+        self.assertEqual(
+            list(DailySales.objects.values_list('status', 'orders', 'revenue')),
+            [('paid', 1, Decimal('100.00')), ('refunded', 1, Decimal('60.00'))],
+        )
+        self.assertEqual(
+            DailyProductSales.objects.get(size=self.sizes['M']).units, 0,
+        )
+        self.assertEqual(DailyCategorySales.objects.get().units, 2)
+
+    def test_rebuild_matches_incremental_and_is_idempotent(self):
+        self.place('S', 2)
+        self.place('M', 3, stripe_charge_id='ch_1')
+        with transaction.atomic():
+            handle_refund({'id': 'ch_1'})
+        incremental = rollup_rows()
+
+        rollups.rebuild(self.today, self.today)
+
+        # Нулевые строки после возврата пересчет не создает
+        self.assertEqual(rollup_rows(), tuple(
+            [row for row in rows if row[-2]] for rows in incremental
+        ))
+
+    def test_rebuild_window_moves_orders_between_days(self):
+        order = self.place('S', 1)
+        self.place('M', 1)
+        yesterday = self.today - timedelta(days=1)
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=1))
+
+        rollups.rebuild(yesterday, self.today)
+        rebuilt = rollup_rows()
+        rollups.rebuild(yesterday, self.today)
+
+        self.assertEqual(rollup_rows(), rebuilt)
+        self.assertEqual(rebuilt[0], [
+            (yesterday, 'paid', 1, Decimal('100.00')),
+            (self.today, 'paid', 1, Decimal('100.00')),
+        ])
+        self.assertEqual(
+            [(day, size, units) for day, _, size, units, _ in rebuilt[1]],
+            [(yesterday, self.sizes['S'].id, 1), (self.today, self.sizes['M'].id, 1)],
+        )
+
+    def test_report_reads_only_rollups(self):
+        staff = get_user_model()._default_manager.create(
+            email='staff@example.com', first_name='Staff', last_name='User', is_staff=True,
+        )
+        self.client.force_login(staff)
+        self.place('S', 2)
+        self.place('M', 1)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('payments:sales_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Coat')
+        self.assertFalse([query for query in captured if 'payments_order' in query['sql']])
+
+        response = self.client.get(
+            reverse('payments:sales_report_csv', args=['products']),
+            {'start': self.today.isoformat(), 'end': self.today.isoformat()},
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(response.content.decode())))
+        self.assertEqual(rows[0], ['product_id', 'product', 'size', 'units', 'revenue'])
+        self.assertEqual(rows[1], [str(self.product.id), 'Coat', 'S', '2', '100.00'])
+
+        self.assertEqual(self.client.get(reverse('payments:sales_report_csv', args=['nope'])).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('payments:sales_report')).status_code, 302)
+
+
+class StripeStandIn(ThreadingHTTPServer):
+    """
+    Минимальный HTTP-сервер вместо api.stripe.com для тестов: PaymentIntent
+    create/retrieve/update в памяти. delay - задержка ответа (проверка таймаутов).
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StripeStandInHandler)
+        self.intents = {}
+        self.requests = []
+        self.idempotent_responses = {}
+        self.delay = 0
+        self.ids = itertools.count(1)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StripeStandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_intent_request()
+
+    def do_POST(self):
+        self.handle_intent_request()
+
+    def handle_intent_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        idempotency_key = self.headers.get('Idempotency-Key')
+        self.server.requests.append((self.command, self.path, params, idempotency_key))
+        time.sleep(self.server.delay)
+
+        # Как у Stripe: повтор POST с тем же ключом получает сохраненный ответ,
+        # а тот же ключ с другими параметрами - idempotency_error
+        if self.command == 'POST' and idempotency_key in self.server.idempotent_responses:
+            first_params, status, body = self.server.idempotent_responses[idempotency_key]
+            if first_params != params:
+                return self.respond(400, {'error': {
+                    'type': 'idempotency_error',
+                    'message': 'Keys for idempotent requests can only be used with the same parameters',
+                }})
+            return self.respond(status, body)
+        if self.command == 'POST' and idempotency_key:
+            self.respond = self.remembering_respond(idempotency_key, params)
+
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[:2] != ['v1', 'payment_intents']:
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+
+        if len(parts) == 2 and self.command == 'POST':
+            intent_id = f'pi_standin_{next(self.server.ids)}'
+            intent = self.server.intents[intent_id] = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': int(params['amount']),
+                'currency': params['currency'],
+                'status': 'requires_payment_method',
+                'client_secret': f'{intent_id}_secret_standin',
+                'metadata': {
+                    key[len('metadata['):-1]: value for key, value in params.items() if key.startswith('metadata[')
+                },
+            }
+            return self.respond(200, intent)
+
+        intent = self.server.intents.get(parts[2]) if len(parts) == 3 else None
+        if intent is None:
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'No such payment_intent'}})
+        if self.command == 'POST':
+            if intent['status'] in ('succeeded', 'canceled'):
+                return self.respond(400, {'error': {
+                    'type': 'invalid_request_error',
+                    'code': 'payment_intent_unexpected_state',
+                    'message': f'This PaymentIntent has a status of {intent["status"]}',
+                }})
+            if 'amount' in params:
+                intent['amount'] = int(params['amount'])
+        return self.respond(200, intent)
+
+    def remembering_respond(self, idempotency_key, params):
+        respond = self.respond
+
+        def remembering(status, body):
+            self.server.idempotent_responses[idempotency_key] = (params, status, json.loads(json.dumps(body)))
+            respond(status, body)
+
+        return remembering
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент уже отвалился по таймауту
+            pass
+
+
+class StripeStandInMixin:
+    """Направить apps.payments.gateway на StripeStandIn на время теста"""
+
+    def setUp(self):
+        super().setUp()
+        self.stripe_server = StripeStandIn().__enter__()
+        self.addCleanup(self.stripe_server.__exit__, None, None, None)
+        stripe_settings = override_settings(
+            STRIPE_API_BASE=self.stripe_server.url,
+            STRIPE_SECRET_KEY='sk_test_standin',
+            STRIPE_TIMEOUT=0.5,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+        )
+        stripe_settings.enable()
+        self.addCleanup(gateway.configure)
+        self.addCleanup(stripe_settings.disable)
+        gateway.configure()
+
+        self.product, self.sizes = create_stock({'S': 5})
+
+    def fill_cart(self, client, quantity=2):
+        return client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'size_id': self.sizes['S'].size_id, 'quantity': quantity},
+        )
+
+    def checkout_form(self):
+        return {key: ORDER_FIELDS[key] for key in (
+            'email', 'first_name', 'last_name', 'phone', 'address_line1', 'city', 'postal_code', 'country',
+        )}
+
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        admin_user = get_user_model()._default_manager.create(
+            email='admin@example.com', first_name='Admin', last_name='User', is_staff=True, is_superuser=True,
+        )
+        self.client.force_login(admin_user)
+        self.product, self.sizes = create_stock({'S': 50, 'M': 50})
+
+    def create_orders(self, count):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(**ORDER_FIELDS, shipping_cost=Decimal('15.00'), tax_amount=Decimal('5.00'))
+            for size in self.sizes.values():
+                OrderItem.objects.create(order=order, product=self.product, size=size, price=Decimal('10.00'), quantity=2)
+            orders.append(order)
+        return orders
+
+    def count_queries(self, url):
+        # Первый запрос сессии пишет ее в базу - меряем второй
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured), response
+
+    def test_changelist_queries_do_not_grow_with_orders(self):
+        self.create_orders(2)
+        few, _ = self.count_queries(reverse('admin:payments_order_changelist'))
+        self.create_orders(8)
+        many, response = self.count_queries(reverse('admin:payments_order_changelist'))
+
+        self.assertEqual(few, many)
+        # 40 за позиции + 15 доставка + 5 налог
+        self.assertContains(response, '$60.00', count=10)
+
+    def test_change_view_queries_do_not_grow_with_items(self):
+        order, other = self.create_orders(2)
+        for _ in range(5):
+            OrderItem.objects.create(order=other, product=self.product, size=self.sizes['S'], price=Decimal('1.00'))
+
+        few, _ = self.count_queries(reverse('admin:payments_order_change', args=[order.id]))
+        many, response = self.count_queries(reverse('admin:payments_order_change', args=[other.id]))
+
+        self.assertEqual(few, many)
+        self.assertContains(response, '$65.00')
+
+    def test_item_changelist_and_filters(self):
+        order, _ = self.create_orders(2)
+        few, _ = self.count_queries(reverse('admin:payments_orderitem_changelist'))
+        self.create_orders(3)
+        many, _ = self.count_queries(reverse('admin:payments_orderitem_changelist'))
+        self.assertEqual(few, many)
+
+        response = self.client.get(reverse('admin:payments_orderitem_changelist'), {'q': f'#{order.id}'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get(reverse('admin:payments_order_changelist'), {'q': str(order.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [order])
+        response = self.client.get(reverse('admin:payments_order_changelist'), {'status__exact': 'shipped'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+
+class PaymentFlowTests(StripeStandInMixin, TestCase):
+    def test_checkout_payment_and_order(self):
+        self.fill_cart(self.client)
+
+        response = self.client.post(reverse('payments:checkout'), self.checkout_form())
+        self.assertRedirects(response, reverse('payments:payment'), fetch_redirect_response=False)
+        intent_id = self.client.session['payment_intent_id']
+        self.assertEqual(self.stripe_server.intents[intent_id]['amount'], 12650)
+
+        response = self.client.get(reverse('payments:payment'))
+        self.assertContains(response, f'{intent_id}_secret_standin')
+
+        # Пока платеж не прошел, заказ не создается
+        response = self.client.post(reverse('payments:payment_success'))
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+        self.stripe_server.intents[intent_id]['status'] = 'succeeded'
+        response = self.client.post(reverse('payments:payment_success'))
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse('payments:order_confirmation', args=[order.id]), fetch_redirect_response=False,
+        )
+        self.assertEqual(order.stripe_payment_intent_id, intent_id)
+        self.sizes['S'].refresh_from_db()
+        self.assertEqual(self.sizes['S'].stock, 3)
+        # Гость видит подтверждение своего заказа
+        self.assertEqual(self.client.get(response['Location']).status_code, 200)
+
+    def test_stripe_timeout_shows_error(self):
+        self.fill_cart(self.client)
+        self.stripe_server.delay = 1
+
+        response = self.client.post(reverse('payments:checkout'), self.checkout_form())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Payment processing error')
+        self.assertNotIn('payment_intent_id', self.client.session)
+
+    def test_server_timing_includes_stripe(self):
+        self.fill_cart(self.client)
+        self.stripe_server.delay = 0.05
+
+        response = self.client.post(reverse('payments:checkout'), self.checkout_form())
+
+        match = re.search(r'stripe;dur=(\d+\.\d{2})', response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertGreaterEqual(float(match[1]), 50)
+
+    async def test_checkout_under_asgi(self):
+        client = AsyncClient()
+        await client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'size_id': self.sizes['S'].size_id, 'quantity': 1},
+        )
+
+        response = await client.post(reverse('payments:checkout'), self.checkout_form())
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(self.stripe_server.intents), 1)
+
+
+class PaymentIntentReuseTests(StripeStandInMixin, TestCase):
+    def stripe_calls(self):
+        return [(method, path.split('?')[0]) for method, path, _, _ in self.stripe_server.requests]
+
+    def submit_checkout(self):
+        response = self.client.post(reverse('payments:checkout'), self.checkout_form())
+        self.assertRedirects(response, reverse('payments:payment'), fetch_redirect_response=False)
+        return self.client.session['payment_intent_id']
+
+    def test_completed_checkout_makes_two_stripe_calls(self):
+        self.fill_cart(self.client)
+        intent_id = self.submit_checkout()
+        # Повторная отправка и страница оплаты берут intent из сессии
+        self.assertEqual(self.submit_checkout(), intent_id)
+        self.assertContains(self.client.get(reverse('payments:payment')), f'{intent_id}_secret_standin')
+        self.assertContains(self.client.get(reverse('payments:payment')), f'{intent_id}_secret_standin')
+
+        self.stripe_server.intents[intent_id]['status'] = 'succeeded'
+        self.client.post(reverse('payments:payment_success'))
+
+        self.assertTrue(Order.objects.filter(stripe_payment_intent_id=intent_id).exists())
+        self.assertEqual(self.stripe_calls(), [
+            ('POST', '/v1/payment_intents'),
+            ('GET', f'/v1/payment_intents/{intent_id}'),
+        ])
+        self.assertNotIn(intents.SESSION_KEY, self.client.session)
+        self.assertNotIn(intents.ATTEMPT_KEY, self.client.session)
+
+    def test_changed_cart_modifies_the_same_intent(self):
+        self.fill_cart(self.client, quantity=1)
+        intent_id = self.submit_checkout()
+        self.fill_cart(self.client, quantity=1)
+
+        self.assertEqual(self.submit_checkout(), intent_id)
+
+        self.assertEqual(self.stripe_calls(), [
+            ('POST', '/v1/payment_intents'),
+            ('POST', f'/v1/payment_intents/{intent_id}'),
+        ])
+        self.assertEqual(self.stripe_server.intents[intent_id]['amount'], 12650)
+        self.assertEqual(self.stripe_server.requests[1][3], f'pi-{intent_id}-rev1')
+
+    def test_reused_revision_key_moves_to_next_revision(self):
+        self.fill_cart(self.client, quantity=1)
+        intent_id = self.submit_checkout()
+        self.fill_cart(self.client, quantity=1)
+        self.submit_checkout()
+        # Сохранение сессии после modify потерялось: в ней все еще ревизия 0
+        session = self.client.session
+        session[intents.SESSION_KEY] = {**session[intents.SESSION_KEY], 'revision': 0, 'fingerprint': ''}
+        session.save()
+        self.fill_cart(self.client, quantity=1)
+
+        self.assertEqual(self.submit_checkout(), intent_id)
+
+        keys = [key for _, _, _, key in self.stripe_server.requests]
+        self.assertEqual(keys[1:], [f'pi-{intent_id}-rev1', f'pi-{intent_id}-rev1', f'pi-{intent_id}-rev2'])
+        self.assertEqual(self.stripe_server.intents[intent_id]['amount'], 18150)
+        self.assertEqual(self.client.session[intents.SESSION_KEY]['revision'], 2)
+
+    def test_finished_intent_is_replaced(self):
+        self.fill_cart(self.client, quantity=1)
+        intent_id = self.submit_checkout()
+        self.stripe_server.intents[intent_id]['status'] = 'canceled'
+        self.fill_cart(self.client, quantity=1)
+
+        new_intent_id = self.submit_checkout()
+
+        self.assertNotEqual(new_intent_id, intent_id)
+        self.assertEqual(self.stripe_server.intents[new_intent_id]['amount'], 12650)
+
+    def test_create_is_idempotent_within_checkout_attempt(self):
+        self.fill_cart(self.client)
+        self.client.get(reverse('payments:checkout'))
+        intent_id = self.submit_checkout()
+        # Ответ create потерян (например, таймаут после записи в Stripe): в сессии intent нет
+        session = self.client.session
+        del session[intents.SESSION_KEY]
+        session.save()
+
+        self.assertEqual(self.submit_checkout(), intent_id)
+        self.assertEqual(len(self.stripe_server.intents), 1)
+
+
+class StockReservationTests(StripeStandInMixin, TestCase):
+    def submit_checkout(self):
+        return self.client.post(reverse('payments:checkout'), self.checkout_form())
+
+    def stock(self):
+        self.sizes['S'].refresh_from_db()
+        return self.sizes['S'].stock
+
+    def test_checkout_reserves_stock_until_payment(self):
+        self.fill_cart(self.client)
+        self.submit_checkout()
+
+        reservation = StockReservation.objects.get()
+        self.assertEqual(reservation.quantity, 2)
+        self.assertEqual(self.stock(), 3)
+
+        # Повторная отправка только продлевает резерв
+        expires_at = reservation.expires_at
+        self.submit_checkout()
+        self.assertGreater(StockReservation.objects.get().expires_at, expires_at)
+        self.assertEqual(self.stock(), 3)
+
+        intent_id = self.client.session['payment_intent_id']
+        self.stripe_server.intents[intent_id]['status'] = 'succeeded'
+        self.client.post(reverse('payments:payment_success'))
+
+        # Резерв стал заказом без повторного списания
+        self.assertTrue(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.stock(), 3)
+
+    def test_changed_cart_adjusts_reservation(self):
+        self.fill_cart(self.client, quantity=1)
+        self.submit_checkout()
+        self.fill_cart(self.client, quantity=2)
+        self.submit_checkout()
+
+        self.assertEqual(StockReservation.objects.get().quantity, 3)
+        self.assertEqual(self.stock(), 2)
+
+    def test_out_of_stock_does_not_reach_stripe(self):
+        self.fill_cart(self.client, quantity=2)
+        ProductSize.objects.filter(pk=self.sizes['S'].pk).update(stock=1)
+
+        response = self.submit_checkout()
+
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertEqual(self.stripe_server.requests, [])
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.stock(), 1)
+
+    def test_stripe_error_releases_reservation(self):
+        self.fill_cart(self.client)
+        self.stripe_server.delay = 1
+
+        self.submit_checkout()
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+    def test_expired_reservation_is_released(self):
+        self.fill_cart(self.client)
+        self.submit_checkout()
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+        # Оплата после истечения резерва списывает остатки заново
+        intent_id = self.client.session['payment_intent_id']
+        self.stripe_server.intents[intent_id]['status'] = 'succeeded'
+        self.client.post(reverse('payments:payment_success'))
+        self.assertTrue(Order.objects.exists())
+        self.assertEqual(self.stock(), 3)
+
+    def test_active_reservation_is_kept(self):
+        self.fill_cart(self.client)
+        self.submit_checkout()
+
+        self.assertEqual(reservations.release_expired(), 0)
+        self.assertEqual(self.stock(), 3)
+
+
+class StripeOutsideTransactionTests(StripeStandInMixin, TransactionTestCase):
+    def test_stripe_calls_do_not_hold_a_transaction(self):
+        in_transaction = []
+        create = gateway.create_payment_intent
+
+        def spy(*args, **kwargs):
+            in_transaction.append(connection.in_atomic_block)
+            return create(*args, **kwargs)
+
+        self.fill_cart(self.client)
+        with mock.patch.object(gateway, 'create_payment_intent', spy), \
+                mock.patch.object(gateway, 'acreate_payment_intent', gateway._in_executor(spy)):
+            response = self.client.post(reverse('payments:checkout'), self.checkout_form())
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(in_transaction, [False])
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import (
-    checkout, payment, payment_success, order_confirmation, stripe_webhook
+    checkout, payment, payment_success, order_confirmation, stripe_webhook,
+    sales_report, sales_report_csv,
 )
 
 app_name = 'payments'
@@ -12,6 +13,10 @@ urlpatterns = [
     path('payment/success/', payment_success, name='payment_success'),
     path('order/<int:order_id>/confirmation/', order_confirmation, name='order_confirmation'),
 
+    # Staff reports (read from the daily sales rollups)
+    path('reports/sales/', sales_report, name='sales_report'),
+    path('reports/sales/<slug:report>.csv', sales_report_csv, name='sales_report_csv'),
+
     # Stripe webhook
     path('webhook/stripe/', stripe_webhook, name='stripe_webhook'),
 ]
\ No newline at end of file
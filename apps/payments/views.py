@@ -2,20 +2,27 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib import messages
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from asgiref.sync import sync_to_async
 from decimal import Decimal
 import stripe
+import csv
 import json
 import logging
 
 from apps.cart.cart import Cart
-from .forms import CheckoutForm
-from .models import Order, OrderItem
-from apps.main.models import ProductSize
+from apps.main.renditions import attach_renditions
+from . import gateway, intents, reservations
+from . import reports
+from .forms import CheckoutForm, SalesReportForm
+from .models import Order
+from .orders import InsufficientStock
+from .webhooks import enqueue_event
 
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
 def calculate_shipping(cart_total):
@@ -30,55 +37,26 @@ def calculate_tax(subtotal, shipping):
     return (subtotal + shipping) * Decimal('0.10')
 
 
-@require_http_methods(["GET", "POST"])
-def checkout(request):
-    """Checkout page with form"""
-    cart = Cart(request)
-
-    if not cart:
-        messages.warning(request, 'Your cart is empty')
-        return redirect('cart:cart_detail')
-
-    # Calculate costs
+def _order_amounts(cart):
     subtotal = cart.get_total_price()
     shipping_cost = calculate_shipping(subtotal)
     tax_amount = calculate_tax(subtotal, shipping_cost)
-    total = subtotal + shipping_cost + tax_amount
-
-    if request.method == 'POST':
-        form = CheckoutForm(request.POST)
+    return {
+        'subtotal': subtotal,
+        'shipping_cost': shipping_cost,
+        'tax_amount': tax_amount,
+        'total': subtotal + shipping_cost + tax_amount,
+    }
 
-        if form.is_valid():
-            try:
-                # Create Stripe PaymentIntent
-                intent = stripe.PaymentIntent.create(
-                    amount=int(total * 100),  # Convert to cents
-                    currency=settings.STRIPE_CURRENCY,
-                    metadata={
-                        'email': form.cleaned_data['email'],
-                        'user_id': request.user.id if request.user.is_authenticated else None,
-                    }
-                )
-
-                # Store form data in session
-                request.session['checkout_data'] = form.cleaned_data
-                request.session['payment_intent_id'] = intent.id
-                request.session['order_amounts'] = {
-                    'subtotal': str(subtotal),
-                    'shipping': str(shipping_cost),
-                    'tax': str(tax_amount),
-                    'total': str(total)
-                }
 
-                return redirect('payments:payment')
+def _checkout_form(request):
+    """Форма checkout и контекст страницы; None - если корзина пуста"""
+    cart = Cart(request)
+    if not cart:
+        return None
 
-            except stripe.error.StripeError as e:
-                logger.error(f'Stripe error: {str(e)}')
-                messages.error(request, 'Payment processing error. Please try again.')
-        else:
-            for field, errors in form.errors.items():
-                for error in errors:
-                    messages.error(request, f'{error}')
+    if request.method == 'POST':
+        form = CheckoutForm(request.POST)
     else:
         # Pre-fill form for authenticated users
         initial_data = {}
@@ -94,120 +72,202 @@ def checkout(request):
                 'postal_code': request.user.postal_code or '',
                 'country': request.user.country or '',
             }
-
         form = CheckoutForm(initial=initial_data)
+        # Попытка оформления заводится до отправки формы - одновременные
+        # повторные POST получат один ключ идемпотентности
+        intents.checkout_attempt(request.session)
 
-    context = {
+    return {
         'form': form,
         'cart': cart,
-        'subtotal': subtotal,
-        'shipping_cost': shipping_cost,
-        'tax_amount': tax_amount,
-        'total': total,
+        'user_id': request.user.id if request.user.is_authenticated else None,
+        **_order_amounts(cart),
     }
 
+
+def _intent_request(context):
+    """Сумма, metadata и отпечаток корзины для PaymentIntent"""
+    amount = int(context['total'] * 100)  # Convert to cents
+    metadata = {
+        'email': context['form'].cleaned_data['email'],
+        'user_id': context['user_id'],
+    }
+    return {
+        'fingerprint': intents.cart_fingerprint(context['cart'], amount, metadata),
+        'amount': amount,
+        'metadata': metadata,
+    }
+
+
+def _save_checkout(request, context, intent):
+    # Store form data in session
+    request.session['checkout_data'] = context['form'].cleaned_data
+    request.session['payment_intent_id'] = intent['id']
+    request.session['order_amounts'] = {
+        'subtotal': str(context['subtotal']),
+        'shipping': str(context['shipping_cost']),
+        'tax': str(context['tax_amount']),
+        'total': str(context['total'])
+    }
+
+
+def _pending_checkout(request):
+    """Данные оформленного, но еще не оплаченного заказа из сессии"""
+    if 'checkout_data' not in request.session:
+        return None
+    return {
+        'checkout_data': request.session.get('checkout_data'),
+        'order_amounts': request.session.get('order_amounts'),
+        'payment_intent_id': request.session.get('payment_intent_id'),
+        'intent': intents.stored_intent(request.session),
+    }
+
+
+def _create_order(request, pending):
+    """
+    Создать заказ (своя короткая транзакция) и очистить корзину. Резерв,
+    сделанный на checkout, засчитывается - остатки списываются только на разницу.
+    """
+    cart = Cart(request)
+    checkout_data = pending['checkout_data']
+    order_amounts = pending['order_amounts']
+
+    # Create order, its items and reduce stock (all or nothing)
+    order = reservations.place_reserved_order(
+        request.session,
+        cart,
+        user=request.user if request.user.is_authenticated else None,
+        email=checkout_data['email'],
+        first_name=checkout_data['first_name'],
+        last_name=checkout_data['last_name'],
+        phone=checkout_data['phone'],
+        address_line1=checkout_data['address_line1'],
+        address_line2=checkout_data.get('address_line2', ''),
+        city=checkout_data['city'],
+        postal_code=checkout_data['postal_code'],
+        country=checkout_data['country'],
+        customer_notes=checkout_data.get('customer_notes', ''),
+        total_amount=Decimal(order_amounts['total']),
+        shipping_cost=Decimal(order_amounts['shipping']),
+        tax_amount=Decimal(order_amounts['tax']),
+        stripe_payment_intent_id=pending['payment_intent_id'],
+        status='paid'
+    )
+
+    # Clear cart and session
+    cart.clear()
+    del request.session['checkout_data']
+    del request.session['order_amounts']
+    del request.session['payment_intent_id']
+    intents.forget_intent(request.session)
+    if not request.user.is_authenticated:
+        # order_confirmation показывает гостю только его заказ
+        request.session['guest_order_email'] = order.email
+    return order
+
+
+def _render_checkout(request, context):
+    attach_renditions(item['product'].main_image for item in context['cart'])
     return render(request, 'payments/checkout.html', context)
 
 
+# Вызовы Stripe идут по сети и могут длиться секунды, поэтому views оплаты
+# асинхронные и без ATOMIC_REQUESTS: во время ожидания Stripe не держится ни
+# транзакция, ни поток воркера. Транзакции открываются только в reservations.
+
+@transaction.non_atomic_requests
+@require_http_methods(["GET", "POST"])
+async def checkout(request):
+    """Checkout page with form"""
+    context = await sync_to_async(_checkout_form)(request)
+    if context is None:
+        messages.warning(request, 'Your cart is empty')
+        return redirect('cart:cart_detail')
+
+    form = context['form']
+    if request.method == 'POST':
+        if form.is_valid():
+            try:
+                # Остатки резервируются до обращения к Stripe: товара, которого
+                # нет, не оплатить. Резерв держится STOCK_RESERVATION_SECONDS
+                await sync_to_async(reservations.reserve_cart)(request.session, context['cart'])
+            except InsufficientStock as e:
+                logger.info(f'Checkout rejected, out of stock: {e}')
+                messages.error(request, 'Some items in your cart are no longer in stock. Please update your cart.')
+                return redirect('cart:cart_detail')
+
+            try:
+                # Stripe PaymentIntent: повторная отправка той же корзины
+                # не создает новый intent, измененная - обновляет существующий
+                intent = await intents.aprepare_intent(request.session, **_intent_request(context))
+            except stripe.error.StripeError as e:
+                logger.error(f'Stripe error: {str(e)}')
+                await sync_to_async(reservations.release)(request.session)
+                messages.error(request, 'Payment processing error. Please try again.')
+            else:
+                await sync_to_async(_save_checkout)(request, context, intent)
+                return redirect('payments:payment')
+        else:
+            for field, errors in form.errors.items():
+                for error in errors:
+                    messages.error(request, f'{error}')
+
+    return await sync_to_async(_render_checkout)(request, context)
+
+
+@transaction.non_atomic_requests
 @require_http_methods(["GET"])
-def payment(request):
+async def payment(request):
     """Payment page with Stripe Elements"""
-    if 'checkout_data' not in request.session:
+    pending = await sync_to_async(_pending_checkout)(request)
+    if pending is None:
         messages.warning(request, 'Please complete checkout first')
-        return redirect('cart:checkout')
-
-    cart = Cart(request)
-    checkout_data = request.session.get('checkout_data')
-    order_amounts = request.session.get('order_amounts')
-    payment_intent_id = request.session.get('payment_intent_id')
+        return redirect('payments:checkout')
 
-    # Get client secret
-    try:
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        client_secret = intent.client_secret
-    except stripe.error.StripeError as e:
-        logger.error(f'Stripe error retrieving intent: {str(e)}')
+    # client_secret сохранен при создании intent - Stripe здесь не нужен
+    intent = pending['intent']
+    if intent is None or intent['id'] != pending['payment_intent_id']:
         messages.error(request, 'Payment session expired. Please try again.')
         return redirect('payments:checkout')
+    client_secret = intent['client_secret']
 
     context = {
-        'cart': cart,
-        'checkout_data': checkout_data,
-        'order_amounts': order_amounts,
+        'cart': Cart(request),
+        'checkout_data': pending['checkout_data'],
+        'order_amounts': pending['order_amounts'],
         'client_secret': client_secret,
         'stripe_public_key': settings.STRIPE_PUBLIC_KEY,
     }
 
-    return render(request, 'payments/payment.html', context)
+    return await sync_to_async(render)(request, 'payments/payment.html', context)
 
 
+@transaction.non_atomic_requests
 @require_POST
-def payment_success(request):
+async def payment_success(request):
     """Handle successful payment"""
-    if 'checkout_data' not in request.session:
+    pending = await sync_to_async(_pending_checkout)(request)
+    if pending is None:
         return redirect('main:main_page')
+    payment_intent_id = pending['payment_intent_id']
 
     try:
-        cart = Cart(request)
-        checkout_data = request.session.get('checkout_data')
-        order_amounts = request.session.get('order_amounts')
-        payment_intent_id = request.session.get('payment_intent_id')
-
         # Verify payment with Stripe
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        intent = await gateway.aretrieve_payment_intent(payment_intent_id)
 
         if intent.status != 'succeeded':
             raise Exception('Payment not successful')
 
-        # Create order
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            email=checkout_data['email'],
-            first_name=checkout_data['first_name'],
-            last_name=checkout_data['last_name'],
-            phone=checkout_data['phone'],
-            address_line1=checkout_data['address_line1'],
-            address_line2=checkout_data.get('address_line2', ''),
-            city=checkout_data['city'],
-            postal_code=checkout_data['postal_code'],
-            country=checkout_data['country'],
-            customer_notes=checkout_data.get('customer_notes', ''),
-            total_amount=Decimal(order_amounts['total']),
-            shipping_cost=Decimal(order_amounts['shipping']),
-            tax_amount=Decimal(order_amounts['tax']),
-            stripe_payment_intent_id=payment_intent_id,
-            status='paid'
-        )
-
-        # Create order items and reduce stock
-        for item in cart:
-            # Получаем правильный ProductSize объект
-            product_size = ProductSize.objects.get(
-                product=item['product'],
-                size=item['size']
-            )
-
-            OrderItem.objects.create(
-                order=order,
-                product=item['product'],
-                size=product_size,  # ← Теперь передаем ProductSize, а не Size
-                price=item['price'],
-                quantity=item['quantity']
-            )
-
-            # Reduce stock
-            product_size.stock -= item['quantity']
-            product_size.save()
-
-        # Clear cart and session
-        cart.clear()
-        del request.session['checkout_data']
-        del request.session['order_amounts']
-        del request.session['payment_intent_id']
+        order = await sync_to_async(_create_order)(request, pending)
 
         messages.success(request, f'Order #{order.id} placed successfully!')
         return redirect('payments:order_confirmation', order_id=order.id)
 
+    except InsufficientStock as e:
+        logger.error(f'Order not placed for payment intent {payment_intent_id}, out of stock: {e}')
+        messages.error(request, 'Some items in your cart are no longer in stock. Please contact support.')
+        return redirect('cart:cart_detail')
+
     except Exception as e:
         logger.error(f'Order creation error: {str(e)}')
         messages.error(request, 'Error processing order. Please contact support.')
@@ -236,6 +296,39 @@ def order_confirmation(request, order_id):
     return render(request, 'payments/order_confirmation.html', context)
 
 
+@staff_member_required
+def sales_report(request):
+    """Отчет о продажах за период - только из сводок apps.payments.rollups"""
+    form = SalesReportForm(request.GET)
+    context = {'form': form}
+    if form.is_valid():
+        start, end = form.cleaned_data['start'], form.cleaned_data['end']
+        context.update({
+            'start': start,
+            'end': end,
+            'days': reports.daily_sales(start, end),
+            'statuses': reports.status_totals(start, end),
+            'products': reports.top_products(start, end),
+            'categories': reports.category_sales(start, end),
+        })
+    return render(request, 'payments/sales_report.html', context)
+
+
+@staff_member_required
+def sales_report_csv(request, report):
+    """CSV-выгрузка отчета о продажах: daily, products или categories"""
+    rows = reports.CSV_REPORTS.get(report)
+    form = SalesReportForm(request.GET)
+    if rows is None or not form.is_valid():
+        return HttpResponse('Unknown report or invalid period', status=400)
+
+    start, end = form.cleaned_data['start'], form.cleaned_data['end']
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="sales-{report}-{start}-{end}.csv"'
+    csv.writer(response).writerows(rows(start, end))
+    return response
+
+
 @csrf_exempt
 @require_POST
 def stripe_webhook(request):
@@ -254,62 +347,7 @@ def stripe_webhook(request):
         logger.error('Invalid webhook signature')
         return HttpResponse(status=400)
 
-    # Handle different event types
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        handle_payment_success(payment_intent)
-
-    elif event['type'] == 'payment_intent.payment_failed':
-        payment_intent = event['data']['object']
-        handle_payment_failure(payment_intent)
-
-    elif event['type'] == 'charge.refunded':
-        charge = event['data']['object']
-        handle_refund(charge)
+    # Обработка - в воркере (manage.py process_webhooks), здесь только очередь
+    enqueue_event(json.loads(payload))
 
     return HttpResponse(status=200)
-
-
-def handle_payment_success(payment_intent):
-    """Handle successful payment webhook"""
-    try:
-        order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        order.status = 'paid'
-        order.stripe_charge_id = payment_intent.get('latest_charge', '')
-        order.save()
-        logger.info(f'Order {order.id} marked as paid')
-    except Order.DoesNotExist:
-        logger.warning(f'Order not found for payment intent {payment_intent["id"]}')
-
-
-def handle_payment_failure(payment_intent):
-    """Handle failed payment webhook"""
-    try:
-        order = Order.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        order.status = 'cancelled'
-        order.admin_notes = f"Payment failed: {payment_intent.get('last_payment_error', {}).get('message', 'Unknown error')}"
-        order.save()
-        logger.info(f'Order {order.id} marked as cancelled due to payment failure')
-    except Order.DoesNotExist:
-        logger.warning(f'Order not found for failed payment intent {payment_intent["id"]}')
-
-
-def handle_refund(charge):
-    """Handle refund webhook"""
-    try:
-        order = Order.objects.get(stripe_charge_id=charge['id'])
-        order.status = 'refunded'
-        order.save()
-
-        # Restore stock
-        for item in order.items.all():
-            product_size = ProductSize.objects.get(
-                product=item.product,
-                size=item.size
-            )
-            product_size.stock += item.quantity
-            product_size.save()
-
-        logger.info(f'Order {order.id} refunded and stock restored')
-    except Order.DoesNotExist:
-        logger.warning(f'Order not found for charge {charge["id"]}')
\ No newline at end of file
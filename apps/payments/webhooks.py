@@ -0,0 +1,140 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.main.queues import RetryPolicy
+
+from . import rollups
+from .models import Order, WebhookEvent
+from .orders import restore_stock
+
+logger = logging.getLogger(__name__)
+
+
+# 8 попыток с паузой 30с, 1м, 2м, 4м ... но не больше часа
+RETRY_POLICY = RetryPolicy(max_attempts=8)
+
+
+def enqueue_event(payload):
+    """
+    Сохранить событие Stripe (уже проверенное, как dict из тела запроса) в очередь.
+    Один INSERT ... ON CONFLICT DO NOTHING: повторная доставка того же
+    события ничего не добавляет.
+    """
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=payload['id'], type=payload['type'], payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def handle_payment_success(payment_intent):
+    """Handle successful payment webhook"""
+    try:
+        order = Order.objects.select_for_update().get(stripe_payment_intent_id=payment_intent['id'])
+        old_status = order.status
+        order.status = 'paid'
+        order.stripe_charge_id = payment_intent.get('latest_charge', '') or ''
+        order.save()
+        rollups.record_order(order, old_status)
+        logger.info(f'Order {order.id} marked as paid')
+    except Order.DoesNotExist:
+        logger.warning(f'Order not found for payment intent {payment_intent["id"]}')
+
+
+def handle_payment_failure(payment_intent):
+    """Handle failed payment webhook"""
+    try:
+        order = Order.objects.select_for_update().get(stripe_payment_intent_id=payment_intent['id'])
+        old_status = order.status
+        order.status = 'cancelled'
+        order.admin_notes = f"Payment failed: {(payment_intent.get('last_payment_error') or {}).get('message', 'Unknown error')}"
+        order.save()
+        rollups.record_order(order, old_status)
+        logger.info(f'Order {order.id} marked as cancelled due to payment failure')
+    except Order.DoesNotExist:
+        logger.warning(f'Order not found for failed payment intent {payment_intent["id"]}')
+
+
+def handle_refund(charge):
+    """Handle refund webhook"""
+    try:
+        order = Order.objects.select_for_update().get(stripe_charge_id=charge['id'])
+    except Order.DoesNotExist:
+        logger.warning(f'Order not found for charge {charge["id"]}')
+        return
+
+    if order.status == 'refunded':
+        # Другое событие возврата по тому же заказу уже вернуло остатки
+        logger.info(f'Order {order.id} already refunded')
+        return
+
+    old_status = order.status
+    order.status = 'refunded'
+    order.save()
+    rollups.record_order(order, old_status)
+
+    # Restore stock
+    restore_stock(order)
+    logger.info(f'Order {order.id} refunded and stock restored')
+
+
+HANDLERS = {
+    'payment_intent.succeeded': handle_payment_success,
+    'payment_intent.payment_failed': handle_payment_failure,
+    'charge.refunded': handle_refund,
+}
+
+
+def process_event(event):
+    """
+    Применить одно событие. Вызывается внутри транзакции, в которой событие
+    заблокировано: изменения заказа и отметка processed фиксируются вместе,
+    поэтому событие не может примениться дважды.
+    """
+    handler = HANDLERS.get(event.type)
+    if handler is not None:
+        handler(event.payload['data']['object'])
+
+
+def process_pending(batch_size=100):
+    """
+    Обработать одну пачку событий из очереди. Возвращает (обработано, с ошибкой).
+
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет запускать несколько воркеров:
+    каждый берет свои события. Ошибка одного события откатывает только его
+    (savepoint), остальные в пачке обрабатываются.
+    """
+    processed = failed = 0
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    process_event(event)
+            except Exception as e:
+                failed += 1
+                event.last_error = f'{type(e).__name__}: {e}'
+                if RETRY_POLICY.exhausted(event.attempts):
+                    event.status = 'failed'
+                    logger.error(f'Webhook event {event.event_id} failed permanently: {event.last_error}')
+                else:
+                    event.next_attempt_at = timezone.now() + RETRY_POLICY.delay(event.attempts)
+                    logger.warning(f'Webhook event {event.event_id} failed, attempt {event.attempts}: {event.last_error}')
+            else:
+                processed += 1
+                event.status = 'processed'
+                event.processed_at = timezone.now()
+                event.last_error = ''
+
+        if events:
+            WebhookEvent.objects.bulk_update(
+                events, ['status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at']
+            )
+    return processed, failed